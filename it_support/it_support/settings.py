@@ -137,11 +137,32 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# REST API is read-only and for staff dashboards
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAdminUser',
+    ],
+}
+
 # Users
 AUTH_USER_MODEL = 'user_app.User'
 
 TELEGRAM_ACCESS_TOKEN = env.str('TELEGRAM_ACCESS_TOKEN')
 
+# Orders creds encryption (Fernet keys), old keys are only used to decrypt until rotate_creds_key is run
+CREDS_ENCRYPTION_KEY = env.str('CREDS_ENCRYPTION_KEY')
+CREDS_ENCRYPTION_OLD_KEYS = env.list('CREDS_ENCRYPTION_OLD_KEYS', [])
+
+# Per chat flood protection, role -> (updates per second, burst), overrides tgbot_app.throttling.DEFAULT_THROTTLE_RATES
+BOT_THROTTLE_RATES = {}
+
+# Local SQLite file with drafts of conversations (order task being created, order being taken), see tgbot_app.drafts
+BOT_DRAFTS_DB = env.str('BOT_DRAFTS_DB', str(BASE_DIR / 'bot_drafts.sqlite3'))
+
 
 LOGGING = {
     'version': 1,
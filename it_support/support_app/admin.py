@@ -1,43 +1,211 @@
-from django.contrib import admin
+from typing import Optional
 
+from django import forms
+from django.contrib import admin
+from django.contrib import messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.paginator import Paginator
+from django.db import DatabaseError
+from django.db import connections
+from django.db.transaction import atomic
+from django.utils.functional import cached_property
+
+from tgbot_app.models import OutboxMessage
 from . import models as m
 
 
+# ниже этой оценки строки считаются точно, COUNT(*) по небольшой таблице дешевый
+EXACT_COUNT_LIMIT = 10000
+
+
+def estimate_table_rows(queryset) -> Optional[int]:
+    """
+    Число строк таблицы по статистике БД, None если статистики нет.
+
+    Статистику собирает ANALYZE (в PostgreSQL autovacuum), в SQLite ее нет до первого ANALYZE
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+            elif connection.vendor == 'sqlite':
+                # первое число stat - строки индекса, у частичных индексов их меньше, чем в таблице
+                cursor.execute('SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        # sqlite_stat1 создается первым ANALYZE
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(row[0])
+    # reltuples = -1 у таблицы, которую еще не анализировали
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which takes unfiltered list size from database statistics instead of COUNT(*) over the whole table.
+
+    Small or not analyzed tables are counted exactly. The estimate is as fresh as the last ANALYZE,
+    pages past the real end are empty
+    """
+
+    @cached_property
+    def count(self):
+        if self.object_list.query.where:
+            return super().count
+        estimate = estimate_table_rows(self.object_list)
+        if estimate is None or estimate < EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
+
+
+class BotUserAdmin(admin.ModelAdmin):
+    list_display = ('tg_nick', 'status', 'telegram_id', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('^tg_nick',)
+    ordering = ('tg_nick',)
+
+
 @admin.register(m.Client)
-class ClientAdmin(admin.ModelAdmin):
-    pass
+class ClientAdmin(BotUserAdmin):
+    list_display = ('tg_nick', 'status', 'tariff', 'paid', 'telegram_id', 'created_at')
+    list_filter = ('status', 'paid', 'tariff')
+    # tariffs come from the process tariff table, no join needed
+    list_select_related = ()
 
 
 @admin.register(m.Contractor)
-class ContractorAdmin(admin.ModelAdmin):
+class ContractorAdmin(BotUserAdmin):
     pass
 
 
 @admin.register(m.Manager)
-class ManagerAdmin(admin.ModelAdmin):
+class ManagerAdmin(BotUserAdmin):
     pass
 
 
 @admin.register(m.Owner)
-class OwnerAdmin(admin.ModelAdmin):
+class OwnerAdmin(BotUserAdmin):
     pass
 
 
 @admin.register(m.Tariff)
 class TariffAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('name', 'orders_limit', 'reaction_time_minutes', 'price')
+
+
+class OrderActionForm(ActionForm):
+    contractor_id = forms.IntegerField(label='id подрядчика (для передачи заказа)', required=False)
+
+
+class BaseOrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'client', 'contractor', 'created_at', 'assigned_at', 'closed_at')
+    list_select_related = ('client', 'contractor')
+    list_filter = ('status',)
+    search_fields = ('=client__tg_nick', '=contractor__tg_nick')
+    date_hierarchy = 'created_at'
+    autocomplete_fields = ('client', 'contractor')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
 
 @admin.register(m.Order)
-class OrderAdmin(admin.ModelAdmin):
-    pass
+class OrderAdmin(BaseOrderAdmin):
+    list_display = BaseOrderAdmin.list_display + ('reaction_deadline',)
+    action_form = OrderActionForm
+    actions = ('cancel_orders', 'release_orders', 'reassign_orders')
+    exclude = ('creds',)
+    search_help_text = 'Ник клиента или подрядчика, иначе слова из задания'
+
+    def get_search_results(self, request, queryset, search_term):
+        """Если по нику ничего нет - полнотекстовый поиск по заданию, самые подходящие первыми"""
+        by_nick_queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if not search_term.strip() or by_nick_queryset.exists():
+            return by_nick_queryset, may_have_duplicates
+        return queryset.search_task(search_term), False
+
+    @admin.action(description='Отменить выбранные заказы')
+    def cancel_orders(self, request, queryset):
+        cancelled_count = queryset.cancel()
+        self.message_user(request, f'Отменено заказов: {cancelled_count}')
+
+    @admin.action(description='Освободить выбранные заказы от подрядчиков')
+    def release_orders(self, request, queryset):
+        released_count = queryset.release()
+        self.message_user(request, f'Освобождено заказов: {released_count}')
+
+    @admin.action(description='Передать выбранный заказ подрядчику')
+    def reassign_orders(self, request, queryset):
+        try:
+            contractor = m.Contractor.objects.active().get(pk=request.POST.get('contractor_id'))
+        except (m.Contractor.DoesNotExist, ValueError):
+            self.message_user(request, 'Укажите id активного подрядчика', messages.ERROR)
+            return
+        orders = list(queryset.select_related('client', 'contractor')[:2])
+        if len(orders) != 1:
+            # у подрядчика может быть только один заказ в работе
+            self.message_user(request, 'Выберите один заказ', messages.ERROR)
+            return
+        order = orders[0]
+        previous_contractor = order.contractor if order.status == m.Order.Status.in_work else None
+        # сообщения пишутся в outbox в одной транзакции с заказом, бот отправит их
+        with atomic():
+            if not order.reassign(contractor):
+                self.message_user(
+                    request,
+                    'Заказ уже закрыт или отменен, или у подрядчика уже есть заказ в работе',
+                    messages.ERROR,
+                )
+                return
+            self.notify_reassigned(order, contractor, previous_contractor)
+        self.message_user(request, f'Заказ {order.pk} передан подрядчику {contractor}')
+
+    @staticmethod
+    def notify_reassigned(order, contractor, previous_contractor) -> None:
+        """
+        Сообщения сторонам заказа как при взятии заказа в боте.
+
+        Доступы в outbox не пишутся, там текст хранится открытым, подрядчик запрашивает их у клиента
+        """
+        if previous_contractor is None:
+            OutboxMessage.objects.enqueue(
+                [order.client.telegram_id],
+                'Ваш заказ взят работу! При выполнении пришлем уведомление.',
+            )
+        else:
+            OutboxMessage.objects.enqueue(
+                [order.client.telegram_id],
+                'Ваш заказ передан другому подрядчику. При выполнении пришлем уведомление.',
+            )
+            OutboxMessage.objects.enqueue(
+                [previous_contractor.telegram_id],
+                f'Менеджер передал заказ {order.pk} другому подрядчику, теперь вы можете брать новый заказ',
+            )
+        OutboxMessage.objects.enqueue(
+            [contractor.telegram_id],
+            f'Менеджер передал вам заказ в работу\n\nЗадание:\n{order.task}\n\n'
+            f'Доступы к сайту запросите у заказчика кнопкой "Написать заказчику"',
+        )
+
+
+@admin.register(m.ArchivedOrder)
+class ArchivedOrderAdmin(BaseOrderAdmin):
+    date_hierarchy = 'closed_at'
 
 
 @admin.register(m.AssignedContractor)
 class AssignedContractorAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('client', 'contractor')
+    list_select_related = ('client', 'contractor')
+    autocomplete_fields = ('client', 'contractor')
+    search_fields = ('=client__tg_nick', '=contractor__tg_nick')
 
 
 @admin.register(m.SystemSettings)
 class SystemSettingsAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('parameter_name', 'parameter_value')
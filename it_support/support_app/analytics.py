@@ -0,0 +1,171 @@
+from datetime import datetime
+from itertools import islice
+from typing import Optional
+
+import numpy as np
+
+from .models import ArchivedOrder
+from .models import Contractor
+from .models import Order
+from .models import get_billing_calendar
+
+# колонки закрытых заказов, которые нужны аналитике
+ORDER_COLUMNS = ('contractor_id', 'assigned_at', 'closed_at', 'estimated_hours')
+ORDERS_CHUNK_SIZE = 10000
+
+
+class ClosedOrdersArrays:
+    """Закрытые заказы в виде колонок NumPy, время - секунды от начала эпохи"""
+
+    def __init__(
+            self,
+            contractor_ids: np.ndarray,
+            assigned_at: np.ndarray,
+            closed_at: np.ndarray,
+            estimated_hours: np.ndarray,
+    ):
+        self.contractor_ids = contractor_ids
+        self.assigned_at = assigned_at
+        self.closed_at = closed_at
+        # nan если подрядчик не оценивал заказ
+        self.estimated_hours = estimated_hours
+
+    def __len__(self):
+        return len(self.contractor_ids)
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple]):
+        return cls(
+            np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((row[1].timestamp() for row in rows), dtype=np.float64, count=len(rows)),
+            np.fromiter((row[2].timestamp() for row in rows), dtype=np.float64, count=len(rows)),
+            np.fromiter((row[3] or np.nan for row in rows), dtype=np.float64, count=len(rows)),
+        )
+
+    @classmethod
+    def concatenate(cls, parts: list['ClosedOrdersArrays']):
+        return cls(
+            np.concatenate([part.contractor_ids for part in parts] or [np.empty(0, dtype=np.int64)]),
+            np.concatenate([part.assigned_at for part in parts] or [np.empty(0)]),
+            np.concatenate([part.closed_at for part in parts] or [np.empty(0)]),
+            np.concatenate([part.estimated_hours for part in parts] or [np.empty(0)]),
+        )
+
+
+def load_closed_orders(since: Optional[datetime] = None) -> ClosedOrdersArrays:
+    """
+    Загрузить закрытые заказы (вместе с архивом) одним проходом по каждой таблице.
+
+    Строки переводятся в колонки пачками по ORDERS_CHUNK_SIZE, в памяти не бывает
+    списка кортежей всех заказов, только колонки NumPy
+    """
+    parts = []
+    for model in [Order, ArchivedOrder]:
+        orders = model.objects.filter(
+            status=Order.Status.closed,
+            contractor__isnull=False,
+            assigned_at__isnull=False,
+        )
+        if since is not None:
+            orders = orders.filter(closed_at__gt=since)
+        rows = orders.values_list(*ORDER_COLUMNS).iterator(chunk_size=ORDERS_CHUNK_SIZE)
+        while True:
+            chunk = list(islice(rows, ORDERS_CHUNK_SIZE))
+            if not chunk:
+                break
+            parts.append(ClosedOrdersArrays.from_rows(chunk))
+    return ClosedOrdersArrays.concatenate(parts)
+
+
+def calculate_group_quantiles(groups: np.ndarray, values: np.ndarray, groups_count: int, quantile: float) -> np.ndarray:
+    """
+    Квантиль values внутри каждой группы (линейная интерполяция, как np.quantile).
+
+    Одна сортировка по (группа, значение) вместо цикла по группам, nan для пустых групп
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=groups_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    result = np.full(groups_count, np.nan)
+    has_values = counts > 0
+    positions = (counts[has_values] - 1) * quantile
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    group_starts = starts[has_values]
+    lower_values = sorted_values[group_starts + lower]
+    upper_values = sorted_values[group_starts + upper]
+    result[has_values] = lower_values + (upper_values - lower_values) * (positions - lower)
+    return result
+
+
+def get_billing_starts(billing_periods: int) -> list[datetime]:
+    """Начала последних billing_periods биллингов, от старого к текущему"""
+    billing_calendar = get_billing_calendar()
+    nearest_billing_start_date = billing_calendar.get_period_start()
+    return [
+        billing_calendar.shift(nearest_billing_start_date, -months_ago)
+        for months_ago in range(billing_periods - 1, -1, -1)
+    ]
+
+
+def calculate_contractors_performance(
+        billing_periods: int = 3,
+        orders: Optional[ClosedOrdersArrays] = None,
+) -> tuple[list[datetime], list[dict]]:
+    """
+    Посчитать по каждому подрядчику время выполнения (медиана и p90 в часах),
+    ошибку оценки и число закрытых заказов в последних billing_periods биллингах.
+
+    Ошибка оценки - средняя |факт - оценка| / оценка, смещение - средняя (факт - оценка) / оценка,
+    положительное смещение значит что подрядчик недооценивает заказы.
+    Возвращает начала биллингов и строки отчета, отсортированные по числу заказов
+    """
+    if orders is None:
+        orders = load_closed_orders()
+    billing_starts = get_billing_starts(billing_periods)
+    if not len(orders):
+        return billing_starts, []
+
+    contractor_ids, groups = np.unique(orders.contractor_ids, return_inverse=True)
+    groups_count = len(contractor_ids)
+    close_hours = (orders.closed_at - orders.assigned_at) / 3600
+    closed_count = np.bincount(groups, minlength=groups_count)
+    median_hours = calculate_group_quantiles(groups, close_hours, groups_count, 0.5)
+    p90_hours = calculate_group_quantiles(groups, close_hours, groups_count, 0.9)
+
+    is_estimated = ~np.isnan(orders.estimated_hours)
+    estimated_hours = orders.estimated_hours[is_estimated]
+    relative_errors = (close_hours[is_estimated] - estimated_hours) / estimated_hours
+    estimated_groups = groups[is_estimated]
+    estimated_count = np.bincount(estimated_groups, minlength=groups_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        estimate_error = np.bincount(estimated_groups, np.abs(relative_errors), minlength=groups_count) / estimated_count
+        estimate_bias = np.bincount(estimated_groups, relative_errors, minlength=groups_count) / estimated_count
+
+    # номер биллинга для каждого заказа, -1 - заказ закрыт раньше первого из них
+    billing_bounds = np.array([billing_start.timestamp() for billing_start in billing_starts])
+    periods = np.searchsorted(billing_bounds, orders.closed_at, side='left') - 1
+    in_periods = periods >= 0
+    throughput = np.bincount(
+        groups[in_periods] * billing_periods + periods[in_periods],
+        minlength=groups_count * billing_periods,
+    ).reshape(groups_count, billing_periods)
+
+    tg_nicks = dict(Contractor.objects.filter(pk__in=contractor_ids.tolist()).values_list('pk', 'tg_nick'))
+    performance = [
+        {
+            'contractor': tg_nicks.get(contractor_id, str(contractor_id)),
+            'closed_orders': int(closed_count[group]),
+            'median_hours': round(float(median_hours[group]), 2),
+            'p90_hours': round(float(p90_hours[group]), 2),
+            'estimated_orders': int(estimated_count[group]),
+            'estimate_error': None if np.isnan(estimate_error[group]) else round(float(estimate_error[group]), 3),
+            'estimate_bias': None if np.isnan(estimate_bias[group]) else round(float(estimate_bias[group]), 3),
+            'throughput': throughput[group].tolist(),
+        }
+        for group, contractor_id in enumerate(contractor_ids.tolist())
+    ]
+    performance.sort(key=lambda contractor_performance: -contractor_performance['closed_orders'])
+    return billing_starts, performance
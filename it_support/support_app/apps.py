@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SupportAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'support_app'
+
+    def ready(self):
+        from . import checks  # noqa: F401
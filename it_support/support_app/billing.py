@@ -0,0 +1,62 @@
+import calendar
+from bisect import bisect_right
+from datetime import datetime
+from typing import Optional
+
+from django.utils import timezone
+
+# границы биллингов считаются заранее на столько месяцев назад и вперед
+MONTHS_BACK = 10 * 12
+MONTHS_AHEAD = 2 * 12
+
+
+class BillingCalendar:
+    """
+    Начала биллингов по дню биллинга, посчитанные заранее на диапазон месяцев.
+
+    Если в месяце нет дня биллинга (29-31), биллинг начинается в последний день месяца,
+    т.е. при дне 31 биллинги начинаются 31.01, 28.02, 31.03 и т.д.
+    Поиск биллинга для момента времени - бинарный поиск по списку начал
+    """
+
+    def __init__(self, billing_day: int, now: Optional[datetime] = None):
+        self.billing_day = min(max(billing_day, 1), 31)
+        now = timezone.localtime(now)
+        first_month = now.year * 12 + now.month - 1 - MONTHS_BACK
+        self.starts = [
+            self.calculate_start(month // 12, month % 12 + 1)
+            for month in range(first_month, first_month + MONTHS_BACK + MONTHS_AHEAD + 1)
+        ]
+        self.timestamps = [start.timestamp() for start in self.starts]
+
+    def calculate_start(self, year: int, month: int) -> datetime:
+        """Начало биллинга в месяце"""
+        return timezone.make_aware(
+            datetime(year=year, month=month, day=min(self.billing_day, calendar.monthrange(year, month)[1]))
+        )
+
+    def covers(self, moment: datetime) -> bool:
+        """Есть ли в календаре биллинг момента и следующий за ним"""
+        return self.timestamps[0] <= moment.timestamp() < self.timestamps[-1]
+
+    def get_period_start(self, moment: Optional[datetime] = None) -> datetime:
+        """Начало биллинга, в котором находится момент (по умолчанию - текущего)"""
+        moment = moment or timezone.now()
+        if self.covers(moment):
+            return self.starts[bisect_right(self.timestamps, moment.timestamp()) - 1]
+        # вне посчитанного диапазона (очень старые данные) считаем напрямую
+        local_moment = timezone.localtime(moment)
+        period_start = self.calculate_start(local_moment.year, local_moment.month)
+        if period_start > moment:
+            return self.shift(period_start, -1)
+        return period_start
+
+    def shift(self, period_start: datetime, periods: int) -> datetime:
+        """Начало биллинга через periods биллингов от биллинга period_start (назад если periods < 0)"""
+        if self.covers(period_start):
+            index = bisect_right(self.timestamps, period_start.timestamp()) - 1 + periods
+            if 0 <= index < len(self.starts):
+                return self.starts[index]
+        local_period_start = timezone.localtime(self.get_period_start(period_start))
+        month = local_period_start.year * 12 + local_period_start.month - 1 + periods
+        return self.calculate_start(month // 12, month % 12 + 1)
@@ -0,0 +1,46 @@
+from django.core.checks import Tags
+from django.core.checks import Warning
+from django.core.checks import register
+from django.db import connections
+
+from .models import ORDER_TASK_FTS_TABLE
+from .models import Order
+
+ORDER_TASK_FTS_TRIGGERS = [f'{ORDER_TASK_FTS_TABLE}_{event}' for event in ('insert', 'delete', 'update')]
+
+
+@register(Tags.database)
+def check_order_task_fts_triggers(app_configs, databases=None, **kwargs):
+    """
+    Проверить, что триггеры полнотекстового индекса заданий на месте.
+
+    Миграции, которые в SQLite пересоздают таблицу заказов, удаляют ее триггеры, после этого
+    поиск молча перестает видеть новые и измененные заказы. Предупреждение, а не ошибка,
+    чтобы migrate мог применить миграцию, которая создаст их заново
+    """
+    warnings = []
+    for alias in databases or []:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT type, name FROM sqlite_master WHERE name = %s OR (type = 'trigger' AND tbl_name = %s)",
+                [ORDER_TASK_FTS_TABLE, Order._meta.db_table],
+            )
+            names_by_type = {}
+            for object_type, name in cursor.fetchall():
+                names_by_type.setdefault(object_type, set()).add(name)
+        if 'table' not in names_by_type:  # миграция с индексом еще не применена
+            continue
+        missing_triggers = [name for name in ORDER_TASK_FTS_TRIGGERS if name not in names_by_type.get('trigger', set())]
+        if missing_triggers:
+            warnings.append(Warning(
+                f'в БД {alias} нет триггеров полнотекстового индекса заданий: {", ".join(missing_triggers)}',
+                hint=(
+                    'создайте их миграцией, как в 0021_order_task_fts, '
+                    f"и выполните INSERT INTO {ORDER_TASK_FTS_TABLE} ({ORDER_TASK_FTS_TABLE}) VALUES ('rebuild')"
+                ),
+                id='support_app.W001',
+            ))
+    return warnings
@@ -0,0 +1,48 @@
+from functools import lru_cache
+
+from cryptography.fernet import Fernet
+from cryptography.fernet import MultiFernet
+from django.conf import settings
+
+# метка перед токеном Fernet: открытые доступы могут начинаться как угодно, в том числе как токен
+ENCRYPTED_CREDS_PREFIX = 'fernet:'
+
+
+@lru_cache(maxsize=None)
+def get_creds_cipher() -> MultiFernet:
+    """Шифр доступов, ключи читаются из настроек один раз на процесс"""
+    keys = [settings.CREDS_ENCRYPTION_KEY, *settings.CREDS_ENCRYPTION_OLD_KEYS]
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def encrypt_creds(creds: str) -> str:
+    """Зашифровать доступы актуальным ключом (AES-CBC + HMAC)"""
+    if not creds:
+        return creds
+    return ENCRYPTED_CREDS_PREFIX + get_creds_cipher().encrypt(creds.encode()).decode()
+
+
+def is_encrypted(creds: str) -> bool:
+    """Зашифрованы ли доступы, открытые доступы без метки остаются только до миграции 0022"""
+    return creds.startswith(ENCRYPTED_CREDS_PREFIX)
+
+
+def decrypt_creds(token: str) -> str:
+    """
+    Расшифровать доступы любым из настроенных ключей.
+
+    Доступы, сохраненные до появления шифрования, возвращаются как есть. Токен, который не
+    расшифровывается ни одним ключом (ключ удален из CREDS_ENCRYPTION_OLD_KEYS), вызывает InvalidToken
+    """
+    if not token or not is_encrypted(token):
+        return token
+    return get_creds_cipher().decrypt(token[len(ENCRYPTED_CREDS_PREFIX):].encode()).decode()
+
+
+def rotate_creds(token: str) -> str:
+    """Перешифровать доступы актуальным ключом, незашифрованные доступы зашифровать, InvalidToken как в decrypt_creds"""
+    if not token:
+        return token
+    if not is_encrypted(token):
+        return encrypt_creds(token)
+    return ENCRYPTED_CREDS_PREFIX + get_creds_cipher().rotate(token[len(ENCRYPTED_CREDS_PREFIX):].encode()).decode()
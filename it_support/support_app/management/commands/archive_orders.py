@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from support_app.models import Order
+from support_app.models import SystemSettings
+
+
+class Command(BaseCommand):
+    help = "Move old closed and cancelled orders to the archive table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--billing-periods',
+            type=int,
+            default=None,
+            help='archive orders closed before this many billing periods ago '
+                 '(default is ARCHIVE_BILLING_PERIODS system setting or 3)',
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='orders moved in one transaction')
+
+    def handle(self, *args, **options):
+        billing_periods = options['billing_periods']
+        if billing_periods is None:
+            billing_periods = SystemSettings.objects.get_int('ARCHIVE_BILLING_PERIODS', 3)
+        archived_count = Order.objects.archive(billing_periods, options['chunk_size'])
+        self.stdout.write(f'Archived {archived_count} orders')
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from support_app.encryption import decrypt_creds
+from support_app.encryption import encrypt_creds
+from support_app.encryption import get_creds_cipher
+
+
+class Command(BaseCommand):
+    help = "Measure creds encryption and decryption throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10000)
+        parser.add_argument('--size', type=int, default=64, help='creds length in characters')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        creds = ('Логин: Иван\nПароль: qwerty\n' * options['size'])[:options['size']]
+        get_creds_cipher()  # key loading is not a part of per-order latency
+
+        started_at = time.perf_counter()
+        tokens = [encrypt_creds(creds) for _ in range(iterations)]
+        encrypt_seconds = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        for token in tokens:
+            decrypt_creds(token)
+        decrypt_seconds = time.perf_counter() - started_at
+
+        for name, seconds in [('encrypt', encrypt_seconds), ('decrypt', decrypt_seconds)]:
+            self.stdout.write(
+                f'{name}: {iterations / seconds:.0f} ops/s, {seconds / iterations * 10 ** 6:.1f} us/op'
+            )
+        self.stdout.write(f'token length: {len(tokens[0])} chars for {len(creds)} chars of creds')
@@ -0,0 +1,50 @@
+from cryptography.fernet import InvalidToken
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+
+from support_app.encryption import rotate_creds
+from support_app.models import Order
+
+
+class Command(BaseCommand):
+    help = "Re-encrypt orders creds with the actual CREDS_ENCRYPTION_KEY"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='orders updated in one transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        rotated_count = 0
+        failed_order_ids = []
+        # SQLite does not isolate queries of one connection, updates under an open iterator() cursor
+        # can make it skip rows or read rotated ones again, so rows are read by chunks after the last id
+        last_pk = 0
+        while True:
+            orders_with_creds = Order.objects.filter(pk__gt=last_pk).exclude(creds='').order_by('pk')
+            orders_chunk = list(orders_with_creds.values_list('pk', 'creds')[:chunk_size])
+            if not orders_chunk:
+                break
+            chunk = []
+            for order_pk, creds in orders_chunk:
+                try:
+                    chunk.append((order_pk, creds, rotate_creds(creds)))
+                except InvalidToken:
+                    # the key of these creds is not configured, they are left as they are
+                    failed_order_ids.append(order_pk)
+            rotated_count += self.save_chunk(chunk)
+            last_pk = orders_chunk[-1][0]
+        self.stdout.write(f'Re-encrypted creds of {rotated_count} orders')
+        if failed_order_ids:
+            self.stderr.write(
+                f'Creds of {len(failed_order_ids)} orders are encrypted with an unknown key, '
+                f'add it to CREDS_ENCRYPTION_OLD_KEYS and run again: {failed_order_ids[:100]}'
+            )
+
+    def save_chunk(self, chunk: list[tuple[int, str, str]]) -> int:
+        """Save chunk in short transaction, skip orders which creds were changed meanwhile (e.g. closed)"""
+        rotated_count = 0
+        with atomic():
+            for order_pk, old_creds, new_creds in chunk:
+                rotated_count += Order.objects.filter(pk=order_pk, creds=old_creds).update(creds=new_creds)
+        return rotated_count
@@ -0,0 +1,121 @@
+import random
+import statistics
+from datetime import datetime
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from support_app.matching import ContractorStats
+from support_app.matching import plan_inform_wave
+
+
+class SimulatedContractor:
+    def __init__(self, pk: int, rng: random.Random):
+        self.pk = pk
+        self.response_probability = rng.uniform(0.1, 0.9)
+        self.mean_claim_minutes = rng.uniform(2, 40)
+        self.mean_close_hours = rng.uniform(1, 12)
+        self.estimate_error = rng.uniform(0, 1)
+
+
+class Command(BaseCommand):
+    help = "Compare broadcast and ranked waves of new order notifications on synthetic contractors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contractors', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--reaction-minutes', type=int, default=60)
+        parser.add_argument('--top-k', type=int, default=3)
+        parser.add_argument('--wave-percent', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        contractors = [SimulatedContractor(pk, rng) for pk in range(1, options['contractors'] + 1)]
+        reaction_time = timedelta(minutes=options['reaction_minutes'])
+        wave_interval = reaction_time * max(options['wave_percent'], 1) / 100
+        top_k = max(options['top_k'], 1)
+
+        stats = {contractor.pk: ContractorStats() for contractor in contractors}
+        results = {'broadcast': ([], []), 'waves': ([], [])}
+        created_at = timezone.now()
+        for _ in range(options['orders']):
+            created_at += timedelta(hours=1)
+            # both strategies get the same random draws for an order
+            claim_delays = {
+                contractor.pk: timedelta(minutes=rng.expovariate(1 / contractor.mean_claim_minutes))
+                for contractor in contractors
+                if rng.random() < contractor.response_probability
+            }
+            close_hours = {contractor.pk: rng.expovariate(1 / contractor.mean_close_hours) for contractor in contractors}
+
+            claim_times, messages = results['broadcast']
+            claim_times.append(min(claim_delays.values(), default=None))
+            messages.append(len(contractors))
+
+            ranked = sorted(contractors, key=lambda contractor: (-stats[contractor.pk].get_score(created_at), contractor.pk))
+            claimed_by, claim_delay, sent = self.simulate_waves(
+                ranked, claim_delays, created_at, wave_interval, top_k,
+            )
+            claim_times, messages = results['waves']
+            claim_times.append(claim_delay)
+            messages.append(sent)
+            if claimed_by is not None:
+                assigned_at = created_at + claim_delay
+                closed_at = assigned_at + timedelta(hours=close_hours[claimed_by.pk])
+                estimated_hours = max(round(close_hours[claimed_by.pk] * (1 + claimed_by.estimate_error)), 1)
+                stats[claimed_by.pk].add_closed_order(assigned_at, closed_at, estimated_hours)
+
+        for strategy, (claim_times, messages) in results.items():
+            self.write_report(strategy, claim_times, messages, reaction_time)
+
+    @staticmethod
+    def simulate_waves(
+            ranked: list[SimulatedContractor],
+            claim_delays: dict[int, timedelta],
+            created_at: datetime,
+            wave_interval: timedelta,
+            top_k: int,
+    ) -> tuple:
+        """Send waves on schedule until someone claims the order, return claimer, claim delay and messages sent"""
+        informed_at = {}
+        informed_waves = 0
+        is_all_informed = False
+        now = created_at
+        while not is_all_informed:
+            to_inform, informed_waves, is_all_informed = plan_inform_wave(
+                ranked, informed_waves, created_at, wave_interval, top_k, now,
+            )
+            for contractor in to_inform:
+                informed_at[contractor.pk] = now
+            now += wave_interval
+
+        claims = sorted(
+            (informed_at[contractor.pk] + claim_delays[contractor.pk], contractor.pk, contractor)
+            for contractor in ranked
+            if contractor.pk in claim_delays
+        )
+        if not claims:
+            return None, None, len(ranked)
+        claimed_at, _, contractor = claims[0]
+        sent = sum(1 for at in informed_at.values() if at <= claimed_at)
+        return contractor, claimed_at - created_at, sent
+
+    def write_report(self, strategy: str, claim_times: list, messages: list, reaction_time: timedelta):
+        claimed_minutes = [claim_time.total_seconds() / 60 for claim_time in claim_times if claim_time is not None]
+        in_time = sum(1 for minutes in claimed_minutes if minutes <= reaction_time.total_seconds() / 60)
+        self.stdout.write(f'{strategy}:')
+        if len(claimed_minutes) > 1:
+            self.stdout.write(
+                f'  time to claim: median {statistics.median(claimed_minutes):.1f} min, '
+                f'p90 {statistics.quantiles(claimed_minutes, n=10)[-1]:.1f} min, '
+                f'mean {statistics.fmean(claimed_minutes):.1f} min'
+            )
+        self.stdout.write(
+            f'  claimed in reaction time: {in_time / len(claim_times):.1%}, '
+            f'unclaimed: {len(claim_times) - len(claimed_minutes)}'
+        )
+        self.stdout.write(
+            f'  messages per order: {statistics.fmean(messages):.1f}, total {sum(messages)}'
+        )
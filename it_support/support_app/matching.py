@@ -0,0 +1,121 @@
+import statistics
+from collections import deque
+from datetime import datetime
+from datetime import timedelta
+from typing import Iterable
+from typing import Optional
+
+from django.utils import timezone
+
+from .models import Order
+
+# сколько последних заказов подрядчика учитывается в статистике
+STATS_WINDOW = 50
+# на старте статистика собирается только по недавним заказам
+STATS_HISTORY = timedelta(days=90)
+
+
+class ContractorStats:
+    """Скользящая статистика подрядчика"""
+    __slots__ = ('last_activity_at', 'close_hours', 'estimate_errors')
+
+    def __init__(self):
+        self.last_activity_at = None
+        self.close_hours = deque(maxlen=STATS_WINDOW)
+        self.estimate_errors = deque(maxlen=STATS_WINDOW)
+
+    def add_activity(self, activity_at: datetime) -> None:
+        if self.last_activity_at is None or activity_at > self.last_activity_at:
+            self.last_activity_at = activity_at
+
+    def add_closed_order(self, assigned_at: datetime, closed_at: datetime, estimated_hours: Optional[int]) -> None:
+        close_hours = (closed_at - assigned_at).total_seconds() / 3600
+        self.close_hours.append(close_hours)
+        if estimated_hours:
+            self.estimate_errors.append(abs(close_hours - estimated_hours) / estimated_hours)
+        self.add_activity(closed_at)
+
+    def get_score(self, now: datetime) -> float:
+        """Оценка от 0 до 1, у подрядчиков без истории нейтральная, чтобы новички тоже получали заказы"""
+        if self.last_activity_at is None:
+            activity = 0.5
+        else:
+            activity = 1 / (1 + (now - self.last_activity_at).total_seconds() / (24 * 3600))
+        speed = 1 / (1 + statistics.median(self.close_hours) / 8) if self.close_hours else 0.5
+        accuracy = 1 / (1 + statistics.fmean(self.estimate_errors)) if self.estimate_errors else 0.5
+        return 0.4 * activity + 0.3 * speed + 0.3 * accuracy
+
+
+class ContractorRanker:
+    """
+    Ранжирование подрядчиков по недавней активности, скорости выполнения и точности оценок.
+
+    Статистика хранится в памяти процесса и дочитывается из БД инкрементально,
+    по водяным знакам времени взятия и закрытия заказов
+    """
+
+    def __init__(self):
+        self.stats: dict[int, ContractorStats] = {}
+        self.assigned_watermark = None
+        self.closed_watermark = None
+
+    def get_stats(self, contractor_id: int) -> ContractorStats:
+        if contractor_id not in self.stats:
+            self.stats[contractor_id] = ContractorStats()
+        return self.stats[contractor_id]
+
+    def refresh(self) -> None:
+        """Дочитать заказы, взятые и закрытые после прошлого обновления"""
+        history_start = timezone.now() - STATS_HISTORY
+        assigned_orders = Order.objects.filter(
+            contractor__isnull=False,
+            assigned_at__gt=self.assigned_watermark or history_start,
+        ).values_list('contractor_id', 'assigned_at')
+        for contractor_id, assigned_at in assigned_orders:
+            self.get_stats(contractor_id).add_activity(assigned_at)
+            self.assigned_watermark = max(self.assigned_watermark or assigned_at, assigned_at)
+
+        closed_orders = Order.objects.filter(
+            status=Order.Status.closed,
+            closed_at__gt=self.closed_watermark or history_start,
+        ).order_by('closed_at').values_list('contractor_id', 'assigned_at', 'closed_at', 'estimated_hours')
+        for contractor_id, assigned_at, closed_at, estimated_hours in closed_orders:
+            if contractor_id is not None and assigned_at is not None:
+                self.get_stats(contractor_id).add_closed_order(assigned_at, closed_at, estimated_hours)
+            self.closed_watermark = closed_at
+
+    def rank(self, contractors: Iterable, now: Optional[datetime] = None) -> list:
+        """Отсортировать подрядчиков (объекты с pk) от лучшего к худшему"""
+        now = now or timezone.now()
+        return sorted(
+            contractors,
+            key=lambda contractor: (-self.get_stats(contractor.pk).get_score(now), contractor.pk),
+        )
+
+
+def plan_inform_wave(
+        ranked_contractors: list,
+        informed_waves: int,
+        phase_start: datetime,
+        wave_interval: timedelta,
+        top_k: int,
+        now: datetime,
+) -> tuple[list, int, bool]:
+    """
+    Определить, кого из ранжированных подрядчиков пора проинформировать.
+
+    Волна w начинается в phase_start + w * wave_interval, после w волн проинформированы
+    top_k * (2 ** w - 1) лучших подрядчиков, т.е. каждая волна вдвое больше предыдущей.
+    Если задача опоздала, пропущенные волны отправляются сразу. Рейтинг между волнами
+    может измениться, тогда кто-то из подрядчиков может не получить уведомление,
+    но заказ останется в списке "Посмотреть заказы".
+    Возвращает подрядчиков для информирования, число отправленных волн и проинформированы ли все
+    """
+    if now < phase_start:
+        return [], informed_waves, False
+    due_waves = int((now - phase_start) / wave_interval) + 1
+    if due_waves <= informed_waves:
+        return [], informed_waves, top_k * (2 ** informed_waves - 1) >= len(ranked_contractors)
+    informed_count = top_k * (2 ** informed_waves - 1)
+    due_count = top_k * (2 ** due_waves - 1)
+    return ranked_contractors[informed_count:due_count], due_waves, due_count >= len(ranked_contractors)
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.13 on 2026-10-18 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0011_alter_assignedcontractor_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['client', 'status'], name='order_client_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['contractor', 'status'], name='order_contractor_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['client', 'created_at'], name='order_client_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['contractor', 'closed_at'], name='order_contractor_closed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('all_contractors_informed', False), ('status', 'создан')), fields=['created_at'], name='order_not_informed_all_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('not_in_work_manager_informed', False), ('status', 'создан')), fields=['created_at'], name='order_not_in_work_warn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('late_work_manager_informed', False), ('status', 'в работе')), fields=['assigned_at'], name='order_not_closed_warn_idx'),
+        ),
+    ]
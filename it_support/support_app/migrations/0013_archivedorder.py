@@ -0,0 +1,34 @@
+# Generated by Django 4.1.13 on 2026-10-18 22:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0012_order_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('task', models.TextField(verbose_name='задание')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='дата и время создания')),
+                ('assigned_at', models.DateTimeField(blank=True, null=True, verbose_name='дата и время взятия в работу')),
+                ('closed_at', models.DateTimeField(db_index=True, verbose_name='дата и время выполнения')),
+                ('status', models.CharField(choices=[('создан', 'Created'), ('в работе', 'In Work'), ('закрыт', 'Closed'), ('отменен', 'Cancelled')], max_length=30, verbose_name='статус')),
+                ('estimated_hours', models.IntegerField(blank=True, null=True, verbose_name='оцененное время выполнения в часах')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='дата и время переноса в архив')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_orders', to='support_app.client')),
+                ('contractor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_orders', to='support_app.contractor')),
+            ],
+            options={
+                'verbose_name': 'архивный заказ',
+                'verbose_name_plural': 'архивные заказы',
+            },
+        ),
+    ]
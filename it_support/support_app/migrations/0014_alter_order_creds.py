@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0013_archivedorder'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='creds',
+            field=models.TextField(blank=True, verbose_name='доступы к сервису (зашифрованы)'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.13 on 2026-10-18 22:53
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0014_alter_order_creds'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='botuser',
+            name='tg_nick',
+            field=models.CharField(db_index=True, max_length=32, validators=[django.core.validators.MinLengthValidator(5), django.core.validators.RegexValidator('^\\w{5,32}$')], verbose_name='ник в telegram'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-18 23:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0015_botuser_tg_nick_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(
+                auto_now=True,
+                db_index=True,
+                default=django.utils.timezone.now,
+                verbose_name='дата и время изменения',
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0016_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='contractors_inform_wave',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='отправлено волн уведомлений подрядчикам'),
+        ),
+    ]
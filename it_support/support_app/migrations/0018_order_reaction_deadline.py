@@ -0,0 +1,56 @@
+# Generated by Django 4.1.13 on 2026-10-19 00:20
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def fill_reaction_deadline(apps, schema_editor):
+    Order = apps.get_model('support_app', 'Order')
+    Tariff = apps.get_model('support_app', 'Tariff')
+    for tariff in Tariff.objects.all():
+        Order.objects.filter(client__tariff=tariff, reaction_deadline__isnull=True).update(
+            reaction_deadline=models.F('created_at') + timedelta(minutes=tariff.reaction_time_minutes),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0017_order_contractors_inform_wave'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reaction_deadline',
+            field=models.DateTimeField(
+                blank=True,
+                help_text='Время создания плюс время реакции тарифа клиента на момент создания',
+                null=True,
+                verbose_name='крайний срок взятия в работу',
+            ),
+        ),
+        migrations.RunPython(fill_reaction_deadline, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='reaction_deadline',
+            field=models.DateTimeField(
+                blank=True,
+                help_text='Время создания плюс время реакции тарифа клиента на момент создания',
+                verbose_name='крайний срок взятия в работу',
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_not_informed_all_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('all_contractors_informed', False), ('status', 'создан')), fields=['reaction_deadline', 'id'], name='order_not_informed_all_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'создан')), fields=['reaction_deadline', 'id'], name='order_created_deadline_idx'),
+        ),
+    ]
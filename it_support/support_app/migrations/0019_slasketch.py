@@ -0,0 +1,30 @@
+# Generated by Django 4.1.13 on 2026-10-18 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0018_order_reaction_deadline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlaSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='день')),
+                ('metric', models.CharField(choices=[('реакция', 'Reaction'), ('выполнение', 'Resolution')], max_length=30, verbose_name='метрика')),
+                ('sketches', models.JSONField(verbose_name='скетчи по id тарифа')),
+            ],
+            options={
+                'verbose_name': 'скетч SLA',
+                'verbose_name_plural': 'скетчи SLA',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='slasketch',
+            constraint=models.UniqueConstraint(fields=('metric', 'day'), name='sla_sketch_metric_day_unique'),
+        ),
+    ]
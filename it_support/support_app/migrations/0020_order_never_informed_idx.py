@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 23:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0019_slasketch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('assigned_contractors_informed', False), ('contractors_inform_wave', 0)), fields=['updated_at'], name='order_never_informed_idx'),
+        ),
+    ]
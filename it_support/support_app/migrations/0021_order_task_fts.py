@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# индекс с внешним содержимым: FTS5 хранит только индекс, тексты читаются из support_app_order.
+# Миграции, которые в SQLite пересоздают таблицу заказов (например AlterField), удаляют триггеры,
+# после них триггеры нужно создать заново и выполнить 'rebuild'
+CREATE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE support_app_order_task_fts USING fts5(
+        task,
+        content='support_app_order',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER support_app_order_task_fts_insert AFTER INSERT ON support_app_order BEGIN
+        INSERT INTO support_app_order_task_fts (rowid, task) VALUES (new.id, new.task);
+    END
+    """,
+    """
+    CREATE TRIGGER support_app_order_task_fts_delete AFTER DELETE ON support_app_order BEGIN
+        INSERT INTO support_app_order_task_fts (support_app_order_task_fts, rowid, task)
+        VALUES ('delete', old.id, old.task);
+    END
+    """,
+    # save() пишет все колонки, индекс меняется только при изменении текста
+    """
+    CREATE TRIGGER support_app_order_task_fts_update AFTER UPDATE OF task ON support_app_order
+    WHEN old.task IS NOT new.task BEGIN
+        INSERT INTO support_app_order_task_fts (support_app_order_task_fts, rowid, task)
+        VALUES ('delete', old.id, old.task);
+        INSERT INTO support_app_order_task_fts (rowid, task) VALUES (new.id, new.task);
+    END
+    """,
+    "INSERT INTO support_app_order_task_fts (support_app_order_task_fts) VALUES ('rebuild')",
+]
+DROP_FTS_SQL = [
+    'DROP TRIGGER IF EXISTS support_app_order_task_fts_insert',
+    'DROP TRIGGER IF EXISTS support_app_order_task_fts_delete',
+    'DROP TRIGGER IF EXISTS support_app_order_task_fts_update',
+    'DROP TABLE IF EXISTS support_app_order_task_fts',
+]
+
+
+def create_order_task_fts(apps, schema_editor):
+    # FTS5 есть только в SQLite, в других БД search_task ищет подстроку
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_FTS_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_order_task_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_FTS_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0020_order_never_informed_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_order_task_fts, drop_order_task_fts),
+    ]
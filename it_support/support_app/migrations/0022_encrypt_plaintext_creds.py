@@ -0,0 +1,66 @@
+import base64
+import binascii
+
+from cryptography.fernet import Fernet
+from cryptography.fernet import InvalidToken
+from cryptography.fernet import MultiFernet
+from django.conf import settings
+from django.db import migrations
+
+CHUNK_SIZE = 500
+# копия логики support_app.encryption на момент миграции, чтобы ее изменения не меняли миграцию
+ENCRYPTED_CREDS_PREFIX = 'fernet:'
+
+
+def is_fernet_token(value: str) -> bool:
+    """Похоже ли значение на токен Fernet: версия 0x80, время, IV, шифротекст по 16 байт и HMAC"""
+    try:
+        data = base64.b64decode(value.encode(), altchars=b'-_', validate=True)
+    except (ValueError, binascii.Error):
+        return False
+    return data[:1] == b'\x80' and len(data) >= 73 and (len(data) - 57) % 16 == 0
+
+
+def encrypt_plaintext_creds(apps, schema_editor):
+    """
+    Пометить доступы меткой шифрования, открытые доступы зашифровать.
+
+    Без метки хранятся открытые доступы, сохраненные до шифрования, и токены, сохраненные
+    до появления метки. Токен, который расшифровывается одним из ключей или устроен как токен
+    (его ключ уже удален из настроек), получает метку как есть, остальное - открытые доступы,
+    даже если они начинаются как токен
+    """
+    Order = apps.get_model('support_app', 'Order')
+    cipher = MultiFernet([
+        Fernet(key) for key in [settings.CREDS_ENCRYPTION_KEY, *settings.CREDS_ENCRYPTION_OLD_KEYS]
+    ])
+    # SQLite не изолирует запросы одного соединения, поэтому строки читаются пачками по id, а не iterator()
+    last_pk = 0
+    while True:
+        orders_with_creds = Order.objects.filter(pk__gt=last_pk).exclude(creds='').order_by('pk')
+        chunk = list(orders_with_creds.values_list('pk', 'creds')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        for order_pk, creds in chunk:
+            if creds.startswith(ENCRYPTED_CREDS_PREFIX):
+                continue
+            try:
+                cipher.decrypt(creds.encode())
+                is_token = True
+            except InvalidToken:
+                is_token = is_fernet_token(creds)
+            token = creds if is_token else cipher.encrypt(creds.encode()).decode()
+            Order.objects.filter(pk=order_pk, creds=creds).update(creds=ENCRYPTED_CREDS_PREFIX + token)
+        last_pk = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0021_order_task_fts'),
+    ]
+
+    operations = [
+        # расшифровка понимает и помеченные, и открытые доступы, откатывать нечего
+        migrations.RunPython(encrypt_plaintext_creds, migrations.RunPython.noop),
+    ]
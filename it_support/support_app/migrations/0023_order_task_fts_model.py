@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-19 00:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0022_encrypt_plaintext_creds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTaskFts',
+            fields=[
+                ('order', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='task_fts', serialize=False, to='support_app.order')),
+                ('task', models.TextField(verbose_name='задание')),
+            ],
+            options={
+                'db_table': 'support_app_order_task_fts',
+                'managed': False,
+            },
+        ),
+    ]
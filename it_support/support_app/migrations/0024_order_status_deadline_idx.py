@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-19 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support_app', '0023_order_task_fts_model'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_not_informed_all_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_created_deadline_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'reaction_deadline', 'id'], name='order_status_deadline_idx'),
+        ),
+    ]
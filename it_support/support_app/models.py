@@ -1,28 +1,106 @@
+import hashlib
+import heapq
+import re
+import threading
+from collections import defaultdict
+from datetime import date
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+from time import monotonic
+from typing import Iterator
+from typing import Optional
+
 from django.core.validators import MinLengthValidator, RegexValidator, MinValueValidator, MaxValueValidator
+from django.db import connection
 from django.db import models
-from django.db.models import Min, Count
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.db.models import Min, Max, Count
+from django.db.models.expressions import RawSQL
 from django.db.transaction import atomic
 from django.utils import timezone
-from dateutil import relativedelta
+
+from .billing import BillingCalendar
+from .encryption import decrypt_creds
+from .encryption import encrypt_creds
+from .sketches import QuantileSketch
+from .tariffs import TariffForeignKey
+from .tariffs import get_tariff_table
+from .tariffs import reset_tariff_table
+
+
+# полнотекстовый индекс заданий заказов (SQLite FTS5), создается и синхронизируется триггерами в миграции 0021
+ORDER_TASK_FTS_TABLE = 'support_app_order_task_fts'
+SEARCH_WORD_REGEX = re.compile(r'\w+')
+
+# как часто процесс сверяет день биллинга с БД (правки в админке другого процесса)
+BILLING_CALENDAR_CHECK_SECONDS = 60
+billing_calendar_cache = {'calendar': None, 'checked_at': 0.0}
+billing_calendar_lock = threading.Lock()
+names_watermark_cache = {'fingerprint': None, 'changed_at': None}
+names_watermark_lock = threading.Lock()
+
+
+def get_billing_calendar() -> BillingCalendar:
+    """
+    Получить общий для процесса календарь биллингов.
+
+    Календарь пересчитывается только если изменился BILLING_DAY (в этом процессе это
+    ловит сигнал сохранения настройки, в других - сверка раз в минуту) или календарь кончился
+    """
+    with billing_calendar_lock:
+        billing_calendar = billing_calendar_cache['calendar']
+        is_check_time = monotonic() - billing_calendar_cache['checked_at'] > BILLING_CALENDAR_CHECK_SECONDS
+        if billing_calendar is None or is_check_time:
+            billing_day = SystemSettings.objects.get_int('BILLING_DAY', 1)
+            if (
+                billing_calendar is None
+                or billing_calendar.billing_day != min(max(billing_day, 1), 31)
+                or not billing_calendar.covers(timezone.now())
+            ):
+                billing_calendar = BillingCalendar(billing_day)
+                billing_calendar_cache['calendar'] = billing_calendar
+            billing_calendar_cache['checked_at'] = monotonic()
+        return billing_calendar
+
+
+def reset_billing_calendar() -> None:
+    with billing_calendar_lock:
+        billing_calendar_cache['calendar'] = None
 
 
 def get_nearest_billing_start_date() -> timezone.datetime:
     """Получить дату начала текущего биллинга"""
-    try:
-        billing_day = int(SystemSettings.objects.get('BILLING_DAY').parameter_value)
-    except (SystemSettings.DoesNotExist, ValueError):
-        billing_day = 1
-
-    now = timezone.now()
-    billing_date = timezone.datetime(
-        year=now.year,
-        month=now.month,
-        day=billing_day,
-        tzinfo=timezone.get_current_timezone()
-    )
-    if billing_date > now:
-        return billing_date - relativedelta.relativedelta(months=1)
-    return billing_date
+    return get_billing_calendar().get_period_start()
+
+
+def get_names_watermark() -> tuple[str, datetime]:
+    """
+    Получить отпечаток ников пользователей и названий тарифов, которые показываются в отчетах и API, и время его смены.
+
+    Времени изменения у пользователей и тарифов нет (состояние бота сохраняется на каждое сообщение),
+    а правятся они в админке другого процесса, поэтому отпечаток считается при каждом обращении, таблицы небольшие.
+    Время смены - когда процесс впервые увидел отпечаток, оно не раньше настоящего изменения
+    """
+    bot_users = BotUser.objects.order_by('pk').values_list('pk', 'tg_nick')
+    tariffs = Tariff.objects.order_by('pk').values_list('pk', 'name')
+    fingerprint = hashlib.md5(repr((list(bot_users), list(tariffs))).encode()).hexdigest()
+    with names_watermark_lock:
+        if names_watermark_cache['fingerprint'] != fingerprint:
+            names_watermark_cache['fingerprint'] = fingerprint
+            names_watermark_cache['changed_at'] = timezone.now()
+        return fingerprint, names_watermark_cache['changed_at']
+
+
+def merge_orders_counts(key: str, *orders_counts) -> list[dict]:
+    """Сложить количества заказов (count_orders), посчитанные по полю key в нескольких выборках"""
+    counts = defaultdict(int)
+    for order_counts in orders_counts:
+        for order_count in order_counts:
+            counts[order_count[key]] += order_count['count_orders']
+    return [{key: value, 'count_orders': count} for value, count in counts.items()]
 
 
 class BotUserQuerySet(models.QuerySet):
@@ -46,6 +124,7 @@ class BotUser(models.Model):
     tg_nick = models.CharField(
         'ник в telegram',
         max_length=32,
+        db_index=True,
         validators=[MinLengthValidator(5), RegexValidator(REGEX_TELEGRAM_NICKNAME)]
     )
     role = models.CharField('роль', max_length=30, choices=Role.choices)
@@ -100,7 +179,8 @@ class ClientQuerySet(BotUserQuerySet):
 
 
 class Client(BotUser):
-    tariff = models.ForeignKey(Tariff, related_name='clients', on_delete=models.DO_NOTHING)
+    # тариф берется из таблицы тарифов процесса, без запроса в БД
+    tariff = TariffForeignKey(Tariff, related_name='clients', on_delete=models.DO_NOTHING)
     paid = models.BooleanField('оплачен ли тариф', db_index=True)
 
     def can_create_orders(self):
@@ -134,9 +214,12 @@ class Client(BotUser):
 
     def get_contractors(self):
         """Получить список выполнявших работу подрядчиков, которые еще работают"""
+        archived_contractors = self.archived_orders.filter(
+            contractor__status=BotUser.Status.active
+        ).values('contractor__tg_nick')
         return self.orders.select_related('contractor').filter(
             contractor__status=BotUser.Status.active
-        ).values('contractor__tg_nick').distinct()
+        ).values('contractor__tg_nick').union(archived_contractors)
 
     def assign_contractor(self, contractor):
         """Закрепить подрядчика"""
@@ -153,11 +236,19 @@ class Client(BotUser):
 
     def has_closed_orders(self):
         """Есть ли закрытые контракты"""
-        return self.orders.filter(status=Order.Status.closed).exists()
+        return (
+            self.orders.filter(status=Order.Status.closed).exists()
+            or self.archived_orders.filter(status=Order.Status.closed).exists()
+        )
 
     def get_last_closed_order(self):
-        """Получить последний закрытый контракт"""
-        return self.orders.select_related('client').filter(status=Order.Status.closed).latest('closed_at')
+        """Получить последний закрытый контракт (из архива, если в рабочей таблице закрытых нет)"""
+        try:
+            return self.orders.select_related('client').filter(status=Order.Status.closed).latest('closed_at')
+        except Order.DoesNotExist:
+            return self.archived_orders.select_related('client').filter(
+                status=Order.Status.closed
+            ).latest('closed_at')
 
     def get_last_contractor_of_closed_order(self):
         """Получить подрядчика последнего закрытого контракта"""
@@ -181,6 +272,16 @@ class ContractorQuerySet(BotUserQuerySet):
         not_available_contractor_ids = [contractor['contractor'] for contractor in not_available_contractors]
         return self.active().exclude(id__in=not_available_contractor_ids)
 
+    def with_workload(self):
+        """Добавить число заказов в работе и закрытых в текущем биллинге"""
+        return self.annotate(
+            orders_in_work=Count('orders', filter=models.Q(orders__status=Order.Status.in_work)),
+            closed_in_billing=Count(
+                'orders',
+                filter=models.Q(orders__closed_at__gte=get_nearest_billing_start_date()),
+            ),
+        )
+
 
 class Contractor(BotUser):
     objects = ContractorQuerySet.as_manager()
@@ -189,15 +290,7 @@ class Contractor(BotUser):
         """Удалить подрядчика из бота, освободив его заказы"""
         contractor_orders = Order.objects.filter(status=Order.Status.in_work, contractor=self)
         with atomic():
-            contractor_orders.update(
-                status=Order.Status.created,
-                assigned_at=None,
-                contractor=None,
-                not_in_work_manager_informed=False,
-                late_work_manager_informed=False,
-                in_work_client_informed=False,
-                estimated_hours=None,
-            )
+            contractor_orders.release()
             self.status = BotUser.Status.inactive
             self.save()
 
@@ -265,79 +358,151 @@ class AssignedContractor(models.Model):
 
 
 class OrderQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """Обновить заказы, проставив время изменения (auto_now при update не срабатывает)"""
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
+    def get_watermark(self) -> tuple[timezone.datetime, int]:
+        """Получить время последнего изменения и число заказов, по ним видно изменилась ли выборка"""
+        watermark = self.aggregate(updated_at=Max('updated_at'), count=Count('id'))
+        return watermark['updated_at'], watermark['count']
+
+    def get_orders_not_in_work_for(self, reaction_time_share: float):
+        """Получить созданные заказы, которые ждут дольше reaction_time_share от времени реакции тарифа"""
+        # одним запросом: для каждого тарифа своя граница времени создания
+        now = timezone.now()
+        tariffs_filter = models.Q(pk__in=[])
+        for tariff in get_tariff_table().values():
+            tariffs_filter |= models.Q(
+                client__tariff_id=tariff.pk,
+                created_at__lt=now - timedelta(minutes=tariff.reaction_time_minutes * reaction_time_share),
+            )
+        return self.filter(tariffs_filter, status=Order.Status.created)
+
+    def get_orders_not_closed_for(self, work_time_share: float):
+        """Получить заказы в работе, которые выполняются дольше work_time_share от допустимого времени"""
+        orders_not_closed = self.select_related('client', 'contractor').filter(status=Order.Status.in_work)
+        orders_ids = []
+
+        for order in orders_not_closed:
+            not_closed_time = timezone.now() - order.assigned_at
+            limit_seconds = 60 * 60 * 24  # TODO: добавить эстимейты
+            if not_closed_time.total_seconds() / limit_seconds > work_time_share:
+                orders_ids.append(order.pk)
+        return self.filter(pk__in=orders_ids)
+
     def get_warning_orders_not_in_work(self):
         """Получить список новых заказов, которые почти просрочили (долго не берут в работу)"""
-        orders_not_in_work = self.select_related('client').filter(
-            status=Order.Status.created,
-            not_in_work_manager_informed=False,
-        )
-        warning_orders_ids = []
-        tariffs = Tariff.objects.all()
-
-        try:
-            limit = SystemSettings.objects.get('INFORM_MANAGER_CREATED_PROJECT_LIMIT').parameter_value
-            limit = int(limit) / 100
-        except (SystemSettings.DoesNotExist, ValueError):
-            limit = 0.95
-
-        # TODO: написать через аннотейты
-        for tariff in tariffs:
-            tariff_orders = orders_not_in_work.filter(client__tariff=tariff)
-            for tariff_order in tariff_orders:
-                not_in_work_time = timezone.now() - tariff_order.created_at
-                tariff_limit_seconds = tariff.reaction_time_minutes * 60
-                if not_in_work_time.total_seconds() / tariff_limit_seconds > limit:
-                    warning_orders_ids.append(tariff_order.pk)
-        return self.filter(pk__in=warning_orders_ids)
+        limit = SystemSettings.objects.get_int('INFORM_MANAGER_CREATED_PROJECT_LIMIT', 95) / 100
+        return self.filter(not_in_work_manager_informed=False).get_orders_not_in_work_for(limit)
 
     def get_warning_orders_not_closed(self):
         """Получить список выполняющихся заказов, которые почти просрочили (долго выполняют)"""
-        orders_not_closed = self.select_related('client', 'contractor').filter(
-            status=Order.Status.in_work,
-            late_work_manager_informed=False,
-        )
-        warning_orders_ids = []
+        limit = SystemSettings.objects.get_int('INFORM_MANAGER_IN_WORK_PROJECT_LIMIT', 95) / 100
+        return self.filter(late_work_manager_informed=False).get_orders_not_closed_for(limit)
 
-        try:
-            limit = SystemSettings.objects.get('INFORM_MANAGER_IN_WORK_PROJECT_LIMIT').parameter_value
-            limit = int(limit) / 100
-        except (SystemSettings.DoesNotExist, ValueError):
-            limit = 0.95
+    def get_sla_breaches(self):
+        """Получить заказы, которые просрочили время реакции тарифа или выполняются дольше суток"""
+        return self.get_overdue() | self.get_orders_not_closed_for(1)
 
-        for order in orders_not_closed:
-            not_closed_time = timezone.now() - order.assigned_at
-            limit_seconds = 60 * 60 * 24  # TODO: добавить эстимейты
-            if not_closed_time.total_seconds() / limit_seconds > limit:
-                warning_orders_ids.append(order.pk)
-        return self.filter(pk__in=warning_orders_ids)
+    def get_overdue(self):
+        """Получить созданные заказы, у которых прошел крайний срок взятия в работу"""
+        return self.filter(status=Order.Status.created, reaction_deadline__lt=timezone.now())
 
     def get_available(self):
-        """Получить список заказов, которые можно взять в работу"""
-        return self.filter(status=Order.Status.created).order_by('created_at')
+        """Получить список заказов, которые можно взять в работу, первыми - с ближайшим крайним сроком"""
+        return self.filter(status=Order.Status.created).order_by('reaction_deadline', 'id')
 
     def get_available_not_informed_all(self):
         """Получить список заказов, которые можно взять в работу и по которым не проинформированы все подрядчики"""
         return self.get_available().filter(all_contractors_informed=False)
 
+    def search_task(self, text: str):
+        """
+        Найти заказы по словам задания, самые подходящие первыми.
+
+        В SQLite поиск идет по полнотекстовому индексу: все слова должны встретиться
+        в задании, каждое слово ищется и как начало слова (сайт - сайта, сайтом),
+        порядок по релевантности bm25 лежит в search_rank. В других БД каждое слово ищется как подстрока
+        """
+        words = SEARCH_WORD_REGEX.findall(text)
+        if not words:
+            return self.none()
+        if connection.vendor != 'sqlite':
+            queryset = self
+            for word in words:
+                queryset = queryset.filter(task__icontains=word)
+            return queryset
+        # слова в кавычках, чтобы операторы FTS5 (AND, OR, NOT, NEAR) искались как обычные слова
+        match_query = ' '.join(f'"{word}"*' for word in words)
+        # bm25 считается по присоединенной таблице индекса, подзапрос на каждую строку повторял бы весь поиск
+        return self.filter(task_fts__task__match=match_query).annotate(
+            search_rank=RawSQL(f'bm25({ORDER_TASK_FTS_TABLE})', []),
+        ).order_by('search_rank')
+
+    def cancel(self) -> int:
+        """Отменить активные заказы одним запросом"""
+        return self.filter(status__in=[Order.Status.created, Order.Status.in_work]).update(
+            status=Order.Status.cancelled,
+            closed_at=timezone.now(),
+            creds='',
+        )
+
+    def release(self) -> int:
+        """Вернуть заказы в работе в список доступных одним запросом, подрядчики будут проинформированы заново"""
+        return self.filter(status=Order.Status.in_work).update(
+            status=Order.Status.created,
+            assigned_at=None,
+            contractor=None,
+            not_in_work_manager_informed=False,
+            late_work_manager_informed=False,
+            estimated_hours=None,
+            assigned_contractors_informed=False,
+            all_contractors_informed=False,
+            contractors_inform_wave=0,
+        )
+
     def calculate_average_orders_in_month(self):
         """Получить помесячную (финансовый месяц) статистику по заказам"""
-        nearest_billing_start_date = get_nearest_billing_start_date()
-        prev_billing_start_date = nearest_billing_start_date - relativedelta.relativedelta(months=1)
+        billing_calendar = get_billing_calendar()
+        prev_billing_start_date = billing_calendar.shift(billing_calendar.get_period_start(), -1)
+        archive_boundary = ArchivedOrder.objects.get_boundary()
 
         first_order_date = self.exclude(
             status=Order.Status.cancelled
         ).aggregate(dt=Min('created_at'))['dt']
+        if archive_boundary is not None:
+            first_archived_order_date = ArchivedOrder.objects.exclude(
+                status=Order.Status.cancelled
+            ).aggregate(dt=Min('created_at'))['dt']
+            first_order_date = min(filter(None, [first_order_date, first_archived_order_date]), default=None)
 
         stats = []
         while True:
             total_orders_in_month = 0
+            month_filter = {
+                'created_at__gt': prev_billing_start_date,
+                'created_at__lte': billing_calendar.shift(prev_billing_start_date, 1),
+            }
             clients_month_stat = self.exclude(
                 status=Order.Status.cancelled,
             ).filter(
-                created_at__gt=prev_billing_start_date,
-                created_at__lte=prev_billing_start_date + relativedelta.relativedelta(months=1),
+                **month_filter
             ).select_related('client__tg_nick').values('client__tg_nick').annotate(count_orders=Count('id'))
 
+            # архив нужен только для периодов, в которых могут быть перенесенные туда заказы
+            if archive_boundary is not None and prev_billing_start_date <= archive_boundary:
+                clients_month_stat = merge_orders_counts(
+                    'client__tg_nick',
+                    clients_month_stat,
+                    ArchivedOrder.objects.exclude(
+                        status=Order.Status.cancelled,
+                    ).filter(
+                        **month_filter
+                    ).values('client__tg_nick').annotate(count_orders=Count('id')),
+                )
+
             if prev_billing_start_date < first_order_date and not clients_month_stat:
                 break
 
@@ -357,21 +522,70 @@ class OrderQuerySet(models.QuerySet):
                     total_orders_in_month
                 ]
             )
-            prev_billing_start_date -= relativedelta.relativedelta(months=1)
+            prev_billing_start_date = billing_calendar.shift(prev_billing_start_date, -1)
         return stats
 
     def calculate_billing(self):
         """Посчитать биллинг для подрядчиков за прошелший финансовый месяц"""
-        nearest_billing_start_date = get_nearest_billing_start_date()
-        prev_billing_start_date = nearest_billing_start_date - relativedelta.relativedelta(months=1)
-
-        return self.exclude(
+        billing_calendar = get_billing_calendar()
+        prev_billing_start_date = billing_calendar.shift(billing_calendar.get_period_start(), -1)
+        billing_filter = {
+            'closed_at__gt': prev_billing_start_date,
+            'closed_at__lte': billing_calendar.shift(prev_billing_start_date, 1),
+        }
+
+        billing = self.exclude(
             status=Order.Status.cancelled,
         ).filter(
-            closed_at__gt=prev_billing_start_date,
-            closed_at__lte=prev_billing_start_date + relativedelta.relativedelta(months=1),
+            **billing_filter
         ).select_related('contractor').values('contractor__tg_nick').annotate(count_orders=Count('id'))
 
+        if not ArchivedOrder.objects.is_required_for(prev_billing_start_date):
+            return billing
+        return merge_orders_counts(
+            'contractor__tg_nick',
+            billing,
+            ArchivedOrder.objects.exclude(
+                status=Order.Status.cancelled,
+            ).filter(
+                **billing_filter
+            ).values('contractor__tg_nick').annotate(count_orders=Count('id')),
+        )
+
+    def get_archivable(self, archive_before: timezone.datetime):
+        """Получить закрытые и отмененные заказы, завершенные до archive_before"""
+        return self.filter(
+            status__in=[Order.Status.closed, Order.Status.cancelled],
+            closed_at__lt=archive_before,
+        )
+
+    def archive(self, billing_periods: int, chunk_size: int = 1000) -> int:
+        """
+        Перенести в архив закрытые и отмененные заказы старше billing_periods биллингов.
+
+        Переносит пачками по chunk_size, каждая пачка в своей транзакции,
+        чтобы не держать блокировку таблицы заказов. Возвращает число перенесенных заказов
+        """
+        if billing_periods < 1:
+            # текущий биллинг (заработок подрядчиков, лимиты клиентов) всегда читается из рабочей таблицы
+            raise ValueError('billing_periods should be at least 1')
+        billing_calendar = get_billing_calendar()
+        archive_before = billing_calendar.shift(billing_calendar.get_period_start(), -billing_periods)
+        archivable_orders = self.get_archivable(archive_before).order_by('closed_at')
+
+        archived_count = 0
+        while True:
+            with atomic():
+                orders = list(archivable_orders[:chunk_size])
+                if not orders:
+                    break
+                # без ignore_conflicts: если в архиве уже есть строка с таким id, пачка откатывается
+                # с IntegrityError, иначе заказ удалился бы без своей копии в архиве
+                ArchivedOrder.objects.bulk_create([ArchivedOrder.from_order(order) for order in orders])
+                Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+            archived_count += len(orders)
+        return archived_count
+
 
 class Order(models.Model):
     class Status(models.TextChoices):
@@ -394,6 +608,11 @@ class Order(models.Model):
         default=timezone.now,
         db_index=True,
     )
+    reaction_deadline = models.DateTimeField(
+        'крайний срок взятия в работу',
+        blank=True,
+        help_text='Время создания плюс время реакции тарифа клиента на момент создания',
+    )
     assigned_at = models.DateTimeField(
         'дата и время взятия в работу',
         null=True,
@@ -413,6 +632,11 @@ class Order(models.Model):
         default=Status.created,
         db_index=True,
     )
+    updated_at = models.DateTimeField(
+        'дата и время изменения',
+        auto_now=True,
+        db_index=True,
+    )
 
     not_in_work_manager_informed = models.BooleanField(
         'менеджер проинформирован что заказ не взят',
@@ -423,7 +647,7 @@ class Order(models.Model):
         default=False,
     )
 
-    creds = models.CharField('доступы к сервису', max_length=2000, blank=True)
+    creds = models.TextField('доступы к сервису (зашифрованы)', blank=True)
     estimated_hours = models.IntegerField(
         'оцененное время выполнения в часах',
         validators=[MinValueValidator(1), MaxValueValidator(24)],
@@ -439,9 +663,22 @@ class Order(models.Model):
         'все подрядчики проинформированы',
         default=False,
     )
+    contractors_inform_wave = models.PositiveSmallIntegerField(
+        'отправлено волн уведомлений подрядчикам',
+        default=0,
+    )
 
     objects = OrderQuerySet.as_manager()
 
+    def save(self, *args, **kwargs):
+        if self.reaction_deadline is None:
+            self.reaction_deadline = self.calculate_reaction_deadline()
+        super().save(*args, **kwargs)
+
+    def calculate_reaction_deadline(self):
+        """Посчитать крайний срок взятия в работу по тарифу клиента"""
+        return self.created_at + timedelta(minutes=self.client.tariff.reaction_time_minutes)
+
     def take_in_work(self, contractor, estimated_hours):
         """Взять заказ в работу"""
         with atomic():
@@ -451,6 +688,27 @@ class Order(models.Model):
             self.status = self.Status.in_work
             self.save()
 
+    def reassign(self, contractor) -> bool:
+        """
+        Передать активный заказ подрядчику, у которого нет заказа в работе.
+
+        Бот рассчитывает на один заказ в работе у подрядчика: строка подрядчика блокируется,
+        чтобы два одновременных переназначения не дали ему два заказа
+        """
+        with atomic():
+            list(BotUser.objects.select_for_update().filter(pk=contractor.pk).values_list('pk'))
+            if contractor.has_order_in_work():
+                return False
+            return bool(Order.objects.filter(
+                pk=self.pk,
+                status__in=[self.Status.created, self.Status.in_work],
+            ).update(
+                status=self.Status.in_work,
+                contractor=contractor,
+                assigned_at=timezone.now(),
+                late_work_manager_informed=False,
+            ))
+
     def close_work(self):
         """Завершить заказ"""
         with atomic():
@@ -468,23 +726,315 @@ class Order(models.Model):
             self.save()
 
     def encode_creds(self, creds):
-        """Раскодировать доступы"""
-        # TODO: написать шифрование доступов
-        return creds
+        """Закодировать доступы"""
+        return encrypt_creds(creds)
 
     def decode_creds(self, creds):
-        """Закодировать доступы"""
-        # TODO: написать шифрование доступов
-        return creds
+        """Раскодировать доступы"""
+        return decrypt_creds(creds)
 
     class Meta:
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
+        indexes = [
+            # проверки клиента и подрядчика (есть ли активный заказ, заказ в работе)
+            models.Index(fields=['client', 'status'], name='order_client_status_idx'),
+            models.Index(fields=['contractor', 'status'], name='order_contractor_status_idx'),
+            # лимит заказов клиента и заработок подрядчика за биллинг
+            models.Index(fields=['client', 'created_at'], name='order_client_created_idx'),
+            models.Index(fields=['contractor', 'closed_at'], name='order_contractor_closed_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            # лента доступных заказов и уведомитель, упорядоченные по крайнему сроку. Статус - первое поле, а не
+            # условие частичного индекса: Django передает статус параметром, и частичный индекс SQLite не выбирает
+            models.Index(fields=['status', 'reaction_deadline', 'id'], name='order_status_deadline_idx'),
+            # частичные индексы под ежеминутные задачи, они маленькие, т.к. содержат только ждущие заказы
+            # заказы, о которых подрядчики еще не знают (новые и возвращенные), уведомитель читает их по updated_at,
+            # без условия на статус, иначе без статистики SQLite выбирает индекс по статусу со всеми ждущими заказами
+            models.Index(
+                fields=['updated_at'],
+                name='order_never_informed_idx',
+                condition=models.Q(assigned_contractors_informed=False, contractors_inform_wave=0),
+            ),
+            models.Index(
+                fields=['created_at'],
+                name='order_not_in_work_warn_idx',
+                condition=models.Q(status='создан', not_in_work_manager_informed=False),
+            ),
+            models.Index(
+                fields=['assigned_at'],
+                name='order_not_closed_warn_idx',
+                condition=models.Q(status='в работе', late_work_manager_informed=False),
+            ),
+        ]
 
     def __str__(self):
         return f'Заказ {self.pk} ({self.status})'
 
 
+class FullTextField(models.TextField):
+    """Колонка таблицы FTS5, для нее есть lookup match"""
+
+    def deconstruct(self):
+        # для миграций это обычный TextField
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'django.db.models.TextField', args, kwargs
+
+
+@FullTextField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class OrderTaskFts(models.Model):
+    """
+    Полнотекстовый индекс заданий (FTS5, только SQLite), таблицу и триггеры создает миграция 0021.
+
+    Модель нужна search_task, чтобы соединить заказы с индексом, строки пишут триггеры
+    """
+    order = models.OneToOneField(
+        Order,
+        primary_key=True,
+        db_column='rowid',
+        related_name='task_fts',
+        on_delete=models.DO_NOTHING,
+    )
+    task = FullTextField('задание')
+
+    class Meta:
+        managed = False
+        db_table = ORDER_TASK_FTS_TABLE
+
+
+class ArchivedOrderQuerySet(models.QuerySet):
+    def get_boundary(self):
+        """Получить дату завершения самого позднего заказа в архиве (None если архив пуст)"""
+        return self.aggregate(dt=Max('closed_at'))['dt']
+
+    def is_required_for(self, period_start: timezone.datetime) -> bool:
+        """Могут ли в архиве быть заказы периода, начинающегося с period_start"""
+        archive_boundary = self.get_boundary()
+        return archive_boundary is not None and period_start <= archive_boundary
+
+
+class ArchivedOrder(models.Model):
+    """Закрытый или отмененный заказ, перенесенный из рабочей таблицы, id сохраняется"""
+    id = models.BigIntegerField(primary_key=True)
+    task = models.TextField('задание')
+    client = models.ForeignKey(Client, related_name='archived_orders', on_delete=models.DO_NOTHING)
+    contractor = models.ForeignKey(
+        Contractor,
+        related_name='archived_orders',
+        on_delete=models.DO_NOTHING,
+        null=True,
+        blank=True,
+    )
+    created_at = models.DateTimeField('дата и время создания', db_index=True)
+    assigned_at = models.DateTimeField('дата и время взятия в работу', null=True, blank=True)
+    closed_at = models.DateTimeField('дата и время выполнения', db_index=True)
+    status = models.CharField('статус', max_length=30, choices=Order.Status.choices)
+    estimated_hours = models.IntegerField('оцененное время выполнения в часах', null=True, blank=True)
+    archived_at = models.DateTimeField('дата и время переноса в архив', default=timezone.now)
+
+    objects = ArchivedOrderQuerySet.as_manager()
+
+    @classmethod
+    def from_order(cls, order: Order):
+        """Создать архивную запись заказа (доступы не переносятся)"""
+        return cls(
+            id=order.pk,
+            task=order.task,
+            client_id=order.client_id,
+            contractor_id=order.contractor_id,
+            created_at=order.created_at,
+            assigned_at=order.assigned_at,
+            closed_at=order.closed_at,
+            status=order.status,
+            estimated_hours=order.estimated_hours,
+        )
+
+    class Meta:
+        verbose_name = 'архивный заказ'
+        verbose_name_plural = 'архивные заказы'
+
+    def __str__(self):
+        return f'Архивный заказ {self.pk} ({self.status})'
+
+
+class SlaSketchQuerySet(models.QuerySet):
+    # (начало, конец) интервала для каждой метрики, день интервала - день его конца
+    METRIC_FIELDS = {
+        'реакция': ('created_at', 'assigned_at'),
+        'выполнение': ('assigned_at', 'closed_at'),
+    }
+    ORDERS_CHUNK_SIZE = 10000
+
+    def stream_day_sketches(
+            self,
+            metric: str,
+            start_day: date,
+            end_day: date,
+    ) -> Iterator[tuple[date, dict[int, QuantileSketch]]]:
+        """
+        Пройти по заказам (вместе с архивом) за дни с start_day по end_day включительно
+        и выдать скетчи по тарифам за каждый день.
+
+        Заказы читаются через iterator() в порядке конца интервала, поэтому в памяти
+        только скетчи одного дня, сколько бы заказов ни было
+        """
+        start_field, end_field = self.METRIC_FIELDS[metric]
+        orders_filter = {
+            f'{start_field}__isnull': False,
+            f'{end_field}__gte': timezone.make_aware(datetime.combine(start_day, time.min)),
+            f'{end_field}__lt': timezone.make_aware(datetime.combine(end_day + timedelta(days=1), time.min)),
+        }
+        if end_field == 'closed_at':
+            orders_filter['status'] = Order.Status.closed
+        orders_streams = [
+            model.objects.filter(**orders_filter).order_by(end_field).values_list(
+                end_field,
+                start_field,
+                'client__tariff_id',
+            ).iterator(chunk_size=self.ORDERS_CHUNK_SIZE)
+            for model in [Order, ArchivedOrder]
+        ]
+
+        day, day_sketches = None, defaultdict(QuantileSketch)
+        for ended_at, started_at, tariff_id in heapq.merge(*orders_streams):
+            order_day = timezone.localdate(ended_at)
+            if order_day != day:
+                if day is not None:
+                    yield day, day_sketches
+                day, day_sketches = order_day, defaultdict(QuantileSketch)
+            day_sketches[tariff_id].add((ended_at - started_at).total_seconds())
+        if day is not None:
+            yield day, day_sketches
+
+    def get_first_day(self) -> Optional[date]:
+        """
+        День создания самого старого заказа (вместе с архивом), None если заказов нет.
+
+        Интервалы заказа кончаются не раньше его создания, поэтому за дни до него скетчи пустые
+        """
+        first_created_at = [
+            created_at
+            for created_at in (model.objects.aggregate(dt=Min('created_at'))['dt'] for model in [Order, ArchivedOrder])
+            if created_at is not None
+        ]
+        return timezone.localdate(min(first_created_at)) if first_created_at else None
+
+    def get_merged_sketches(self, metric: str, start_day: date, end_day: date) -> dict[int, QuantileSketch]:
+        """
+        Получить скетчи по тарифам за период, объединив скетчи за дни.
+
+        Скетчи прошедших дней считаются один раз и сохраняются, текущий день считается заново.
+        Если у заказов прошедших дней правят даты в админке, сохраненные скетчи надо удалить
+        """
+        today = timezone.localdate()
+        merged_sketches = defaultdict(QuantileSketch)
+
+        def merge_day_sketches(day_sketches: dict):
+            for tariff_id, sketch in day_sketches.items():
+                merged_sketches[int(tariff_id)].merge(sketch)
+
+        last_stored_day = min(end_day, today - timedelta(days=1))
+        stored_days = set()
+        for sla_sketch in self.filter(metric=metric, day__gte=start_day, day__lte=last_stored_day):
+            stored_days.add(sla_sketch.day)
+            merge_day_sketches({
+                tariff_id: QuantileSketch.from_dict(sketch)
+                for tariff_id, sketch in sla_sketch.sketches.items()
+            })
+
+        missing_days = []
+        day = start_day
+        while day <= last_stored_day:
+            if day not in stored_days:
+                missing_days.append(day)
+            day += timedelta(days=1)
+        if missing_days:
+            new_sketches = {missing_day: {} for missing_day in missing_days}
+            for day, day_sketches in self.stream_day_sketches(metric, missing_days[0], missing_days[-1]):
+                if day in new_sketches:
+                    new_sketches[day] = day_sketches
+                    merge_day_sketches(day_sketches)
+            self.bulk_create(
+                [
+                    SlaSketch(
+                        day=day,
+                        metric=metric,
+                        sketches={str(tariff_id): sketch.to_dict() for tariff_id, sketch in day_sketches.items()},
+                    )
+                    for day, day_sketches in new_sketches.items()
+                ],
+                ignore_conflicts=True,
+            )
+
+        if end_day >= today:
+            for _, day_sketches in self.stream_day_sketches(metric, max(start_day, today), today):
+                merge_day_sketches(day_sketches)
+        return merged_sketches
+
+    def calculate_percentiles(self, start_day: date, end_day: date, quantiles=(0.5, 0.9, 0.99)) -> list[list]:
+        """
+        Посчитать перцентили времени реакции (создание -> взятие) и выполнения (взятие -> закрытие)
+        в минутах по тарифам за дни с start_day по end_day включительно.
+
+        Ждущие заказы во время реакции не входят, пока их не возьмут в работу
+        """
+        tariffs = get_tariff_table().values()
+        stats = []
+        for metric in self.METRIC_FIELDS:
+            merged_sketches = self.get_merged_sketches(metric, start_day, end_day)
+            for tariff in tariffs:
+                sketch = merged_sketches.get(tariff.pk, QuantileSketch())
+                stats.append(
+                    [tariff.name, metric, sketch.count] + [
+                        None if sketch.count == 0 else round(sketch.quantile(quantile) / 60, 1)
+                        for quantile in quantiles
+                    ]
+                )
+        return stats
+
+
+class SlaSketch(models.Model):
+    """Скетч квантилей длительностей заказов за день по тарифам, сохраненный для отчетов SLA"""
+
+    class Metric(models.TextChoices):
+        reaction = 'реакция'
+        resolution = 'выполнение'
+
+    day = models.DateField('день')
+    metric = models.CharField('метрика', max_length=30, choices=Metric.choices)
+    sketches = models.JSONField('скетчи по id тарифа')
+
+    objects = SlaSketchQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'скетч SLA'
+        verbose_name_plural = 'скетчи SLA'
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'day'], name='sla_sketch_metric_day_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.metric} за {self.day}'
+
+
+class SystemSettingsQuerySet(models.QuerySet):
+    def get_int(self, parameter_name: str, default: int) -> int:
+        """Получить целочисленный системный параметр, default если его нет или он не число"""
+        system_setting = self.filter(parameter_name=parameter_name).first()
+        try:
+            return int(system_setting.parameter_value)
+        except (AttributeError, ValueError):
+            return default
+
+
 class SystemSettings(models.Model):
     parameter_name = models.CharField(
         'имя системного параметра',
@@ -498,9 +1048,22 @@ class SystemSettings(models.Model):
     )
     description = models.TextField('описание параметра')
 
+    objects = SystemSettingsQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'системный параметр'
         verbose_name_plural = 'системные параметры'
 
     def __str__(self):
         return f'{self.parameter_name} - {self.parameter_value}'
+
+
+@receiver([post_save, post_delete], sender=SystemSettings)
+def reset_billing_calendar_on_settings_change(sender, instance, **kwargs):
+    if instance.parameter_name == 'BILLING_DAY':
+        reset_billing_calendar()
+
+
+@receiver([post_save, post_delete], sender=Tariff)
+def reset_tariff_table_on_tariff_change(sender, instance, **kwargs):
+    reset_tariff_table()
@@ -0,0 +1,53 @@
+from rest_framework import serializers
+
+from .models import Contractor
+from .models import Order
+
+
+class SparseFieldsModelSerializer(serializers.ModelSerializer):
+    """Serializer which returns only fields listed in ?fields=a,b,c query parameter"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested_fields = get_requested_fields(request)
+        if requested_fields:
+            for field_name in set(self.fields) - requested_fields:
+                self.fields.pop(field_name)
+
+
+def get_requested_fields(request) -> set[str]:
+    """Get fields from ?fields=a,b,c query parameter"""
+    if request is None or not request.query_params.get('fields'):
+        return set()
+    return {field.strip() for field in request.query_params['fields'].split(',') if field.strip()}
+
+
+class OrderSerializer(SparseFieldsModelSerializer):
+    client = serializers.CharField(source='client.tg_nick')
+    contractor = serializers.CharField(source='contractor.tg_nick', default=None)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id',
+            'status',
+            'task',
+            'client',
+            'contractor',
+            'estimated_hours',
+            'created_at',
+            'reaction_deadline',
+            'assigned_at',
+            'closed_at',
+            'updated_at',
+        ]
+
+
+class ContractorWorkloadSerializer(SparseFieldsModelSerializer):
+    orders_in_work = serializers.IntegerField()
+    closed_in_billing = serializers.IntegerField()
+
+    class Meta:
+        model = Contractor
+        fields = ['id', 'tg_nick', 'orders_in_work', 'closed_in_billing', 'created_at']
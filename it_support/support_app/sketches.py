@@ -0,0 +1,73 @@
+import math
+from collections import defaultdict
+from typing import Optional
+
+# относительная точность квантилей, общая для всех скетчей, иначе их нельзя объединять
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# значения меньше секунды не различаются
+MIN_VALUE = 1
+
+
+class QuantileSketch:
+    """
+    Объединяемый скетч квантилей с логарифмическими корзинами (как DDSketch).
+
+    Значение v попадает в корзину ceil(log_gamma(v)), квантиль возвращается с относительной
+    ошибкой не больше RELATIVE_ACCURACY. Число корзин зависит только от диапазона значений
+    (около 900 на диапазон от секунды до года), а не от числа заказов.
+    Скетчи объединяются сложением счетчиков корзин, поэтому скетчи за дни можно
+    хранить и собирать из них любой период
+    """
+    __slots__ = ('buckets', 'zero_count', 'count')
+
+    def __init__(self):
+        self.buckets: dict[int, int] = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        if value < MIN_VALUE:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / LOG_GAMMA)] += 1
+        self.count += 1
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        for key, count in other.buckets.items():
+            self.buckets[key] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        """Значение квантиля (от 0 до 1), None для пустого скетча"""
+        if not self.count:
+            return None
+        rank = quantile * (self.count - 1)
+        seen_count = self.zero_count
+        if rank < seen_count:
+            return 0
+        for key in sorted(self.buckets):
+            seen_count += self.buckets[key]
+            if rank < seen_count:
+                # середина корзины (gamma^(key-1), gamma^key] с точки зрения относительной ошибки
+                return 2 * GAMMA ** key / (GAMMA + 1)
+        return 2 * GAMMA ** max(self.buckets) / (GAMMA + 1)
+
+    def to_dict(self) -> dict:
+        """Представление для хранения в JSON"""
+        return {
+            'zero_count': self.zero_count,
+            'buckets': {str(key): count for key, count in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'QuantileSketch':
+        sketch = cls()
+        sketch.zero_count = data['zero_count']
+        for key, count in data['buckets'].items():
+            sketch.buckets[int(key)] = count
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
@@ -0,0 +1,77 @@
+import threading
+from time import monotonic
+from types import MappingProxyType
+
+from django.db import models
+from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
+
+# в других процессах (админка) тарифы могут поменяться, таблица перечитывается не реже чем раз в столько секунд
+TARIFF_TABLE_TTL_SECONDS = 60
+
+
+class TariffTable:
+    """
+    Неизменяемая таблица тарифов процесса по id.
+
+    Экземпляры тарифов общие для всех клиентов, менять их нельзя, только читать
+    """
+
+    def __init__(self, tariffs):
+        self.tariffs = MappingProxyType({tariff.pk: tariff for tariff in tariffs})
+        self.loaded_at = monotonic()
+
+    def get(self, tariff_id: int):
+        return self.tariffs.get(tariff_id)
+
+    def values(self):
+        return self.tariffs.values()
+
+    def is_expired(self) -> bool:
+        return monotonic() - self.loaded_at > TARIFF_TABLE_TTL_SECONDS
+
+
+tariff_table_cache = {'table': None}
+tariff_table_lock = threading.Lock()
+
+
+def get_tariff_table(reload: bool = False) -> TariffTable:
+    """Получить таблицу тарифов, загрузив ее при первом обращении, после изменения тарифа или по TTL"""
+    with tariff_table_lock:
+        tariff_table = tariff_table_cache['table']
+        if reload or tariff_table is None or tariff_table.is_expired():
+            from .models import Tariff
+            tariff_table = TariffTable(Tariff.objects.order_by('pk'))
+            tariff_table_cache['table'] = tariff_table
+        return tariff_table
+
+
+def reset_tariff_table() -> None:
+    with tariff_table_lock:
+        tariff_table_cache['table'] = None
+
+
+def get_cached_tariff(tariff_id: int):
+    """Получить тариф из таблицы, перечитав ее если тариф создан после загрузки"""
+    tariff = get_tariff_table().get(tariff_id)
+    if tariff is None:
+        tariff = get_tariff_table(reload=True).get(tariff_id)
+    return tariff
+
+
+class CachedTariffDescriptor(ForwardManyToOneDescriptor):
+    """Берет тариф из таблицы процесса вместо запроса в БД"""
+
+    def get_object(self, instance):
+        tariff = get_cached_tariff(getattr(instance, self.field.attname))
+        if tariff is None:
+            return super().get_object(instance)
+        return tariff
+
+
+class TariffForeignKey(models.ForeignKey):
+    forward_related_accessor_class = CachedTariffDescriptor
+
+    def deconstruct(self):
+        # для миграций это обычный ForeignKey, в схеме БД ничего не меняется
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'django.db.models.ForeignKey', args, kwargs
@@ -1,3 +1,830 @@
+import re
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+from cryptography.fernet import Fernet
+from cryptography.fernet import InvalidToken
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db import connection
+from django.test import SimpleTestCase
 from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as django_timezone
+
+from .admin import EstimatedCountPaginator
+from .analytics import load_closed_orders
+from .billing import BillingCalendar
+from .checks import check_order_task_fts_triggers
+from .encryption import ENCRYPTED_CREDS_PREFIX
+from .encryption import decrypt_creds
+from .encryption import encrypt_creds
+from .encryption import get_creds_cipher
+from .encryption import is_encrypted
+from .encryption import rotate_creds
+from .matching import plan_inform_wave
+from .models import ORDER_TASK_FTS_TABLE
+from .models import ArchivedOrder
+from .models import BotUser
+from .models import Client
+from .models import Contractor
+from .models import Order
+from .models import SlaSketch
+from .models import Tariff
+from .models import get_billing_calendar
+from .models import reset_billing_calendar
+from .sketches import RELATIVE_ACCURACY
+from .sketches import QuantileSketch
+from .tariffs import TARIFF_TABLE_TTL_SECONDS
+from .tariffs import get_tariff_table
+from .tariffs import reset_tariff_table
+from tgbot_app.models import OutboxMessage
+from tgbot_app.notifier import NewOrdersSchedule
+
+# "SCAN table" без индекса означает полный проход по таблице,
+# "SCAN table USING INDEX" и "SEARCH" - проход по индексу
+FULL_SCAN_REGEX = re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)')
+# справочники на десятки строк, полный проход по ним дешевле похода в индекс
+SMALL_TABLES = {'support_app_tariff', 'support_app_systemsettings'}
+
+
+class QueryPlanTestCase(TestCase):
+    """Горячие запросы бота не должны читать таблицы целиком"""
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        cls.client_user = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=tariff,
+            paid=True,
+        )
+        cls.contractor = Contractor.objects.create(tg_nick='testcontractor', role=BotUser.Role.contractor)
+        order = Order.objects.create(task='test', client=cls.client_user)
+        order.take_in_work(cls.contractor, 1)
+        order.close_work()
+        Order.objects.create(task='test', client=cls.client_user)
+
+    def get_query_plans(self, helper) -> list[tuple[str, list[str]]]:
+        """
+        Выполнить helper и получить SQL каждого его запроса со строками плана.
+
+        План строится с теми же параметрами запроса, а не с подставленными в SQL значениями:
+        частичный индекс с условием на значение параметра SQLite не использует
+        """
+        queries = []
+
+        def capture_query(execute, sql, params, many, context):
+            queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture_query):
+            result = helper()
+            if hasattr(result, 'query'):  # ленивые QuerySet выполняем
+                list(result)
+
+        query_plans = []
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                query_plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+        return query_plans
+
+    def get_full_scans(self, helper):
+        return [
+            (table, sql)
+            for sql, plan in self.get_query_plans(helper)
+            for plan_row in plan
+            for table in FULL_SCAN_REGEX.findall(plan_row)
+            if table not in SMALL_TABLES
+        ]
+
+    def assert_uses_index(self, helper, index_name: str):
+        """Запрос к заказам идет по индексу index_name и не сортирует строки отдельно"""
+        plan = [plan_row for _, query_plan in self.get_query_plans(helper) for plan_row in query_plan]
+        self.assertTrue(any(index_name in plan_row for plan_row in plan), plan)
+        self.assertFalse(any('TEMP B-TREE' in plan_row for plan_row in plan), plan)
+
+    def assert_no_full_scans(self, helpers):
+        for name, helper in helpers.items():
+            with self.subTest(helper=name):
+                self.assertEqual(self.get_full_scans(helper), [])
+
+    def test_order_queryset_helpers(self):
+        self.assert_no_full_scans({
+            'get_warning_orders_not_in_work': Order.objects.get_warning_orders_not_in_work,
+            'get_warning_orders_not_closed': Order.objects.get_warning_orders_not_closed,
+            'get_available': Order.objects.get_available,
+            'get_available_not_informed_all': Order.objects.get_available_not_informed_all,
+            'calculate_average_orders_in_month': Order.objects.calculate_average_orders_in_month,
+            'calculate_billing': Order.objects.calculate_billing,
+        })
+
+    def test_available_orders_are_read_in_deadline_order(self):
+        # лента заказов и уведомитель идут по индексам уже в порядке крайнего срока, без сортировки
+        with self.subTest(helper='get_available'):
+            self.assert_uses_index(Order.objects.get_available, 'order_status_deadline_idx')
+        with self.subTest(helper='get_available_not_informed_all'):
+            self.assert_uses_index(Order.objects.get_available_not_informed_all, 'order_status_deadline_idx')
+
+    def test_notifier_reads_only_new_and_released_orders(self):
+        schedule = NewOrdersSchedule()
+        # первый проход только загружает водяной знак, время просмотра появляется после него
+        schedule.collect(1)
+        query_plans = self.get_query_plans(lambda: schedule.collect(1))
+
+        self.assertEqual(self.get_full_scans(lambda: schedule.collect(1)), [])
+        events_plans = [plan for sql, plan in query_plans if '"updated_at" >=' in sql]
+        self.assertEqual(len(events_plans), 1)
+        # новые заказы - по первичному ключу после водяного знака, возвращенные - по order_never_informed_idx
+        self.assertTrue(any('order_never_informed_idx' in plan_row for plan_row in events_plans[0]), events_plans)
+
+    def test_client_helpers(self):
+        client = self.client_user
+        self.assert_no_full_scans({
+            'has_limit_of_orders': client.has_limit_of_orders,
+            'has_active_order': client.has_active_order,
+            'get_active_order': client.get_active_order,
+            'has_in_work_order': client.has_in_work_order,
+            'get_in_work_order': client.get_in_work_order,
+            'get_contractors': client.get_contractors,
+            'is_assigned_contractor': lambda: client.is_assigned_contractor(self.contractor),
+            'get_not_assigned_contractors': client.get_not_assigned_contractors,
+            'has_closed_orders': client.has_closed_orders,
+            'get_last_closed_order': client.get_last_closed_order,
+        })
+
+    def test_contractor_helpers(self):
+        contractor = self.contractor
+        self.assert_no_full_scans({
+            'get_available': Contractor.objects.get_available,
+            'has_order_in_work': contractor.has_order_in_work,
+            'get_order_in_work': contractor.get_order_in_work,
+            'get_closed_in_actual_billing_orders': contractor.get_closed_in_actual_billing_orders,
+        })
+
+
+class OrderTaskSearchTestCase(TestCase):
+    """Полнотекстовый индекс заданий должен следовать за изменениями заказов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        cls.client_user = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=tariff,
+            paid=True,
+        )
+
+    def search(self, text):
+        return list(Order.objects.search_task(text).values_list('pk', flat=True))
+
+    def test_search_follows_changes(self):
+        order = Order.objects.create(task='Не работает форма оплаты на сайте', client=self.client_user)
+        other_order = Order.objects.create(task='Сайт не открывается, сайт недоступен', client=self.client_user)
+        self.assertEqual(self.search('сайт'), [other_order.pk, order.pk])
+        self.assertEqual(self.search('форма сайт'), [order.pk])
+
+        order.task = 'Обновить логотип'
+        order.save()
+        self.assertEqual(self.search('форма'), [])
+        self.assertEqual(self.search('логотип'), [order.pk])
+
+        Order.objects.filter(pk=other_order.pk).delete()
+        self.assertEqual(self.search('сайт'), [])
+
+    def test_search_operators_are_words(self):
+        order = Order.objects.create(task='Перевести сайт с AND на NOT', client=self.client_user)
+        self.assertEqual(self.search('AND NOT'), [order.pk])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_search_without_fts_finds_all_words(self):
+        order = Order.objects.create(task='Не работает форма оплаты на сайте', client=self.client_user)
+        Order.objects.create(task='Сайт недоступен', client=self.client_user)
+        with patch.object(connection, 'vendor', 'postgresql'):
+            self.assertEqual(self.search('сайт форма'), [order.pk])
+
+    def test_missing_triggers_are_reported(self):
+        self.assertEqual(check_order_task_fts_triggers(None, databases=['default']), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {ORDER_TASK_FTS_TABLE}_update')
+        warnings = check_order_task_fts_triggers(None, databases=['default'])
+        self.assertEqual([warning.id for warning in warnings], ['support_app.W001'])
+
+
+class CredsEncryptionTestCase(TestCase):
+    """Открытые доступы шифруются один раз, токен неизвестного ключа не выдается за доступы"""
+    old_key = Fernet.generate_key().decode()
+    new_key = Fernet.generate_key().decode()
+
+    def setUp(self):
+        get_creds_cipher.cache_clear()
+        self.addCleanup(get_creds_cipher.cache_clear)
+
+    def test_plaintext_is_encrypted_once(self):
+        token = rotate_creds('Логин: Иван')
+        self.assertTrue(is_encrypted(token))
+        self.assertEqual(decrypt_creds('Логин: Иван'), 'Логин: Иван')
+        self.assertEqual(decrypt_creds(rotate_creds(token)), 'Логин: Иван')
+        # открытые доступы, которые начинаются как токен Fernet
+        self.assertEqual(decrypt_creds(rotate_creds('gAAAAApassword')), 'gAAAAApassword')
+
+    def test_rotation_to_new_key(self):
+        with override_settings(CREDS_ENCRYPTION_KEY=self.old_key, CREDS_ENCRYPTION_OLD_KEYS=[]):
+            token = encrypt_creds('Пароль: qwerty')
+        get_creds_cipher.cache_clear()
+        with override_settings(CREDS_ENCRYPTION_KEY=self.new_key, CREDS_ENCRYPTION_OLD_KEYS=[self.old_key]):
+            rotated_token = rotate_creds(token)
+        get_creds_cipher.cache_clear()
+        with override_settings(CREDS_ENCRYPTION_KEY=self.new_key, CREDS_ENCRYPTION_OLD_KEYS=[]):
+            self.assertEqual(decrypt_creds(rotated_token), 'Пароль: qwerty')
+            # ключ удален из настроек: ошибка, а не шифротекст вместо доступов
+            with self.assertRaises(InvalidToken):
+                decrypt_creds(token)
+            with self.assertRaises(InvalidToken):
+                rotate_creds(token)
+
+    def test_migration_encrypts_plaintext(self):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        client = Client.objects.create(tg_nick='testclient', role=BotUser.Role.client, tariff=tariff, paid=True)
+        token = encrypt_creds('Пароль: qwerty')
+        unknown_key_token = Fernet(self.old_key).encrypt('Пароль: 12345'.encode()).decode()
+        creds_before = [
+            'Логин: Иван',
+            'gAAAAApassword',
+            token,
+            # токены без метки, сохраненные до ее появления
+            token[len(ENCRYPTED_CREDS_PREFIX):],
+            unknown_key_token,
+        ]
+        orders = [Order.objects.create(task='Задание', client=client, creds=creds) for creds in creds_before]
+
+        migration = import_module('support_app.migrations.0022_encrypt_plaintext_creds')
+        migration.encrypt_plaintext_creds(apps, None)
+
+        creds_after = [Order.objects.get(pk=order.pk).creds for order in orders]
+        self.assertTrue(all(is_encrypted(creds) for creds in creds_after))
+        self.assertEqual(
+            [decrypt_creds(creds) for creds in creds_after[:4]],
+            ['Логин: Иван', 'gAAAAApassword', 'Пароль: qwerty', 'Пароль: qwerty'],
+        )
+        self.assertEqual(creds_after[2], token)
+        # ключ токена удален из настроек: токен помечен как есть, а не зашифрован как открытые доступы
+        self.assertEqual(creds_after[4], ENCRYPTED_CREDS_PREFIX + unknown_key_token)
+        with self.assertRaises(InvalidToken):
+            decrypt_creds(creds_after[4])
+
+    def test_rotate_command_rotates_every_order(self):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        client = Client.objects.create(tg_nick='testclient', role=BotUser.Role.client, tariff=tariff, paid=True)
+        with override_settings(CREDS_ENCRYPTION_KEY=self.old_key, CREDS_ENCRYPTION_OLD_KEYS=[]):
+            tokens = [encrypt_creds(f'Пароль: {index}') for index in range(5)]
+        orders = [Order.objects.create(task='Задание', client=client, creds=token) for token in tokens]
+        get_creds_cipher.cache_clear()
+
+        with override_settings(CREDS_ENCRYPTION_KEY=self.new_key, CREDS_ENCRYPTION_OLD_KEYS=[self.old_key]):
+            call_command('rotate_creds_key', chunk_size=2, stdout=StringIO())
+        get_creds_cipher.cache_clear()
+
+        with override_settings(CREDS_ENCRYPTION_KEY=self.new_key, CREDS_ENCRYPTION_OLD_KEYS=[]):
+            self.assertEqual(
+                [decrypt_creds(Order.objects.get(pk=order.pk).creds) for order in orders],
+                [f'Пароль: {index}' for index in range(5)],
+            )
+
+
+class OrderAdminTestCase(TestCase):
+    """Число заказов в админке не зависит от дыр в id, заказ передается только свободному подрядчику"""
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        cls.client_user = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=tariff,
+            paid=True,
+        )
+        cls.contractor = Contractor.objects.create(tg_nick='testcontractor', role=BotUser.Role.contractor)
+
+    def test_paginator_count_ignores_id_gaps(self):
+        for _ in range(14):
+            Order.objects.create(task='Задание', client=self.client_user)
+        # после архивации в id остаются дыры
+        Order.objects.create(pk=50000, task='Задание', client=self.client_user)
+        orders = Order.objects.order_by('-pk')
+        self.assertEqual(EstimatedCountPaginator(orders, 100).count, 15)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(EstimatedCountPaginator(orders, 100).count, 15)
+        with patch('support_app.admin.EXACT_COUNT_LIMIT', 10):
+            # оценка из статистики SQLite, без COUNT(*)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(EstimatedCountPaginator(orders, 100).count, 15)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    def test_reassign_only_to_contractor_without_order_in_work(self):
+        order = Order.objects.create(task='Задание', client=self.client_user)
+        other_order = Order.objects.create(task='Другое задание', client=self.client_user)
+
+        self.assertTrue(order.reassign(self.contractor))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.contractor_id), (Order.Status.in_work, self.contractor.pk))
+
+        self.assertFalse(other_order.reassign(self.contractor))
+        other_order.refresh_from_db()
+        self.assertEqual((other_order.status, other_order.contractor_id), (Order.Status.created, None))
+
+        order.close_work()
+        self.assertFalse(order.reassign(self.contractor))
+        self.assertTrue(other_order.reassign(self.contractor))
+
+    def test_reassign_action_notifies_both_sides(self):
+        self.client_user.telegram_id = 101
+        self.client_user.save()
+        self.contractor.telegram_id = 202
+        self.contractor.save()
+        order = Order.objects.create(task='Задание', client=self.client_user)
+        other_order = Order.objects.create(task='Другое задание', client=self.client_user)
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        url = '/admin/support_app/order/'
+
+        self.client.post(url, {
+            'action': 'reassign_orders',
+            '_selected_action': [order.pk, other_order.pk],
+            'contractor_id': self.contractor.pk,
+        })
+        self.assertFalse(Order.objects.filter(status=Order.Status.in_work).exists())
+
+        self.client.post(url, {
+            'action': 'reassign_orders',
+            '_selected_action': [order.pk],
+            'contractor_id': self.contractor.pk,
+        })
+        order.refresh_from_db()
+        self.assertEqual(order.contractor_id, self.contractor.pk)
+        self.assertEqual(sorted(OutboxMessage.objects.values_list('chat_id', flat=True)), [101, 202])
+
+
+class PlanInformWaveTestCase(SimpleTestCase):
+    """Каждая волна информирования вдвое больше предыдущей, пропущенные волны уходят сразу"""
+
+    phase_start = datetime(2024, 1, 1, 10, tzinfo=timezone.utc)
+    wave_interval = timedelta(minutes=6)
+    contractors = list(range(20))
+
+    def plan(self, informed_waves, minutes_after_start):
+        return plan_inform_wave(
+            self.contractors,
+            informed_waves,
+            self.phase_start,
+            self.wave_interval,
+            3,
+            self.phase_start + timedelta(minutes=minutes_after_start),
+        )
+
+    def test_waves_widen(self):
+        self.assertEqual(self.plan(0, -1), ([], 0, False))
+        self.assertEqual(self.plan(0, 0), ([0, 1, 2], 1, False))
+        self.assertEqual(self.plan(1, 5), ([], 1, False))
+        self.assertEqual(self.plan(1, 6), ([3, 4, 5, 6, 7, 8], 2, False))
+        self.assertEqual(self.plan(2, 12), (list(range(9, 20)), 3, True))
+        self.assertEqual(self.plan(3, 17), ([], 3, True))
+
+    def test_missed_waves_are_sent_at_once(self):
+        self.assertEqual(self.plan(1, 13), (list(range(3, 20)), 3, True))
+
+
+class ClosedOrdersLoadingTestCase(TestCase):
+    """Закрытые заказы переводятся в колонки пачками, результат не зависит от размера пачки"""
+
+    def test_chunks_are_concatenated(self):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        client = Client.objects.create(tg_nick='testclient', role=BotUser.Role.client, tariff=tariff, paid=True)
+        contractor = Contractor.objects.create(tg_nick='testcontractor', role=BotUser.Role.contractor)
+        assigned_at = datetime(2024, 1, 1, 10, tzinfo=timezone.utc)
+        for hours in range(1, 6):
+            Order.objects.create(
+                task='Задание',
+                client=client,
+                contractor=contractor,
+                status=Order.Status.closed,
+                assigned_at=assigned_at,
+                closed_at=assigned_at + timedelta(hours=hours),
+                estimated_hours=hours if hours % 2 else None,
+            )
+        Order.objects.create(task='Новое задание', client=client)
+
+        with patch('support_app.analytics.ORDERS_CHUNK_SIZE', 2):
+            orders = load_closed_orders()
+
+        self.assertEqual(len(orders), 5)
+        self.assertEqual(orders.contractor_ids.tolist(), [contractor.pk] * 5)
+        self.assertEqual(sorted(orders.closed_at - orders.assigned_at), [3600 * hours for hours in range(1, 6)])
+        self.assertEqual(sorted(orders.estimated_hours[~np.isnan(orders.estimated_hours)]), [1, 3, 5])
+        self.assertEqual(len(load_closed_orders(since=assigned_at + timedelta(hours=10))), 0)
+
+
+class TariffsSlaReportTestCase(TestCase):
+    """Отчет SLA считает и сохраняет скетчи только за дни, когда заказы уже были"""
+
+    url = '/api/reports/tariffs-sla/'
+
+    def setUp(self):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        client = Client.objects.create(tg_nick='testclient', role=BotUser.Role.client, tariff=tariff, paid=True)
+        self.today = django_timezone.localdate()
+        Order.objects.create(task='Задание', client=client, created_at=django_timezone.now() - timedelta(days=10))
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+
+    def test_start_is_moved_to_first_order(self):
+        response = self.client.get(self.url, {'start': '1900-01-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SlaSketch.objects.filter(metric=SlaSketch.Metric.reaction).count(), 10)
+
+    def test_long_or_reversed_period_is_rejected(self):
+        self.assertEqual(SlaSketch.objects.get_first_day(), self.today - timedelta(days=10))
+        Order.objects.update(created_at=django_timezone.now() - timedelta(days=1000))
+        response = self.client.get(self.url, {'start': str(self.today - timedelta(days=900))})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url, {'start': str(self.today), 'end': str(self.today - timedelta(days=1))})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SlaSketch.objects.exists())
+
+
+class OrdersApiTestCase(TestCase):
+    """API заказов: условные запросы, пагинация курсором и выбор полей"""
+
+    url = '/api/orders/'
+
+    def setUp(self):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        self.client_user = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=tariff,
+            paid=True,
+        )
+        now = django_timezone.now()
+        self.orders = [
+            Order.objects.create(
+                task=f'Задание {number}',
+                client=self.client_user,
+                created_at=now - timedelta(hours=number),
+            )
+            for number in range(5)
+        ]
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+
+    def test_not_modified_until_orders_or_names_change(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        Order.objects.filter(pk=self.orders[0].pk).update(estimated_hours=3)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # у клиента нет времени изменения, переименование меняет и ETag, и Last-Modified
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.client_user.tg_nick = 'renamedclient'
+        self.client_user.save()
+        with patch.object(django_timezone, 'now', return_value=django_timezone.now() + timedelta(minutes=1)):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual({order['client'] for order in response.json()['results']}, {'renamedclient'})
+            response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+
+    def test_cursor_pagination_returns_every_order_once(self):
+        order_ids = []
+        response = self.client.get(self.url, {'page_size': 2})
+        while True:
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 2)
+            order_ids += [order['id'] for order in page['results']]
+            if not page['next']:
+                break
+            response = self.client.get(page['next'])
+
+        # новые заказы первыми
+        self.assertEqual(order_ids, [order.pk for order in self.orders])
+
+    def test_requested_fields_only_are_returned_and_read(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'fields': 'id,status'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([set(order) for order in response.json()['results']], [{'id', 'status'}] * 5)
+        self.assertFalse(any('"support_app_order"."task"' in query['sql'] for query in queries))
+        self.assertIn('task', self.client.get(self.url).json()['results'][0])
+
+
+class TariffTableTestCase(TestCase):
+    """Тариф клиента берется из таблицы процесса, изменения тарифов ее сбрасывают"""
+
+    def setUp(self):
+        reset_tariff_table()
+        self.tariff = self.create_tariff('test')
+        self.client_id = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=self.tariff,
+            paid=True,
+        ).pk
+
+    @staticmethod
+    def create_tariff(name: str) -> Tariff:
+        return Tariff.objects.create(
+            name=name,
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+
+    def test_client_tariff_is_read_without_query(self):
+        get_tariff_table()
+        client = Client.objects.get(pk=self.client_id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(client.tariff.name, 'test')
+            # экземпляр тарифа общий для всех клиентов
+            self.assertIs(client.tariff, Client(tariff_id=self.tariff.pk).tariff)
+
+    def test_saved_tariff_invalidates_table(self):
+        table = get_tariff_table()
+        self.tariff.name = 'renamed'
+        self.tariff.save()
+
+        self.assertIsNot(get_tariff_table(), table)
+        self.assertEqual(Client.objects.get(pk=self.client_id).tariff.name, 'renamed')
+
+        other_tariff = self.create_tariff('other')
+        table = get_tariff_table()
+        other_tariff.delete()
+        self.assertIsNot(get_tariff_table(), table)
+        self.assertIsNone(get_tariff_table().get(other_tariff.pk))
+
+    def test_tariffs_changed_by_other_process_are_read_again(self):
+        table = get_tariff_table()
+        # в другом процессе сигналы не срабатывают, как и при update() и bulk_create()
+        Tariff.objects.filter(pk=self.tariff.pk).update(name='renamed')
+        new_tariff, = Tariff.objects.bulk_create([Tariff(
+            name='new',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )])
+        client = Client.objects.create(
+            tg_nick='newclient',
+            role=BotUser.Role.client,
+            tariff_id=new_tariff.pk,
+            paid=True,
+        )
+
+        # новый тариф перечитывает таблицу сразу
+        self.assertEqual(Client.objects.get(pk=client.pk).tariff.name, 'new')
+        self.assertIsNot(get_tariff_table(), table)
+
+        table = get_tariff_table()
+        Tariff.objects.filter(pk=self.tariff.pk).update(name='renamed again')
+        self.assertEqual(Client.objects.get(pk=self.client_id).tariff.name, 'renamed')
+        with patch('support_app.tariffs.monotonic', return_value=table.loaded_at + TARIFF_TABLE_TTL_SECONDS + 1):
+            self.assertEqual(Client.objects.get(pk=self.client_id).tariff.name, 'renamed again')
+
+
+class QuantileSketchTestCase(SimpleTestCase):
+    """Квантили скетча отличаются от точных не больше чем на RELATIVE_ACCURACY, объединение не теряет точность"""
+
+    def setUp(self):
+        random_generator = np.random.default_rng(7)
+        self.values = random_generator.lognormal(mean=8, sigma=1.5, size=5000)
+
+    def assert_quantiles_close(self, sketch, values):
+        for quantile in (0.01, 0.5, 0.9, 0.99):
+            # ранг как в quantile(): значение с индексом floor(q * (n - 1)) среди отсортированных
+            exact = np.sort(values)[int(quantile * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(quantile) - exact), exact * RELATIVE_ACCURACY)
+
+    def build(self, values):
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def test_quantiles_error_is_bounded(self):
+        self.assert_quantiles_close(self.build(self.values), self.values)
+
+    def test_merged_sketch_equals_sketch_of_all_values(self):
+        parts = np.array_split(self.values, 7)
+        merged = QuantileSketch()
+        for part in parts:
+            # скетчи дней хранятся в JSON
+            merged.merge(QuantileSketch.from_dict(self.build(part).to_dict()))
+        whole = self.build(self.values)
+        self.assertEqual(merged.count, len(self.values))
+        self.assertEqual(merged.buckets, whole.buckets)
+        self.assert_quantiles_close(merged, self.values)
+
+    def test_small_and_empty(self):
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+        sketch = self.build([0, 0.5, 0, 100])
+        self.assertEqual(sketch.quantile(0.5), 0)
+        self.assertAlmostEqual(sketch.quantile(1), 100, delta=100 * RELATIVE_ACCURACY)
+
+
+class BillingCalendarTestCase(TestCase):
+    """Биллинг начинается в день биллинга или в последний день месяца, если такого дня в нем нет"""
+
+    now = django_timezone.make_aware(datetime(2024, 3, 15, 12))
+
+    def moment(self, *args):
+        return django_timezone.make_aware(datetime(*args))
+
+    def test_missing_days_are_clamped(self):
+        billing_calendar = BillingCalendar(31, self.now)
+        self.assertEqual(billing_calendar.calculate_start(2024, 2), self.moment(2024, 2, 29))
+        self.assertEqual(billing_calendar.calculate_start(2023, 2), self.moment(2023, 2, 28))
+        self.assertEqual(billing_calendar.calculate_start(2024, 4), self.moment(2024, 4, 30))
+        self.assertEqual(BillingCalendar(29, self.now).calculate_start(2023, 2), self.moment(2023, 2, 28))
+        self.assertEqual(BillingCalendar(45, self.now).billing_day, 31)
+
+    def test_period_start(self):
+        billing_calendar = BillingCalendar(31, self.now)
+        self.assertEqual(billing_calendar.get_period_start(self.now), self.moment(2024, 2, 29))
+        self.assertEqual(billing_calendar.get_period_start(self.moment(2024, 2, 29)), self.moment(2024, 2, 29))
+        self.assertEqual(billing_calendar.get_period_start(self.moment(2024, 2, 28, 23)), self.moment(2024, 1, 31))
+        # вне посчитанного диапазона биллинг считается напрямую
+        self.assertEqual(billing_calendar.get_period_start(self.moment(1990, 3, 1)), self.moment(1990, 2, 28))
+
+    def test_shift(self):
+        billing_calendar = BillingCalendar(31, self.now)
+        period_start = self.moment(2024, 1, 31)
+        self.assertEqual(billing_calendar.shift(period_start, 1), self.moment(2024, 2, 29))
+        self.assertEqual(billing_calendar.shift(period_start, 2), self.moment(2024, 3, 31))
+        self.assertEqual(billing_calendar.shift(period_start, -2), self.moment(2023, 11, 30))
+        self.assertEqual(billing_calendar.shift(period_start, 12 * 50), self.moment(2074, 1, 31))
+        self.assertEqual(billing_calendar.shift(self.moment(1990, 2, 28), 1), self.moment(1990, 3, 31))
+
+
+class OrdersArchiveTestCase(TestCase):
+    """Архивация старых заказов не меняет биллинг и помесячную статистику"""
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        cls.client_user = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=tariff,
+            paid=True,
+        )
+        cls.contractor = Contractor.objects.create(tg_nick='testcontractor', role=BotUser.Role.contractor)
+
+    def setUp(self):
+        reset_billing_calendar()
+        self.addCleanup(reset_billing_calendar)
+        billing_calendar = get_billing_calendar()
+        self.period_starts = [
+            billing_calendar.shift(billing_calendar.get_period_start(), -periods_ago) for periods_ago in range(5)
+        ]
+
+    def create_order(self, periods_ago: int, status=Order.Status.closed):
+        closed_at = self.period_starts[periods_ago] + timedelta(days=2)
+        return Order.objects.create(
+            task='Задание',
+            client=self.client_user,
+            contractor=self.contractor,
+            status=status,
+            created_at=closed_at - timedelta(days=1),
+            assigned_at=closed_at - timedelta(hours=5),
+            closed_at=closed_at,
+        )
+
+    def get_stats(self):
+        billing = sorted((row['contractor__tg_nick'], row['count_orders']) for row in Order.objects.calculate_billing())
+        return billing, Order.objects.calculate_average_orders_in_month()
+
+    def test_stats_are_the_same_after_archive(self):
+        for periods_ago in [1, 1, 3, 3, 3]:
+            self.create_order(periods_ago)
+        self.create_order(4, Order.Status.cancelled)
+        in_work_order = Order.objects.create(task='Задание', client=self.client_user)
+        stats_before = self.get_stats()
+        self.assertIn([self.period_starts[3], 'testclient', 3], stats_before[1])
+
+        stdout = StringIO()
+        call_command('archive_orders', billing_periods=1, chunk_size=2, stdout=stdout)
+
+        self.assertEqual(stdout.getvalue().strip(), 'Archived 4 orders')
+        self.assertEqual(ArchivedOrder.objects.count(), 4)
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertTrue(Order.objects.filter(pk=in_work_order.pk).exists())
+        self.assertEqual(self.get_stats(), stats_before)
+
+    def test_billing_counts_archived_orders_of_its_period(self):
+        # заказы прошлого биллинга оказываются в архиве, если день биллинга передвинули после архивации
+        order = self.create_order(1)
+        self.create_order(1)
+        billing_before = self.get_stats()[0]
+        ArchivedOrder.objects.bulk_create([ArchivedOrder.from_order(order)])
+        Order.objects.filter(pk=order.pk).delete()
+        self.assertEqual(self.get_stats()[0], billing_before)
 
-# Create your tests here.
+    def test_order_is_not_deleted_without_its_copy(self):
+        order = self.create_order(3)
+        ArchivedOrder.objects.create(
+            id=order.pk,
+            task='Другое задание',
+            client=self.client_user,
+            created_at=order.created_at,
+            closed_at=order.closed_at,
+            status=Order.Status.closed,
+        )
+        with self.assertRaises(IntegrityError):
+            Order.objects.archive(1)
+        self.assertTrue(Order.objects.filter(pk=order.pk).exists())
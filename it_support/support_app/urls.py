@@ -0,0 +1,19 @@
+from django.urls import path
+from rest_framework.routers import DefaultRouter
+
+from . import views
+
+router = DefaultRouter()
+router.register('orders', views.OrderViewSet, basename='order')
+
+urlpatterns = [
+    path('contractors/workload/', views.ContractorWorkloadView.as_view(), name='contractors-workload'),
+    path('reports/billing/', views.BillingReportView.as_view(), name='report-billing'),
+    path('reports/orders-stats/', views.OrdersStatsReportView.as_view(), name='report-orders-stats'),
+    path(
+        'reports/contractors-performance/',
+        views.ContractorsPerformanceReportView.as_view(),
+        name='report-contractors-performance',
+    ),
+    path('reports/tariffs-sla/', views.TariffsSlaReportView.as_view(), name='report-tariffs-sla'),
+] + router.urls
@@ -1,3 +1,242 @@
-from django.shortcuts import render
+import hashlib
+from datetime import datetime
+from functools import wraps
+from typing import Optional
 
-# Create your views here.
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.http import quote_etag
+from rest_framework import generics
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .analytics import calculate_contractors_performance
+from .models import Contractor
+from .models import Order
+from .models import SlaSketch
+from .models import get_names_watermark
+from .models import get_nearest_billing_start_date
+from .serializers import ContractorWorkloadSerializer
+from .serializers import OrderSerializer
+from .serializers import get_requested_fields
+
+
+# every day of the SLA report period without stored sketches is calculated and stored by the request
+MAX_SLA_PERIOD_DAYS = 366
+
+
+def orders_conditional_get(handler):
+    """
+    Answer 304 if orders were not changed since the client's ETag or Last-Modified.
+
+    Watermark is the last orders change time and orders count, so it costs one indexed
+    aggregate instead of building the response. Responses show nicks of clients and contractors
+    and tariff names, so their fingerprint and the time it changed are added too. Views which
+    data also depends on time (billing period, overdue orders) add the time since which the data is actual.
+    """
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        last_modified, orders_count = Order.objects.get_watermark()
+        names_fingerprint, names_changed_at = get_names_watermark()
+        for watermark in (names_changed_at, view.get_time_watermark()):
+            if watermark is not None and (last_modified is None or watermark > last_modified):
+                last_modified = watermark
+        etag_source = '|'.join([
+            request.get_full_path(),
+            str(last_modified),
+            str(orders_count),
+            names_fingerprint,
+            view.get_etag_extra(),
+        ])
+        etag = quote_etag(hashlib.md5(etag_source.encode()).hexdigest())
+        last_modified_timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        not_modified_response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified_timestamp,
+        )
+        if not_modified_response is not None:
+            return not_modified_response
+
+        response = handler(view, request, *args, **kwargs)
+        response['ETag'] = etag
+        if last_modified_timestamp is not None:
+            response['Last-Modified'] = http_date(last_modified_timestamp)
+        return response
+
+    return wrapper
+
+
+class ConditionalGetMixin:
+    def get_etag_extra(self) -> str:
+        """Data which changes response but is not an order"""
+        return ''
+
+    def get_time_watermark(self) -> Optional[datetime]:
+        """Time since which response is actual if orders were not changed"""
+        return None
+
+
+class BillingPeriodMixin(ConditionalGetMixin):
+    def get_time_watermark(self):
+        return get_nearest_billing_start_date()
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+
+
+class OrderViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = OrderSerializer
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        orders = Order.objects.select_related('client', 'contractor').defer('creds')
+        requested_fields = get_requested_fields(self.request)
+        if requested_fields and 'task' not in requested_fields:
+            orders = orders.defer('task')
+        if self.request.query_params.get('status'):
+            orders = orders.filter(status=self.request.query_params['status'])
+        return orders
+
+    def get_time_watermark(self):
+        if self.action == 'sla_breaches':
+            # orders become overdue without changes, so the answer is actual within a minute
+            return timezone.now().replace(second=0, microsecond=0)
+        return None
+
+    @orders_conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @orders_conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, url_path='sla-breaches')
+    @orders_conditional_get
+    def sla_breaches(self, request):
+        """Orders which are overdue for the tariff reaction time or in work longer than a day"""
+        orders = self.get_queryset().get_sla_breaches()
+        page = self.paginate_queryset(orders)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+
+class ContractorWorkloadView(BillingPeriodMixin, generics.ListAPIView):
+    serializer_class = ContractorWorkloadSerializer
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        return Contractor.objects.active().with_workload()
+
+    def get_etag_extra(self):
+        # deactivated contractors leave the list without orders changes
+        return ','.join(str(pk) for pk in Contractor.objects.active().order_by('pk').values_list('pk', flat=True))
+
+    @orders_conditional_get
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class BillingReportView(BillingPeriodMixin, APIView):
+    """Contractors billing for the previous billing period"""
+
+    @orders_conditional_get
+    def get(self, request):
+        return Response([
+            {
+                'contractor': contractor_billing['contractor__tg_nick'],
+                'orders_count': contractor_billing['count_orders'],
+            }
+            for contractor_billing in Order.objects.calculate_billing()
+        ])
+
+
+class OrdersStatsReportView(BillingPeriodMixin, APIView):
+    """Clients orders count per billing period"""
+
+    @orders_conditional_get
+    def get(self, request):
+        return Response([
+            {
+                'billing_start': billing_start,
+                'client': client,
+                'orders_count': orders_count,
+            }
+            for billing_start, client, orders_count in Order.objects.calculate_average_orders_in_month()
+        ])
+
+
+class ContractorsPerformanceReportView(BillingPeriodMixin, APIView):
+    """Contractors close time, estimate accuracy and closed orders per billing period"""
+
+    def get_billing_periods(self) -> int:
+        try:
+            return min(max(int(self.request.query_params.get('billing_periods', 3)), 1), 24)
+        except ValueError:
+            return 3
+
+    @orders_conditional_get
+    def get(self, request):
+        billing_starts, contractors_performance = calculate_contractors_performance(self.get_billing_periods())
+        return Response({
+            'billing_starts': billing_starts,
+            'contractors': contractors_performance,
+        })
+
+
+class TariffsSlaReportView(ConditionalGetMixin, APIView):
+    """Reaction and resolution time percentiles per tariff, ?start=YYYY-MM-DD&end=YYYY-MM-DD"""
+
+    def get_period(self):
+        """
+        Period of the report, start is moved to the day of the oldest order, there is nothing before it.
+
+        Period longer than MAX_SLA_PERIOD_DAYS or ending before it starts is answered with 400
+        """
+        today = timezone.localdate()
+        try:
+            start_day = parse_date(self.request.query_params.get('start', ''))
+            end_day = parse_date(self.request.query_params.get('end', ''))
+        except ValueError:
+            start_day = end_day = None
+        start_day = start_day or timezone.localdate(get_nearest_billing_start_date())
+        end_day = min(end_day or today, today)
+        if start_day > end_day:
+            raise ValidationError({'start': 'start of the period is after its end'})
+        first_day = SlaSketch.objects.get_first_day() or end_day
+        start_day = min(max(start_day, first_day), end_day)
+        if (end_day - start_day).days >= MAX_SLA_PERIOD_DAYS:
+            raise ValidationError({'start': f'period is longer than {MAX_SLA_PERIOD_DAYS} days'})
+        return start_day, end_day
+
+    def get_time_watermark(self):
+        # today's orders durations are in the report, so the answer is actual within a minute
+        return timezone.now().replace(second=0, microsecond=0)
+
+    @orders_conditional_get
+    def get(self, request):
+        start_day, end_day = self.get_period()
+        return Response([
+            {
+                'tariff': tariff,
+                'metric': metric,
+                'orders_count': orders_count,
+                'p50_minutes': p50,
+                'p90_minutes': p90,
+                'p99_minutes': p99,
+            }
+            for tariff, metric, orders_count, p50, p90, p99
+            in SlaSketch.objects.calculate_percentiles(start_day, end_day)
+        ])
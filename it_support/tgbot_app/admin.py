@@ -1,3 +1,22 @@
 from django.contrib import admin
 
-# Register your models here.
+from . import models as m
+
+
+@admin.register(m.OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'chat_id', 'status', 'attempts', 'created_at', 'processed_at')
+    list_filter = ('status',)
+    show_full_result_count = False
+
+
+@admin.register(m.SchedulerLease)
+class SchedulerLeaseAdmin(admin.ModelAdmin):
+    list_display = ('name', 'holder', 'acquired_at', 'heartbeat_at', 'expires_at')
+    readonly_fields = ('name', 'holder', 'acquired_at', 'heartbeat_at', 'expires_at')
+
+
+@admin.register(m.NotifierWatermark)
+class NotifierWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('name', 'order_id', 'order_created_at', 'scanned_at')
+    readonly_fields = ('name', 'order_id', 'order_created_at', 'scanned_at')
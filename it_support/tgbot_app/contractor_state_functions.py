@@ -1,23 +1,28 @@
 from textwrap import dedent
 
+from cryptography.fernet import InvalidToken
 from telegram import InlineKeyboardButton
 from telegram import InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext.callbackcontext import CallbackContext
 from telegram.update import Update
 
 from support_app.models import Order
 from support_app.models import SystemSettings
 from support_app.models import Contractor
+from tgbot_app.menus import show_menu
+from tgbot_app.relay import order_pairings
+from tgbot_app.relay import relay_message
 
 import logging
 
 logger = logging.getLogger('tgbot_app_info')
+error_logger = logging.getLogger('tgbot_app_error')
 
 
-def start_contractor(update: Update, context: CallbackContext) -> str:
-    """Contractor start function which send a menu"""
+def start_contractor(update: Update, context: CallbackContext, notice: str = '') -> str:
+    """Contractor start function which show a menu, notice is the answer to the previous action"""
     logger.info('function "start_contractor" was run with the /start command')
-    chat_id = update.effective_chat.id
     keyboard = [
         [InlineKeyboardButton('Как это работает?', callback_data='how_contractor_bot_work')],
         [InlineKeyboardButton('Посмотреть заказы', callback_data='watch_orders')],
@@ -26,7 +31,7 @@ def start_contractor(update: Update, context: CallbackContext) -> str:
         [InlineKeyboardButton('Мой заработок за месяц', callback_data='my_salary')],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    context.bot.send_message(text='Выберите действие', reply_markup=reply_markup, chat_id=chat_id)
+    show_menu(update, context, 'Выберите действие', reply_markup, notice)
     logger.info('function "start_contractor" ended\n')
     return 'HANDLE_MENU_CONTRACTOR'
 
@@ -45,8 +50,7 @@ def handle_watch_orders_callback(
     available_orders = list(Order.objects.get_available())
     if not available_orders:
         message = 'Нет заказов, которые можно взять в работу'
-        context.bot.send_message(text=message, chat_id=chat_id)
-        return True, start_contractor(update, context), ''
+        return True, start_contractor(update, context, message), ''
     for i, order in enumerate(available_orders):
         # send every order in different message because it contains button to take order
         message = dedent(f'''
@@ -65,9 +69,9 @@ def handle_watch_orders_callback(
 
 
 def handle_send_message_to_client_callback(
+        update: Update,
         context: CallbackContext,
         contractor: Contractor,
-        chat_id: str,
 ) -> tuple[bool, str, str]:
     """
     Handling send message to client callbacks.
@@ -76,13 +80,16 @@ def handle_send_message_to_client_callback(
     """
     logger.info('function "handle_send_message_to_client_callback" was run')
     message = 'У вас нет активного заказа'
-    if contractor.has_order_in_work():
-        message = 'Напишите сообщение клиенту'
+    if order_pairings.get(contractor) is not None:
+        message = dedent('''
+        Все ваши сообщения, в том числе фото и файлы, будут пересланы клиенту
+        Чтобы вернуться в меню, нажмите "Вернуться назад" или отправьте /start
+        ''')
         keyboard = [
             [InlineKeyboardButton('Вернуться назад', callback_data='get_back')],
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.send_message(text=message, chat_id=chat_id, reply_markup=reply_markup)
+        show_menu(update, context, message, reply_markup)
         return True, 'WAIT_MESSAGE_TO_CLIENT_CONTRACTOR', ''
     logger.info('function "handle_send_message_to_client_callback" ended\n')
     return False, '', message
@@ -92,7 +99,6 @@ def handle_take_order_callback(
         update: Update,
         context: CallbackContext,
         contractor: Contractor,
-        chat_id: str,
 ) -> tuple[bool, str, str]:
     """
     Handling take order callbacks.
@@ -107,8 +113,7 @@ def handle_take_order_callback(
         # it unnature limit, because now messages and close work not support many orders
         message = 'У вас уже есть активный заказ в работе'
         # fast send message and return for not spend time in checks below
-        context.bot.send_message(text=message, chat_id=chat_id)
-        return True, start_contractor(update, context), ''
+        return True, start_contractor(update, context, message), ''
 
     # check if order exist
     try:
@@ -129,12 +134,12 @@ def handle_take_order_callback(
                 Оценка от 1 до 24 часов, если вы считаете, что заказ потребует больше времени
                 обратитесь к менеджерам, мы не оказываем проектную поддержку
                 ''')
-        context.user_data['order_in_process'] = order
+        context.user_data.order_in_process_id = order.pk
         keyboard = [
             [InlineKeyboardButton('Вернуться в начало', callback_data='return_to_start')],
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.send_message(text=message, chat_id=chat_id, reply_markup=reply_markup)
+        show_menu(update, context, message, reply_markup)
         return True, 'WAIT_ESTIMATE_CONTRACTOR', ''
         logger.info('function "handle_take_order_callback" ended\n')
     return False, '', message
@@ -155,6 +160,7 @@ def handle_close_order_callback(
         order_in_work = contractor.get_order_in_work()
         client_chat_id = order_in_work.client.telegram_id
         order_in_work.close_work()
+        order_pairings.forget(order_in_work.client_id, contractor.pk)
         # also notify client
         message_to_client = dedent('''
                 Подрядчик выполнил ваш заказ, делаем успехов в вашем бизнесе!
@@ -193,7 +199,7 @@ def handle_menu_contractor(update: Update, context: CallbackContext) -> str:
     logger.info('function "handle_menu_contractor" was run')
     chat_id = update.effective_chat.id
     query = update.callback_query
-    contractor = context.user_data['user'].contractor
+    contractor = context.user_data.user.contractor
     is_call_handlers = False
 
     message = 'Я вас не понял, нажмите одну из предложенных кнопок'  # answer when no one of if is True
@@ -221,7 +227,7 @@ def handle_menu_contractor(update: Update, context: CallbackContext) -> str:
         is_return, what_return, message = handle_watch_orders_callback(update, context, chat_id)
         is_call_handlers = True
     elif query and query.data == 'send_message_to_client':  # contractor request to send message to client
-        is_return, what_return, message = handle_send_message_to_client_callback(context, contractor, chat_id)
+        is_return, what_return, message = handle_send_message_to_client_callback(update, context, contractor)
         is_call_handlers = True
     elif query and query.data == 'close_order':  # contractor request to close active order
         is_return, what_return, message = handle_close_order_callback(context, contractor)
@@ -230,44 +236,39 @@ def handle_menu_contractor(update: Update, context: CallbackContext) -> str:
         is_return, what_return, message = handle_my_salary_callback(contractor)
         is_call_handlers = True
     elif query and query.data.startswith('take_order'):  # contractor request to take order
-        is_return, what_return, message = handle_take_order_callback(update, context, contractor, chat_id)
+        is_return, what_return, message = handle_take_order_callback(update, context, contractor)
         is_call_handlers = True
 
     if is_call_handlers and is_return:
         return what_return
 
-    context.bot.send_message(text=message, chat_id=chat_id)
     logger.info('function "handle_menu_contractor" ended\n')
-    return start_contractor(update, context)
+    return start_contractor(update, context, message)
 
 
 def wait_message_to_client_contractor(update: Update, context: CallbackContext) -> str:
-    """Handler of waiting contractor message to client"""
+    """Chat mode of contractor with client, every message is copied to client until contractor goes back"""
     logger.info('function "wait_message_to_client_contractor" was run')
     chat_id = update.effective_chat.id
     query = update.callback_query
-    no_text_message = True
-    if update.message:
-        message_to_client = update.message.text
-        no_text_message = False
-    contractor = context.user_data['user'].contractor
-
     if query and query.data in ['get_back', 'return_to_start']:
         return start_contractor(update, context)
-    elif not contractor.has_order_in_work() or no_text_message:  # if order disappeared or contractor send not a text
-        message = 'Что-то пошло не так, попробуйте снова'
-    else:
-        order = contractor.get_order_in_work()
 
-        # send message to client
-        client_chat_id = order.client.telegram_id
-        message_to_client = f'Вам сообщение от подрядчика вашего заказа:\n\n{message_to_client}'
-        context.bot.send_message(text=message_to_client, chat_id=client_chat_id)
+    pairing = order_pairings.get(context.user_data.user)
+    if pairing is None:  # order was closed or released
+        return start_contractor(update, context, 'У вас нет активного заказа')
+    if update.message is None:  # button of an old message
+        message = 'Вы в режиме переписки с клиентом, чтобы вернуться в меню отправьте /start'
+        context.bot.send_message(text=message, chat_id=chat_id)
+        return 'WAIT_MESSAGE_TO_CLIENT_CONTRACTOR'
 
-        message = 'Сообщение успешно отправлено, когда заказчик ответит вам придет уведомление'
-    context.bot.send_message(text=message, chat_id=chat_id)
+    try:
+        relay_message(context.bot, update.message, pairing.chat_id, 'Вам сообщение от подрядчика вашего заказа:')
+    except TelegramError:
+        message = 'Не удалось переслать сообщение клиенту, попробуйте снова'
+        context.bot.send_message(text=message, chat_id=chat_id)
     logger.info('function "wait_message_to_client_contractor" ended\n')
-    return start_contractor(update, context)
+    return 'WAIT_MESSAGE_TO_CLIENT_CONTRACTOR'
 
 
 def wait_estimate_contractor(update: Update, context: CallbackContext) -> str:
@@ -276,11 +277,11 @@ def wait_estimate_contractor(update: Update, context: CallbackContext) -> str:
     chat_id = update.effective_chat.id
     query = update.callback_query
     no_text_message = True
-    if update.message:
+    if update.message and update.message.text:
         estimated_time_hours = update.message.text
         no_text_message = False
-    order_in_process = context.user_data['order_in_process']
-    contractor = context.user_data['user'].contractor
+    order_in_process = context.user_data.get_order_in_process()
+    contractor = context.user_data.user.contractor
     if query and query.data == 'return_to_start':
         return start_contractor(update, context)
     elif order_in_process and order_in_process.status != Order.Status.created:  # check if order available and in context
@@ -295,23 +296,32 @@ def wait_estimate_contractor(update: Update, context: CallbackContext) -> str:
             if 1 <= estimated_time_hours <= 24:  # limit from DB
                 client_chat_id = order_in_process.client.telegram_id
                 order_in_process.take_in_work(contractor, estimated_time_hours)
-                context.user_data['order_in_process'] = None
+                order_pairings.forget(order_in_process.client_id, contractor.pk)
+                context.user_data.order_in_process_id = None
                 message_to_client = 'Ваш заказ взят работу! При выполнении пришлем уведомление.'
                 context.bot.send_message(text=message_to_client, chat_id=client_chat_id)
-                # TODO: дешифрование кредсов
+                try:
+                    creds = order_in_process.decode_creds(order_in_process.creds)
+                except InvalidToken:
+                    # key of the creds is not in settings, contractor gets them from a manager
+                    error_logger.error(f'creds of order {order_in_process.pk} were not decrypted')
+                    creds = 'не удалось расшифровать, запросите их у менеджера'
                 message = dedent(f'''
                 Заказ успешно взят в работу, приятной работы
 
                 Доступы к сайту:
-                {order_in_process.creds}
+                {creds}
                 ''')
+                # own message, not a notice of the menu which is edited later
+                context.bot.send_message(text=message, chat_id=chat_id)
+                return start_contractor(update, context)
             else:
                 message = 'Оценка должна быть от 1 до 24 часов, попробуйте снова или обратитесь к менеджеру'
                 keyboard = [
                     [InlineKeyboardButton('Вернуться в начало', callback_data='return_to_start')],
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
-                context.bot.send_message(text=message, chat_id=chat_id, reply_markup=reply_markup)
+                show_menu(update, context, message, reply_markup)
                 return 'WAIT_ESTIMATE_CONTRACTOR'
         except ValueError:
             # estimate not a number
@@ -319,6 +329,5 @@ def wait_estimate_contractor(update: Update, context: CallbackContext) -> str:
             context.bot.send_message(text=message, chat_id=chat_id)
             return 'WAIT_ESTIMATE_CONTRACTOR'
 
-    context.bot.send_message(text=message, chat_id=chat_id)
     logger.info('function "wait_estimate_contractor" ended\n')
-    return start_contractor(update, context)
+    return start_contractor(update, context, message)
@@ -0,0 +1,174 @@
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Optional
+
+from support_app.models import BotUser
+from support_app.models import Order
+from tgbot_app.drafts import EMPTY_DRAFT
+from tgbot_app.drafts import Draft
+from tgbot_app.drafts import DraftStore
+
+logger = logging.getLogger('tgbot_app_error')
+
+# chats without updates this long are forgotten, their conversation state is in BotUser.bot_state
+CHAT_CONTEXT_TTL_SECONDS = 60 * 60
+# the least recently active chats are forgotten over this number
+CHAT_CONTEXT_MAX_CHATS = 100_000
+
+
+class ChatContext:
+    """
+    Conversation data of a chat between updates, only ids and primitives.
+
+    user is set by get_user for the current update only and cleared after it, so ORM
+    instances don't live between updates and objects are read from the database again.
+    order_in_process_id and creating_order_task are the draft which is saved to DraftStore,
+    menu_message_id is the last menu of the chat, which show_menu edits in place
+    """
+    __slots__ = (
+        'role', 'order_in_process_id', 'creating_order_task', 'touched_at', 'user', 'saved_draft', 'menu_message_id',
+        'is_relaying',
+    )
+
+    def __init__(self, now: float = 0):
+        # role of the user from the previous update, for the throttler which goes before get_user
+        self.role: Optional[str] = None
+        self.order_in_process_id: Optional[int] = None
+        self.creating_order_task: Optional[str] = None
+        self.touched_at = now
+        self.user: Optional[BotUser] = None
+        self.saved_draft = EMPTY_DRAFT
+        self.menu_message_id: Optional[int] = None
+        # the user is in chat mode after the previous update, for the throttler too
+        self.is_relaying = False
+
+    def get_draft(self) -> Draft:
+        return self.order_in_process_id, self.creating_order_task
+
+    def set_draft(self, draft: Draft) -> None:
+        self.order_in_process_id, self.creating_order_task = draft
+        self.saved_draft = draft
+
+    def get_order_in_process(self) -> Optional[Order]:
+        """Order is read on every call, so its status is current"""
+        if self.order_in_process_id is None:
+            return None
+        return Order.objects.filter(pk=self.order_in_process_id).first()
+
+
+class ChatContextStore:
+    """
+    Replacement of dispatcher.user_data: ChatContext by user id with TTL and LRU eviction.
+
+    Dispatcher only gets items by user id, a missing one is created like in defaultdict.
+    With drafts a missing chat is loaded from them, and changed drafts of chats touched
+    since the previous flush_drafts are saved in one batch
+    """
+
+    def __init__(
+            self,
+            ttl_seconds: float = CHAT_CONTEXT_TTL_SECONDS,
+            max_chats: int = CHAT_CONTEXT_MAX_CHATS,
+            drafts: Optional[DraftStore] = None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_chats = max_chats
+        self.drafts = drafts
+        self.lock = threading.Lock()
+        # the least recently active chats go first
+        self.chats: OrderedDict[int, ChatContext] = OrderedDict()
+        self.touched_chats: set[int] = set()
+        # drafts of forgotten chats and of failed flushes waiting for the next flush
+        self.unsaved_drafts: dict[int, Draft] = {}
+
+    def __getitem__(self, user_id: int) -> ChatContext:
+        now = monotonic()
+        with self.lock:
+            chat = self.chats.get(user_id)
+            if chat is None:
+                chat = ChatContext(now)
+                if self.drafts is not None:
+                    chat.set_draft(self.load_draft(user_id))
+                self.chats[user_id] = chat
+                if len(self.chats) > self.max_chats:
+                    self.forget(*next(iter(self.chats.items())))
+            else:
+                chat.touched_at = now
+                self.chats.move_to_end(user_id)
+            if self.drafts is not None:
+                self.touched_chats.add(user_id)
+        return chat
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.chats
+
+    def __len__(self) -> int:
+        return len(self.chats)
+
+    def keys(self) -> list[int]:
+        with self.lock:
+            return list(self.chats)
+
+    def load_draft(self, user_id: int) -> Draft:
+        if user_id in self.unsaved_drafts:
+            # stays there to be saved by the next flush
+            return self.unsaved_drafts[user_id]
+        try:
+            return self.drafts.load(user_id)
+        except sqlite3.Error as error:
+            logger.error(f'draft of {user_id} was not loaded: {error}')
+            return EMPTY_DRAFT
+
+    def forget(self, user_id: int, chat: ChatContext) -> None:
+        """Remove chat, its draft is kept for the next flush if it is not saved yet"""
+        del self.chats[user_id]
+        if user_id in self.touched_chats:
+            self.touched_chats.discard(user_id)
+            if chat.get_draft() != chat.saved_draft:
+                self.unsaved_drafts[user_id] = chat.get_draft()
+
+    def prune(self) -> int:
+        """Forget chats idle longer than ttl, returns how many were forgotten"""
+        idle_since = monotonic() - self.ttl_seconds
+        pruned_count = 0
+        with self.lock:
+            while self.chats:
+                user_id, chat = next(iter(self.chats.items()))
+                if chat.touched_at > idle_since:
+                    break
+                self.forget(user_id, chat)
+                pruned_count += 1
+        return pruned_count
+
+    def flush_drafts(self) -> int:
+        """Save changed drafts in one transaction, returns how many were saved"""
+        if self.drafts is None:
+            return 0
+        with self.lock:
+            changed_drafts, self.unsaved_drafts = self.unsaved_drafts, {}
+            for user_id in list(self.touched_chats):
+                chat = self.chats[user_id]
+                draft = chat.get_draft()
+                if draft != chat.saved_draft:
+                    changed_drafts[user_id] = draft
+                    chat.saved_draft = draft
+                # chat in the middle of an update can change after this flush, it is checked again by the next one
+                if chat.user is None:
+                    self.touched_chats.discard(user_id)
+        try:
+            self.drafts.save(changed_drafts)
+        except sqlite3.Error as error:
+            logger.error(f'{len(changed_drafts)} drafts were not saved: {error}')
+            with self.lock:
+                self.unsaved_drafts = {**changed_drafts, **self.unsaved_drafts}
+            return 0
+        return len(changed_drafts)
+
+    def close(self) -> None:
+        """Save drafts on shutdown"""
+        if self.drafts is not None:
+            self.flush_drafts()
+            self.drafts.close()
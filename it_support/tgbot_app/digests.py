@@ -0,0 +1,52 @@
+from django.utils import timezone
+
+from support_app.models import Order
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def split_message(blocks: list[str], limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """Join text blocks into messages not longer than limit, messages are split only between blocks"""
+    messages = []
+    current_message = ''
+    for block in blocks:
+        if len(block) > limit:
+            block = block[:limit - 1] + '…'
+        if current_message and len(current_message) + len(block) > limit:
+            messages.append(current_message)
+            current_message = ''
+        current_message += block
+    if current_message:
+        messages.append(current_message)
+    return messages
+
+
+def build_manager_digest(orders_not_in_work: list[Order], orders_not_closed: list[Order]) -> list[str]:
+    """Render overdue orders of both kinds once into messages which fit in telegram limit"""
+    blocks = []
+    if orders_not_in_work:
+        blocks.append('Есть заказы, которые долго не берут в работу\n\n')
+        blocks += [
+            f'Задача: {order.task} \nКонтакт клиента: @{order.client.tg_nick}\n\n'
+            for order in orders_not_in_work
+        ]
+    if orders_not_closed:
+        blocks.append('Есть заказы, которые не выполнены\n\n')
+        blocks += [
+            f'Задача: {order.task}\nКонтакт подрядчика: @{order.contractor.tg_nick}\n'
+            f'Контакт клиента: @{order.client.tg_nick}\n\n'
+            for order in orders_not_closed
+        ]
+    return split_message(blocks)
+
+
+def build_search_results(orders: list[Order]) -> list[str]:
+    """Render found orders, the most relevant first, into messages which fit in telegram limit"""
+    if not orders:
+        return ['Заказы не найдены']
+    blocks = [
+        f'Заказ №{order.pk} ({order.status}, {timezone.localtime(order.created_at):%d.%m.%Y})\n'
+        f'Клиент: @{order.client.tg_nick}\nЗадача: {order.task}\n\n'
+        for order in orders
+    ]
+    return split_message(blocks)
@@ -0,0 +1,72 @@
+import sqlite3
+import threading
+from pathlib import Path
+from time import time
+from typing import Optional
+from typing import Union
+
+# (order_in_process_id, creating_order_task) of ChatContext
+Draft = tuple[Optional[int], Optional[str]]
+EMPTY_DRAFT: Draft = (None, None)
+# changed drafts are written in one transaction this often, and on shutdown
+DRAFTS_FLUSH_SECONDS = 5
+# abandoned drafts are deleted after a week
+DRAFT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+class DraftStore:
+    """
+    Drafts of conversations in a local SQLite file, so they survive restarts of the bot.
+
+    The file is separate from the main database and is in WAL mode with synchronous=NORMAL:
+    a batch of drafts is one short transaction without fsync of every commit, committed
+    drafts survive a crash of the process
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS chat_draft ('
+            'user_id INTEGER PRIMARY KEY, '
+            'order_in_process_id INTEGER, '
+            'creating_order_task TEXT, '
+            'updated_at REAL NOT NULL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS chat_draft_updated_at_idx ON chat_draft (updated_at)')
+
+    def load(self, user_id: int) -> Draft:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT order_in_process_id, creating_order_task FROM chat_draft WHERE user_id = ?',
+                (user_id,),
+            ).fetchone()
+        return row if row is not None else EMPTY_DRAFT
+
+    def save(self, drafts: dict[int, Draft]) -> None:
+        """Write drafts in one transaction, empty drafts are deleted"""
+        if not drafts:
+            return
+        now = time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'DELETE FROM chat_draft WHERE user_id = ?',
+                [(user_id,) for user_id, draft in drafts.items() if draft == EMPTY_DRAFT],
+            )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO chat_draft '
+                '(user_id, order_in_process_id, creating_order_task, updated_at) VALUES (?, ?, ?, ?)',
+                [(user_id, *draft, now) for user_id, draft in drafts.items() if draft != EMPTY_DRAFT],
+            )
+
+    def purge(self, ttl_seconds: float = DRAFT_TTL_SECONDS) -> int:
+        """Delete drafts not changed for ttl, returns how many were deleted"""
+        with self.lock, self.connection:
+            cursor = self.connection.execute('DELETE FROM chat_draft WHERE updated_at < ?', (time() - ttl_seconds,))
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
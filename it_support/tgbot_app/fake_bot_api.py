@@ -0,0 +1,248 @@
+import json
+import random
+import threading
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from itertools import count
+from time import perf_counter
+from time import sleep
+from typing import Iterable
+from typing import Optional
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from tgbot_app.loadtest import TEXT
+from tgbot_app.loadtest import ChatsButtons
+from tgbot_app.loadtest import SimulatedUser
+from tgbot_app.loadtest import UpdateFactory
+from tgbot_app.loadtest import build_sent_message
+from tgbot_app.loadtest import format_latencies
+
+# methods the bot uses, other methods are answered as Bot API answers unknown ones
+SUPPORTED_METHODS = [
+    'getMe',
+    'deleteWebhook',
+    'getUpdates',
+    'sendMessage',
+    'sendDocument',
+    'copyMessage',
+    'editMessageText',
+    'answerCallbackQuery',
+]
+# only requests of these methods get injected 429, so the bot can start and poll
+LIMITED_METHODS = ['sendMessage', 'sendDocument', 'copyMessage', 'editMessageText', 'answerCallbackQuery']
+MAX_UPDATES_LIMIT = 100
+
+
+def get_update_chat_id(update: dict) -> Optional[int]:
+    message = update.get('message') or update.get('callback_query', {}).get('message')
+    return message['chat']['id'] if message else None
+
+
+class FakeBotApi:
+    """
+    Local stand-in of Telegram Bot API for end to end tests of start_bot.
+
+    Updates are put to the feed and given away by getUpdates with long polling, answers of send
+    and edit methods look like Telegram ones. Every request waits the latency and requests of
+    LIMITED_METHODS get 429 with the given probability. Time from an update put to the feed
+    to the first answer of the bot in the chat is the end to end latency
+    """
+
+    def __init__(
+            self,
+            latency: float = 0,
+            too_many_requests_rate: float = 0,
+            retry_after: int = 1,
+            seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.too_many_requests_rate = too_many_requests_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.condition = threading.Condition()
+        self.updates: list[dict] = []
+        self.update_ids = count(1)
+        self.message_ids = count(1)
+        self.buttons = ChatsButtons()
+        self.calls = Counter()
+        self.too_many_requests = Counter()
+        # chats waiting for an answer of the bot, with the moment of the first unanswered update
+        self.waiting_chats: dict[int, float] = {}
+        self.callback_queries_chats: dict[str, int] = {}
+        self.latencies: list[float] = []
+        self.pushed_updates = 0
+
+    def push_update(self, update: dict) -> None:
+        chat_id = get_update_chat_id(update)
+        with self.condition:
+            update['update_id'] = next(self.update_ids)
+            self.updates.append(update)
+            self.pushed_updates += 1
+            if chat_id is not None:
+                self.waiting_chats.setdefault(chat_id, perf_counter())
+            if 'callback_query' in update:
+                self.callback_queries_chats[update['callback_query']['id']] = chat_id
+            self.condition.notify_all()
+
+    def get_updates(self, offset: int, limit: int, timeout: float) -> list[dict]:
+        """Long polling: updates before offset are confirmed, wait up to timeout for new ones"""
+        with self.condition:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            self.condition.wait_for(lambda: self.updates, timeout)
+            return self.updates[:limit]
+
+    def answer_chat(self, chat_id: Optional[int]) -> None:
+        with self.condition:
+            pushed_at = self.waiting_chats.pop(chat_id, None)
+            if pushed_at is not None:
+                self.latencies.append(perf_counter() - pushed_at)
+
+    def call(self, method: str, data: dict) -> tuple[int, dict]:
+        """Answer to the method call as HTTP status and body"""
+        if self.latency:
+            sleep(self.latency)
+        with self.condition:
+            self.calls[method] += 1
+            if method in LIMITED_METHODS and self.random.random() < self.too_many_requests_rate:
+                self.too_many_requests[method] += 1
+                return 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                }
+
+        if method not in SUPPORTED_METHODS:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'ITSupport', 'username': 'it_support_fake_bot'}
+        elif method == 'getUpdates':
+            result = self.get_updates(
+                int(data.get('offset', 0)),
+                min(int(data.get('limit', MAX_UPDATES_LIMIT)), MAX_UPDATES_LIMIT),
+                float(data.get('timeout', 0)),
+            )
+        elif method == 'answerCallbackQuery':
+            with self.condition:
+                chat_id = self.callback_queries_chats.pop(data.get('callback_query_id'), None)
+            self.answer_chat(chat_id)
+            result = True
+        elif method in ['sendMessage', 'sendDocument', 'copyMessage', 'editMessageText']:
+            if 'chat_id' not in data:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat_id is empty'}
+            chat_id = int(data['chat_id'])
+            self.answer_chat(chat_id)
+            # message_id of copyMessage is the id of the copied message
+            message_id = int(data['message_id']) if method.startswith('edit') else next(self.message_ids)
+            self.buttons.remember(method, chat_id, message_id, data.get('reply_markup'))
+            if method == 'copyMessage':
+                # the copy is a new message, only its id is returned
+                result = {'message_id': message_id}
+            else:
+                result = build_sent_message(message_id, chat_id, data.get('text', ''))
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+    def get_report(self) -> list[str]:
+        with self.condition:
+            latencies = np.array(self.latencies) * 1000
+            report = [
+                f'pushed updates: {self.pushed_updates}, answered: {len(latencies)}, '
+                f'chats waiting for an answer: {len(self.waiting_chats)}',
+            ]
+            if len(latencies):
+                report.append(f'latency to the first answer: {format_latencies(latencies)}')
+            report += [
+                f'{method}: {calls} calls, {self.too_many_requests[method]} answered with 429'
+                for method, calls in sorted(self.calls.items())
+            ]
+        return report
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    """Requests to /bot<token>/<method>, the token is not checked"""
+    # keep-alive, the bot reuses connections of its pool
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeBotApiServer'
+
+    def do_GET(self):
+        self.handle_method(dict(parse_qsl(urlsplit(self.path).query)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            data = json.loads(body or b'{}')
+        elif content_type.startswith('multipart/form-data'):
+            data = self.parse_multipart(content_type, body)
+        else:
+            data = dict(parse_qsl(body.decode()))
+        self.handle_method(data)
+
+    @staticmethod
+    def parse_multipart(content_type: str, body: bytes) -> dict:
+        """Form of sendDocument, file contents are bytes"""
+        message = BytesParser(policy=HTTP).parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+        return {
+            part.get_param('name', header='content-disposition'): part.get_content()
+            for part in message.iter_parts()
+        }
+
+    def handle_method(self, data: dict) -> None:
+        path_parts = urlsplit(self.path).path.strip('/').split('/')
+        if len(path_parts) != 2 or not path_parts[0].startswith('bot'):
+            status, answer = 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        else:
+            status, answer = self.server.api.call(path_parts[1], data)
+        content = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # every getUpdates and sendMessage would be printed otherwise
+        pass
+
+
+class FakeBotApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], api: FakeBotApi):
+        super().__init__(address, FakeBotApiHandler)
+        self.api = api
+
+
+def read_script(lines: Iterable[str]) -> list[tuple[float, dict]]:
+    """
+    Scripted feed, every line is json like
+    {"at": 1.5, "chat_id": 1, "username": "client", "text": "/start"} or with "data" of a callback
+    """
+    factory = UpdateFactory()
+    feed = []
+    for line in lines:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        user = SimulatedUser(item['chat_id'], item['username'], role='')
+        step = item['data'] if 'data' in item else (TEXT, item['text'])
+        feed.append((float(item['at']), factory.build(user, step)))
+    return sorted(feed, key=lambda item: item[0])
+
+
+def play_feed(api: FakeBotApi, feed: Iterable[tuple[float, dict]]) -> None:
+    """Put updates to the api at their moments, counted from the start"""
+    started_at = perf_counter()
+    for moment, update in feed:
+        delay = started_at + moment - perf_counter()
+        if delay > 0:
+            sleep(delay)
+        api.push_update(update)
@@ -0,0 +1,420 @@
+import heapq
+import json
+import logging
+import random
+import threading
+from collections import Counter
+from decimal import Decimal
+from itertools import count
+from time import perf_counter
+from time import time
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+from typing import Union
+
+import numpy as np
+from django.db import OperationalError
+from django.db.transaction import atomic
+from telegram import Bot
+from telegram import Update
+from telegram.utils.request import Request
+
+from support_app.models import BotUser
+from support_app.models import Client
+from support_app.models import Contractor
+from support_app.models import Tariff
+
+# one of the steps of a scenario: callback data, a command, (TEXT, text of message)
+# or a function which chooses one of them by what the bot has sent to the user
+TEXT = 'text'
+Step = Union[str, tuple[str, str], Callable[['SimulatedUser', 'ChatsButtons'], Union[str, tuple[str, str]]]]
+
+DISPATCHER_THREAD_NAME = 'dispatcher'
+
+# write statements longer than this are counted as waited for the database lock
+LOCK_WAIT_THRESHOLD_SECONDS = 0.05
+
+
+class ChatsButtons:
+    """Buttons of the last inline keyboards sent to every chat with their messages, so simulated users can press them"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # callback data to id of the message with the button, the last sent go last
+        self.chats_buttons: dict[int, dict[str, int]] = {}
+
+    def remember(self, method: str, chat_id: int, message_id: int, reply_markup: Union[str, dict, None]) -> None:
+        if reply_markup is None:
+            return
+        # bot sends the markup serialized to json
+        reply_markup = json.loads(reply_markup) if isinstance(reply_markup, str) else reply_markup
+        buttons = [
+            button['callback_data']
+            for row in reply_markup.get('inline_keyboard', [])
+            for button in row
+            if 'callback_data' in button
+        ]
+        with self.lock:
+            # orders are sent one by one, buttons of all of them are available
+            chat_buttons = self.chats_buttons.setdefault(chat_id, {})
+            if method.startswith('edit'):
+                # buttons of the edited message are replaced
+                edited_buttons = [button for button, button_id in chat_buttons.items() if button_id == message_id]
+                for button in edited_buttons:
+                    del chat_buttons[button]
+            for button in buttons:
+                chat_buttons.pop(button, None)
+                chat_buttons[button] = message_id
+            while len(chat_buttons) > 100:
+                del chat_buttons[next(iter(chat_buttons))]
+
+    def get(self, chat_id: int) -> list[str]:
+        with self.lock:
+            return list(self.chats_buttons.get(chat_id, {}))
+
+    def get_message_id(self, chat_id: int, button: str) -> Optional[int]:
+        with self.lock:
+            return self.chats_buttons.get(chat_id, {}).get(button)
+
+
+def build_sent_message(message_id: int, chat_id: int, text: str) -> dict:
+    """Message returned by send and edit methods of Bot API"""
+    return {
+        'message_id': message_id,
+        'date': int(time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'text': text,
+    }
+
+
+class FakeBot(Bot):
+    """Bot which never goes to Telegram, every api call is answered locally"""
+
+    def __init__(self, token: str, api_latency: float = 0, on_call: Optional[Callable[[str], None]] = None):
+        # dispatcher and jobs call the bot from different threads
+        super().__init__(token, request=Request(con_pool_size=8))
+        self.api_latency = api_latency
+        # called with the method name when the call is answered
+        self.on_call = on_call
+        self.lock = threading.Lock()
+        self.message_ids = count(1)
+        self.calls = Counter()
+        self.buttons = ChatsButtons()
+
+    def _post(self, endpoint: str, data: dict = None, timeout=None, api_kwargs: dict = None):
+        data = {**(data or {}), **(api_kwargs or {})}
+        if self.api_latency:
+            threading.Event().wait(self.api_latency)
+        with self.lock:
+            self.calls[endpoint] += 1
+        if self.on_call is not None:
+            self.on_call(endpoint)
+        if endpoint == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'ITSupport', 'username': 'it_support_load_test_bot'}
+        if not endpoint.startswith(('send', 'edit', 'copy')) or 'chat_id' not in data:
+            return True
+
+        chat_id = int(data['chat_id'])
+        message_id = int(data['message_id']) if endpoint.startswith('edit') else next(self.message_ids)
+        self.buttons.remember(endpoint, chat_id, message_id, data.get('reply_markup'))
+        if endpoint == 'copyMessage':
+            return {'message_id': message_id}
+        return build_sent_message(message_id, chat_id, data.get('text', ''))
+
+
+class SimulatedUser:
+    __slots__ = ('chat_id', 'username', 'role', 'steps')
+
+    def __init__(self, chat_id: int, username: str, role: str):
+        self.chat_id = chat_id
+        self.username = username
+        self.role = role
+        # every user starts from the menu
+        self.steps: list[Step] = ['/start']
+
+
+def take_order_step(user: SimulatedUser, buttons: ChatsButtons) -> str:
+    """Press one of the take order buttons the contractor was sent, or look at orders again"""
+    take_order_buttons = [button for button in buttons.get(user.chat_id) if button.startswith('take_order')]
+    return random.choice(take_order_buttons) if take_order_buttons else 'watch_orders'
+
+
+# scenarios with weights, every scenario starts from the menu
+CLIENT_SCENARIOS = [
+    (3, ['create_order', (TEXT, 'Нужно обновить плагины на сайте'), (TEXT, 'Логин: Иван\nПароль: qwerty')]),
+    (2, ['send_message_to_contractor', (TEXT, 'Как продвигается работа?'), '/start']),
+    (2, ['see_my_contractors']),
+    (1, ['bind_contractors']),
+    (1, ['/start']),
+]
+CONTRACTOR_SCENARIOS = [
+    (3, ['watch_orders', take_order_step, (TEXT, '3')]),
+    (2, ['send_message_to_client', (TEXT, 'Пришлите, пожалуйста, доступ к хостингу'), '/start']),
+    (2, ['close_order']),
+    (1, ['my_salary']),
+    (1, ['how_contractor_bot_work']),
+]
+
+
+class UpdateFactory:
+    """Telegram updates of simulated users as they come from getUpdates"""
+
+    def __init__(self):
+        self.update_ids = count(1)
+        # ids of messages of users don't cross ids of messages sent by the fake bot
+        self.message_ids = count(10 ** 9)
+
+    def build_user(self, user: SimulatedUser) -> dict:
+        return {'id': user.chat_id, 'is_bot': False, 'first_name': user.username, 'username': user.username}
+
+    def build_message(self, user: SimulatedUser, text: str, message_id: Optional[int] = None) -> dict:
+        message = {
+            'message_id': message_id if message_id is not None else next(self.message_ids),
+            'date': int(time()),
+            'chat': {'id': user.chat_id, 'type': 'private'},
+            'from': self.build_user(user),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return message
+
+    def build(
+            self,
+            user: SimulatedUser,
+            step: Union[str, tuple[str, str]],
+            buttons: Optional[ChatsButtons] = None,
+    ) -> dict:
+        update_id = next(self.update_ids)
+        if isinstance(step, tuple):
+            data = {'update_id': update_id, 'message': self.build_message(user, step[1])}
+        elif step.startswith('/'):
+            data = {'update_id': update_id, 'message': self.build_message(user, step)}
+        else:
+            data = {
+                'update_id': update_id,
+                'callback_query': {
+                    'id': str(update_id),
+                    'from': self.build_user(user),
+                    'chat_instance': str(user.chat_id),
+                    'data': step,
+                    # the message with the pressed button if it is known, bot can edit it
+                    'message': self.build_message(
+                        user,
+                        'Выберите действие',
+                        buttons.get_message_id(user.chat_id, step) if buttons is not None else None,
+                    ),
+                },
+            }
+        return data
+
+
+class LoadGenerator:
+    """
+    Open loop generator: updates are put to the queue at the given rate whatever the bot latency is.
+
+    Every user goes through random scenarios of his role and waits think time between steps,
+    so one user doesn't send more than a person does
+    """
+
+    def __init__(
+            self,
+            users: list[SimulatedUser],
+            buttons: ChatsButtons,
+            rate: float,
+            think_time: float,
+            seed: Optional[int] = None,
+    ):
+        self.users = users
+        self.buttons = buttons
+        self.rate = rate
+        self.think_time = think_time
+        self.random = random.Random(seed)
+        self.factory = UpdateFactory()
+
+    def next_step(self, user: SimulatedUser) -> Union[str, tuple[str, str]]:
+        if not user.steps:
+            scenarios = CLIENT_SCENARIOS if user.role == BotUser.Role.client else CONTRACTOR_SCENARIOS
+            weights, steps = zip(*scenarios)
+            user.steps = list(self.random.choices(steps, weights)[0])
+        step = user.steps.pop(0)
+        if callable(step):
+            step = step(user, self.buttons)
+        return step
+
+    def generate(self, duration: float) -> Iterator[tuple[float, dict]]:
+        """Updates as Bot API sends them with moments to send them, counted from the start"""
+        # users come at random moments of the first think time
+        ready_users = [(self.random.uniform(0, self.think_time), index) for index in range(len(self.users))]
+        heapq.heapify(ready_users)
+        moment = 0
+        while ready_users:
+            ready_at, index = heapq.heappop(ready_users)
+            moment = max(moment + 1 / self.rate, ready_at)
+            if moment > duration:
+                return
+            user = self.users[index]
+            yield moment, self.factory.build(user, self.next_step(user), self.buttons)
+            heapq.heappush(ready_users, (moment + self.random.expovariate(1 / self.think_time), index))
+
+
+def format_latencies(latencies_ms: np.ndarray) -> str:
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return f'p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, max {latencies_ms.max():.1f} ms'
+
+
+class LoadStats:
+    """
+    Latency of updates from putting to the queue to the end of processing and database timings.
+
+    Perceived latency is from putting to the queue to the first bot api call of the update:
+    the user sees the button released or an answer then
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enqueued_at: dict[int, float] = {}
+        self.latencies: list[float] = []
+        self.replayed = 0
+        # when the update in the dispatcher was put to the queue, until the bot answers it
+        self.unanswered_since: Optional[float] = None
+        self.perceived_latencies: list[float] = []
+        # bot api calls in the dispatcher by method
+        self.api_calls = Counter()
+        # by is it the dispatcher thread or not (jobs, reports)
+        self.queries = Counter()
+        self.write_seconds: list[float] = []
+        self.locked_errors = 0
+        self.errors = 0
+
+    def enqueue(self, update: Update) -> None:
+        with self.lock:
+            self.enqueued_at[update.update_id] = perf_counter()
+
+    def wrap_process_update(self, process_update: Callable) -> Callable:
+        def wrapper(update):
+            with self.lock:
+                # replayed callback was answered when it came first
+                self.unanswered_since = self.enqueued_at.get(update.update_id)
+            try:
+                return process_update(update)
+            finally:
+                finished_at = perf_counter()
+                with self.lock:
+                    enqueued_at = self.enqueued_at.pop(update.update_id, None)
+                    if enqueued_at is None:
+                        # callback put back to the queue by the throttler
+                        self.replayed += 1
+                    else:
+                        self.latencies.append(finished_at - enqueued_at)
+
+        return wrapper
+
+    def api_call(self, method: str) -> None:
+        """Called by FakeBot when a call is answered"""
+        if threading.current_thread().name != DISPATCHER_THREAD_NAME:
+            return
+        answered_at = perf_counter()
+        with self.lock:
+            self.api_calls[method] += 1
+            if self.unanswered_since is not None:
+                self.perceived_latencies.append(answered_at - self.unanswered_since)
+                self.unanswered_since = None
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Database execute wrapper, it is installed to every connection"""
+        is_write = sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE')
+        started_at = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if 'locked' in str(error):
+                with self.lock:
+                    self.locked_errors += 1
+            raise
+        finally:
+            seconds = perf_counter() - started_at
+            with self.lock:
+                self.queries[threading.current_thread().name == DISPATCHER_THREAD_NAME] += 1
+                if is_write:
+                    self.write_seconds.append(seconds)
+
+    def get_report(self, seconds: float, unprocessed: int) -> list[str]:
+        latencies = np.array(self.latencies) * 1000
+        write_seconds = np.array(self.write_seconds)
+        processed = len(latencies)
+        report = [
+            f'processed updates: {processed}, not processed in time: {unprocessed}, '
+            f'replayed by throttler: {self.replayed}',
+            f'throughput: {processed / seconds:.1f} updates/s',
+        ]
+        if processed:
+            report.append(f'latency: {format_latencies(latencies)}')
+            report.append(f'queries per update in dispatcher: {self.queries[True] / processed:.1f}')
+            # replays of callbacks are the same user actions
+            api_calls = ', '.join(f'{method} {calls / processed:.2f}' for method, calls in self.api_calls.most_common())
+            report.append(
+                f'bot api calls per update in dispatcher: {sum(self.api_calls.values()) / processed:.2f} ({api_calls})'
+            )
+        if self.perceived_latencies:
+            report.append(f'perceived latency: {format_latencies(np.array(self.perceived_latencies) * 1000)}')
+        if len(write_seconds):
+            lock_waits = write_seconds[write_seconds > LOCK_WAIT_THRESHOLD_SECONDS]
+            report.append(
+                f'writes: {len(write_seconds)}, p99 {np.percentile(write_seconds, 99) * 1000:.1f} ms, '
+                f'lock waits (> {LOCK_WAIT_THRESHOLD_SECONDS * 1000:.0f} ms): {len(lock_waits)}, '
+                f'{lock_waits.sum():.2f} s in total'
+            )
+        report.append(f'"database is locked" errors: {self.locked_errors}, errors logged: {self.errors}')
+        return report
+
+
+class ErrorCounter(logging.Handler):
+    """Counts records of the error logger while the load test runs"""
+
+    def __init__(self, stats: LoadStats):
+        super().__init__(logging.ERROR)
+        self.stats = stats
+
+    def emit(self, record: logging.LogRecord) -> None:
+        with self.stats.lock:
+            self.stats.errors += 1
+
+
+def create_users(clients_count: int, contractors_count: int, first_chat_id: int) -> list[SimulatedUser]:
+    """Active paid clients with unlimited orders and contractors, users created before are reused"""
+    tariff, _ = Tariff.objects.get_or_create(
+        name='load test',
+        defaults={
+            'orders_limit': 32767,
+            'reaction_time_minutes': 60,
+            'can_reserve_contractor': True,
+            'can_see_contractor_contacts': True,
+            'price': Decimal(0),
+        },
+    )
+    users = [
+        SimulatedUser(first_chat_id + index, f'loadclient{index}', BotUser.Role.client)
+        for index in range(clients_count)
+    ] + [
+        SimulatedUser(first_chat_id + clients_count + index, f'loadcontractor{index}', BotUser.Role.contractor)
+        for index in range(contractors_count)
+    ]
+    existing_nicks = set(BotUser.objects.filter(tg_nick__startswith='load').values_list('tg_nick', flat=True))
+    # bulk_create doesn't work with inherited models
+    with atomic():
+        for user in users:
+            if user.username in existing_nicks:
+                continue
+            if user.role == BotUser.Role.client:
+                Client.objects.create(
+                    tg_nick=user.username,
+                    telegram_id=user.chat_id,
+                    role=user.role,
+                    tariff=tariff,
+                    paid=True,
+                )
+            else:
+                Contractor.objects.create(tg_nick=user.username, telegram_id=user.chat_id, role=user.role)
+    return users
@@ -0,0 +1,71 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from tgbot_app.fake_bot_api import FakeBotApi
+from tgbot_app.fake_bot_api import FakeBotApiServer
+from tgbot_app.fake_bot_api import play_feed
+from tgbot_app.fake_bot_api import read_script
+from tgbot_app.loadtest import LoadGenerator
+from tgbot_app.loadtest import create_users
+from tgbot_app.management.commands.load_test_bot import FIRST_CHAT_ID
+
+
+class Command(BaseCommand):
+    help = (
+        "Local fake Telegram Bot API for end to end tests, "
+        "run start_bot with --api-url http://HOST:PORT/bot to use it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency-ms', type=float, default=0, help='latency of every request')
+        parser.add_argument(
+            '--too-many-requests-rate',
+            type=float,
+            default=0,
+            help='share of send, edit and answer requests answered with 429',
+        )
+        parser.add_argument('--retry-after', type=int, default=1, help='retry_after of 429 answers in seconds')
+        parser.add_argument('--script', help='json lines file with updates, see read_script')
+        parser.add_argument(
+            '--clients',
+            type=int,
+            default=0,
+            help='simulated clients, they are created in the database of the bot',
+        )
+        parser.add_argument('--contractors', type=int, default=0)
+        parser.add_argument('--rate', type=float, default=20, help='updates per second of simulated users')
+        parser.add_argument('--duration', type=float, default=60, help='seconds to send updates of simulated users')
+        parser.add_argument('--think-time', type=float, default=5)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        api = FakeBotApi(
+            options['latency_ms'] / 1000,
+            options['too_many_requests_rate'],
+            options['retry_after'],
+            options['seed'],
+        )
+        feeds = []
+        if options['script']:
+            with open(options['script'], encoding='UTF8') as file:
+                feeds.append(read_script(file))
+        if options['clients'] or options['contractors']:
+            users = create_users(options['clients'], options['contractors'], FIRST_CHAT_ID)
+            generator = LoadGenerator(users, api.buttons, options['rate'], options['think_time'], options['seed'])
+            feeds.append(generator.generate(options['duration']))
+
+        server = FakeBotApiServer((options['host'], options['port']), api)
+        for feed in feeds:
+            threading.Thread(target=play_feed, args=(api, feed), daemon=True).start()
+        self.stdout.write(f'fake Bot API is listening on http://{options["host"]}:{options["port"]}/bot')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        for line in api.get_report():
+            self.stdout.write(line)
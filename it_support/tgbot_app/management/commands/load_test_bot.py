@@ -0,0 +1,114 @@
+import logging
+import tempfile
+import threading
+import warnings
+from pathlib import Path
+from time import perf_counter
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from telegram import Update
+from telegram.utils.deprecate import TelegramDeprecationWarning
+
+from support_app.tariffs import reset_tariff_table
+from tgbot_app.loadtest import DISPATCHER_THREAD_NAME
+from tgbot_app.loadtest import ErrorCounter
+from tgbot_app.loadtest import FakeBot
+from tgbot_app.loadtest import LoadGenerator
+from tgbot_app.loadtest import LoadStats
+from tgbot_app.loadtest import create_users
+from tgbot_app.management.commands.start_bot import create_bot
+
+# chat ids of simulated users don't cross real ones
+FIRST_CHAT_ID = 10 ** 9
+
+
+class Command(BaseCommand):
+    help = "Load test of the bot with simulated clients and contractors, runs locally on a temporary database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--contractors', type=int, default=200)
+        parser.add_argument('--rate', type=float, default=50, help='updates per second from all users')
+        parser.add_argument('--duration', type=float, default=60, help='seconds to send updates')
+        parser.add_argument('--think-time', type=float, default=5, help='mean seconds between steps of a user')
+        parser.add_argument('--api-latency-ms', type=float, default=0, help='latency of every fake bot api call')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+            self.stderr.write('load test creates a temporary SQLite database, use SQLite settings')
+            return
+
+        with tempfile.TemporaryDirectory() as directory:
+            # file database, not in memory: dispatcher, jobs and reports work with it in different threads
+            connection.settings_dict['TEST']['NAME'] = str(Path(directory) / 'load_test.sqlite3')
+            old_database_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.run_load_test(options, Path(directory) / 'drafts.sqlite3')
+            finally:
+                connection.creation.destroy_test_db(old_database_name, verbosity=0)
+                reset_tariff_table()
+
+    def run_load_test(self, options, drafts_path: Path):
+        users = create_users(options['clients'], options['contractors'], FIRST_CHAT_ID)
+        stats = LoadStats()
+
+        def install_execute_wrapper(sender, connection, **kwargs):
+            connection.execute_wrappers.append(stats.execute_wrapper)
+
+        connection_created.connect(install_execute_wrapper)
+        connection.execute_wrappers.append(stats.execute_wrapper)
+        error_counter = ErrorCounter(stats)
+        logging.getLogger('tgbot_app_error').addHandler(error_counter)
+
+        fake_bot = FakeBot(settings.TELEGRAM_ACCESS_TOKEN, options['api_latency_ms'] / 1000, stats.api_call)
+        bot = create_bot(fake_bot, drafts_path=drafts_path)
+        dispatcher = bot.updater.dispatcher
+        with warnings.catch_warnings():
+            # wrapping the dispatcher method is the only way to see the end of every update
+            warnings.simplefilter('ignore', TelegramDeprecationWarning)
+            dispatcher.process_update = stats.wrap_process_update(dispatcher.process_update)
+        dispatcher_thread = threading.Thread(target=dispatcher.start, name=DISPATCHER_THREAD_NAME)
+        dispatcher_thread.start()
+        bot.job_queue.start()
+
+        generator = LoadGenerator(users, fake_bot.buttons, options['rate'], options['think_time'], options['seed'])
+        self.stdout.write(
+            f'{options["clients"]} clients and {options["contractors"]} contractors, '
+            f'{options["rate"]} updates/s for {options["duration"]} s'
+        )
+        started_at = perf_counter()
+        try:
+            for moment, update in generator.generate(options['duration']):
+                delay = started_at + moment - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                update = Update.de_json(update, fake_bot)
+                stats.enqueue(update)
+                dispatcher.update_queue.put(update)
+            # updates sent in time are processed, but the queue is not drained longer than the test
+            sending_seconds = perf_counter() - started_at
+            drain_deadline = perf_counter() + options['duration']
+            while dispatcher.update_queue.unfinished_tasks and perf_counter() < drain_deadline:
+                sleep(0.1)
+            seconds = perf_counter() - started_at
+        finally:
+            bot.job_queue.stop()
+            dispatcher.stop()
+            dispatcher_thread.join()
+            bot.chat_contexts.close()
+            connection_created.disconnect(install_execute_wrapper)
+            logging.getLogger('tgbot_app_error').removeHandler(error_counter)
+
+        self.stdout.write(f'sent for {sending_seconds:.1f} s, processed for {seconds:.1f} s')
+        for line in stats.get_report(seconds, len(stats.enqueued_at)):
+            self.stdout.write(line)
+        for (event, role), events_count in sorted(bot.throttler.pop_counters().items()):
+            self.stdout.write(f'throttler {event} {role}: {events_count}')
+        self.stdout.write(f'bot api calls: {sum(fake_bot.calls.values())}')
+
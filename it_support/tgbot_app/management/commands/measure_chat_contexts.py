@@ -0,0 +1,95 @@
+import gc
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Optional
+
+from django.core.management.base import BaseCommand
+
+from support_app.models import BotUser
+from support_app.models import Client
+from support_app.models import Contractor
+from support_app.models import Order
+from tgbot_app.conversation import ChatContextStore
+from tgbot_app.management.commands.load_test_bot import FIRST_CHAT_ID
+
+PER_CHATS = 100_000
+
+
+def get_resident_memory() -> Optional[int]:
+    """Resident memory of the process in bytes, Linux only"""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def build_user(chat_id: int) -> BotUser:
+    """User as get_user leaves it after a handler has read its client or contractor"""
+    role = BotUser.Role.client if chat_id % 2 else BotUser.Role.contractor
+    user = BotUser(pk=chat_id, tg_nick=f'user_{chat_id}', role=role, telegram_id=chat_id, bot_state='START')
+    if role == BotUser.Role.client:
+        user.client = Client(botuser_ptr=user, tg_nick=user.tg_nick, role=role, telegram_id=chat_id)
+    else:
+        user.contractor = Contractor(botuser_ptr=user, tg_nick=user.tg_nick, role=role, telegram_id=chat_id)
+    return user
+
+
+def fill_user_data(chats: int) -> defaultdict:
+    """Previous layout: user and order instances in dispatcher user_data dicts"""
+    user_data = defaultdict(dict)
+    for chat_id in range(FIRST_CHAT_ID, FIRST_CHAT_ID + chats):
+        user = build_user(chat_id)
+        user_data[chat_id]['user'] = user
+        if user.role == BotUser.Role.client:
+            user_data[chat_id]['creating_order_task'] = f'Задание заказа {chat_id}'
+        else:
+            user_data[chat_id]['order_in_process'] = Order(pk=chat_id, task=f'Задание заказа {chat_id}')
+    return user_data
+
+
+def fill_chat_contexts(chats: int) -> ChatContextStore:
+    store = ChatContextStore(max_chats=chats)
+    for chat_id in range(FIRST_CHAT_ID, FIRST_CHAT_ID + chats):
+        chat = store[chat_id]
+        chat.role = BotUser.Role.client if chat_id % 2 else BotUser.Role.contractor
+        if chat.role == BotUser.Role.client:
+            chat.creating_order_task = f'Задание заказа {chat_id}'
+        else:
+            chat.order_in_process_id = chat_id
+    return store
+
+
+def measure(layout: str, chats: int) -> Optional[int]:
+    """Growth of resident memory after filling the layout, runs in a fresh forked process"""
+    gc.collect()
+    memory_before = get_resident_memory()
+    data = fill_user_data(chats) if layout == 'user_data' else fill_chat_contexts(chats)
+    gc.collect()
+    memory_after = get_resident_memory()
+    if memory_before is None or memory_after is None or not data:
+        return None
+    return memory_after - memory_before
+
+
+class Command(BaseCommand):
+    help = "Resident memory of conversation data per 100k chats: ORM instances in user_data against ChatContext"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', type=int, default=PER_CHATS)
+
+    def handle(self, *args, **options):
+        chats = max(options['chats'], 1)
+        for layout, title in [('user_data', 'user_data dicts'), ('chat_contexts', 'ChatContext')]:
+            # every layout in its own process, freed memory is not always given back to the system
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('fork')) as executor:
+                memory = executor.submit(measure, layout, chats).result()
+            if memory is None:
+                self.stdout.write(f'{title}: resident memory is not available on this system')
+            else:
+                self.stdout.write(
+                    f'{title}: {memory / 2 ** 20:.1f} MiB for {chats} chats, '
+                    f'{memory * PER_CHATS / chats / 2 ** 20:.1f} MiB per {PER_CHATS} chats'
+                )
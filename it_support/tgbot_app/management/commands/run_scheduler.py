@@ -0,0 +1,34 @@
+import threading
+from signal import SIGINT
+from signal import SIGTERM
+from signal import signal
+
+from django.core.management import BaseCommand
+
+from tgbot_app.management.commands.start_bot import create_bot
+from tgbot_app.management.commands.start_bot import get_api_bot
+from tgbot_app.management.commands.start_bot import prepare_bot_process
+
+
+class Command(BaseCommand):
+    help = (
+        "Run periodic jobs of the bot without handling updates, "
+        "of several schedulers only the one holding the lease runs jobs, others take over if it stops"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--api-url', help='Bot API url instead of Telegram one, see start_bot')
+
+    def handle(self, *args, **options):
+        prepare_bot_process()
+        bot = create_bot(get_api_bot(options['api_url']))
+        bot.job_queue.start()
+        self.stdout.write(f'scheduler {bot.lease.holder} is started')
+        # updater.idle exits at once without polling, so the lease would not be released
+        stop_event = threading.Event()
+        for signum in (SIGINT, SIGTERM):
+            signal(signum, lambda signum, frame: stop_event.set())
+        while not stop_event.wait(1):
+            pass
+        bot.job_queue.stop()
+        bot.lease.release()
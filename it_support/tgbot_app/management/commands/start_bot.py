@@ -1,6 +1,14 @@
+from pathlib import Path
+from typing import Optional
+from typing import Union
+
 from django.conf import settings
 from django.core.management import BaseCommand
+from telegram import Bot
+from telegram.utils.request import Request
 
+from support_app.encryption import get_creds_cipher
+from support_app.tariffs import get_tariff_table
 from tgbot_app.tg_bot import TgBot
 
 from tgbot_app.client_state_functions import start_client
@@ -32,15 +40,53 @@ from tgbot_app.unknown_state_functions import start_not_found
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--api-url',
+            help='Bot API url instead of Telegram one, e.g. http://127.0.0.1:8081/bot of fake_bot_api',
+        )
+        parser.add_argument(
+            '--no-jobs',
+            action='store_true',
+            help='only handle updates, periodic jobs are run by run_scheduler or other start_bot',
+        )
+
     def handle(self, *args, **options):
         try:
-            start_bot()
+            start_bot(options['api_url'], run_jobs=not options['no_jobs'])
         except Exception as exc:
             raise exc
 
 
-def start_bot():
-    bot = TgBot(
+def start_bot(api_url: Optional[str] = None, run_jobs: bool = True):
+    prepare_bot_process()
+    bot = create_bot(get_api_bot(api_url), run_jobs, settings.BOT_DRAFTS_DB)
+    bot.updater.start_polling()
+    bot.updater.idle()
+    bot.chat_contexts.close()
+    bot.lease.release()
+
+
+def prepare_bot_process():
+    get_creds_cipher()  # load encryption keys on start, so bad keys fail here and not on the first order
+    get_tariff_table()
+
+
+def get_api_bot(api_url: Optional[str]) -> Optional[Bot]:
+    """Bot for Bot API at api_url, None for Telegram one"""
+    if api_url is None:
+        return None
+    # pool as Updater creates for its own bot, dispatcher and jobs send in parallel
+    return Bot(settings.TELEGRAM_ACCESS_TOKEN, base_url=api_url, request=Request(con_pool_size=8))
+
+
+def create_bot(
+        bot: Optional[Bot] = None,
+        run_jobs: bool = True,
+        drafts_path: Optional[Union[str, Path]] = None,
+) -> TgBot:
+    """Bot with states of all roles, bot is passed to replace real telegram bot"""
+    return TgBot(
         settings.TELEGRAM_ACCESS_TOKEN,
         {
             'Клиент': {
@@ -75,7 +121,8 @@ def start_bot():
             'unknown': {
                 'START': start_not_found,
             },
-        }
+        },
+        bot=bot,
+        run_jobs=run_jobs,
+        drafts_path=drafts_path,
     )
-    bot.updater.start_polling()
-    bot.updater.idle()
@@ -4,21 +4,21 @@ from telegram.ext.callbackcontext import CallbackContext
 from telegram.update import Update
 
 from support_app.models import Contractor
+from tgbot_app.menus import show_menu
 
 import logging
 
 logger = logging.getLogger('tgbot_app_info')
 
 
-def start_manager(update: Update, context: CallbackContext) -> str:
-    """Manager start function which send a menu"""
+def start_manager(update: Update, context: CallbackContext, notice: str = '') -> str:
+    """Manager start function which show a menu, notice is the answer to the previous action"""
     logger.info('function "start_manager" was run with the /start command')
     keyboard = [
         [InlineKeyboardButton('Контакты доступных подрядчиков', callback_data='contacts_available_contractors')],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    chat_id = update.effective_chat.id
-    context.bot.send_message(text='Что вас интересует', reply_markup=reply_markup, chat_id=chat_id)
+    show_menu(update, context, 'Что вас интересует', reply_markup, notice)
     logger.info('function "start_manager" ended\n')
     return 'HANDLE_MENU_MANAGER'
 
@@ -26,7 +26,6 @@ def start_manager(update: Update, context: CallbackContext) -> str:
 def handle_menu_manager(update: Update, context: CallbackContext) -> str:
     """Manager menu handler, also answer if unknown enter"""
     logger.info('function "handle_menu_manager" was run')
-    chat_id = update.effective_chat.id
     query = update.callback_query
 
     message = 'Я вас не понял, выберите из предложенных кнопок'
@@ -34,6 +33,5 @@ def handle_menu_manager(update: Update, context: CallbackContext) -> str:
         available_contractors = Contractor.objects.get_available()
         message = '\n'.join([f'@{contractor.tg_nick}' for contractor in available_contractors])
 
-    context.bot.send_message(text=message, chat_id=chat_id)
     logger.info('function "handle_menu_manager" ended\n')
-    return start_manager(update, context)
+    return start_manager(update, context, message)
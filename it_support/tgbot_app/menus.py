@@ -0,0 +1,49 @@
+import logging
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext.callbackcontext import CallbackContext
+from telegram.update import Update
+
+from tgbot_app.digests import TELEGRAM_MESSAGE_LIMIT
+
+logger = logging.getLogger('tgbot_app_error')
+
+
+def show_menu(
+        update: Update,
+        context: CallbackContext,
+        text: str,
+        reply_markup: InlineKeyboardMarkup,
+        notice: str = '',
+) -> None:
+    """
+    Show menu with notice above it, the answer to the previous action of the user.
+
+    The last menu of the chat is edited in place if its button was pressed, otherwise the menu
+    is sent as a new message: a button of an older message gets the menu at the bottom of the chat,
+    where the user looks. A menu which can't be edited, e.g. older than 48 hours, is sent too
+    """
+    chat = context.user_data
+    chat_id = update.effective_chat.id
+    query = update.callback_query
+    is_editable = query is not None and query.message is not None and query.message.message_id == chat.menu_message_id
+    if notice:
+        notice = notice.strip()
+        if len(notice) + len(text) + 2 > TELEGRAM_MESSAGE_LIMIT:
+            # long lists go in their own message and the menu goes below it
+            context.bot.send_message(chat_id=chat_id, text=notice)
+            is_editable = False
+        else:
+            text = f'{notice}\n\n{text}'
+
+    if is_editable:
+        try:
+            query.edit_message_text(text=text, reply_markup=reply_markup)
+            return
+        except BadRequest as error:
+            if error.message.startswith('Message is not modified'):  # the same menu, e.g. "back" pressed twice
+                return
+            logger.error(f'menu of {chat_id} was not edited: {error}')
+    message = context.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+    chat.menu_message_id = message.message_id
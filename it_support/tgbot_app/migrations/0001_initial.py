@@ -0,0 +1,41 @@
+# Generated by Django 4.1.13 on 2026-10-18 22:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField(verbose_name='telegram id чата')),
+                ('text', models.TextField(verbose_name='текст')),
+                ('status', models.CharField(choices=[('pending', 'ожидает отправки'), ('delivered', 'доставлено'), ('failed', 'не доставлено')], default='pending', max_length=20, verbose_name='статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='число попыток отправки')),
+                ('last_error', models.TextField(blank=True, verbose_name='последняя ошибка')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='дата и время создания')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='дата и время следующей попытки')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='дата и время доставки или отказа')),
+            ],
+            options={
+                'verbose_name': 'исходящее сообщение',
+                'verbose_name_plural': 'исходящие сообщения',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at', 'id'], name='outbox_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'processed_at'], name='outbox_processed_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.13 on 2026-10-18 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='название')),
+                ('holder', models.CharField(max_length=200, verbose_name='процесс')),
+                ('acquired_at', models.DateTimeField(verbose_name='дата и время получения')),
+                ('heartbeat_at', models.DateTimeField(verbose_name='дата и время последнего продления')),
+                ('expires_at', models.DateTimeField(verbose_name='действует до')),
+            ],
+            options={
+                'verbose_name': 'аренда планировщика',
+                'verbose_name_plural': 'аренды планировщика',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-18 23:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot_app', '0002_schedulerlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotifierWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='название')),
+                ('order_id', models.BigIntegerField(default=0, verbose_name='id последнего просмотренного заказа')),
+                ('order_created_at', models.DateTimeField(blank=True, null=True, verbose_name='дата и время создания последнего заказа')),
+                ('scanned_at', models.DateTimeField(blank=True, null=True, verbose_name='дата и время последнего просмотра')),
+            ],
+            options={
+                'verbose_name': 'водяной знак уведомителя',
+                'verbose_name_plural': 'водяные знаки уведомителя',
+            },
+        ),
+    ]
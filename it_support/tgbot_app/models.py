@@ -1,3 +1,120 @@
+from datetime import timedelta
+
+from django.db import IntegrityError
 from django.db import models
+from django.db.models import Case
+from django.db.models import F
+from django.db.models import Value
+from django.db.models import When
+from django.db.transaction import atomic
+from django.utils import timezone
+
+
+class OutboxMessageQuerySet(models.QuerySet):
+    def enqueue(self, chat_ids, text: str) -> list:
+        """Поставить сообщение в очередь на отправку в каждый из чатов"""
+        return self.bulk_create([self.model(chat_id=chat_id, text=text) for chat_id in chat_ids if chat_id])
+
+    def pending(self):
+        """Сообщения, которые пора отправить, в порядке постановки в очередь"""
+        return self.filter(
+            status=OutboxMessage.Status.pending,
+            next_attempt_at__lte=timezone.now(),
+        ).order_by('id')
+
+
+class OutboxMessage(models.Model):
+    """Сообщение бота, которое записывается в одной транзакции с изменением заказа и отправляется позже"""
+
+    class Status(models.TextChoices):
+        pending = 'pending', 'ожидает отправки'
+        delivered = 'delivered', 'доставлено'
+        failed = 'failed', 'не доставлено'
+
+    chat_id = models.BigIntegerField('telegram id чата')
+    text = models.TextField('текст')
+    status = models.CharField('статус', max_length=20, choices=Status.choices, default=Status.pending)
+    attempts = models.PositiveSmallIntegerField('число попыток отправки', default=0)
+    last_error = models.TextField('последняя ошибка', blank=True)
+    created_at = models.DateTimeField('дата и время создания', default=timezone.now)
+    next_attempt_at = models.DateTimeField('дата и время следующей попытки', default=timezone.now)
+    processed_at = models.DateTimeField('дата и время доставки или отказа', null=True, blank=True)
+
+    objects = OutboxMessageQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'исходящее сообщение'
+        verbose_name_plural = 'исходящие сообщения'
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                name='outbox_pending_idx',
+                condition=models.Q(status='pending'),
+            ),
+            models.Index(fields=['status', 'processed_at'], name='outbox_processed_idx'),
+        ]
+
+    def __str__(self):
+        return f'Сообщение {self.pk} в чат {self.chat_id} ({self.status})'
+
+
+class SchedulerLeaseQuerySet(models.QuerySet):
+    def acquire(self, name: str, holder: str, ttl: timedelta) -> bool:
+        """
+        Взять или продлить аренду, если она свободна, истекла или уже у holder.
+
+        Обновление условное, поэтому из нескольких процессов аренду получит только один
+        """
+        now = timezone.now()
+        is_acquired = self.filter(name=name).filter(models.Q(holder=holder) | models.Q(expires_at__lte=now)).update(
+            holder=holder,
+            acquired_at=Case(When(holder=holder, then=F('acquired_at')), default=Value(now)),
+            heartbeat_at=now,
+            expires_at=now + ttl,
+        )
+        if is_acquired:
+            return True
+        try:
+            with atomic():
+                self.create(name=name, holder=holder, acquired_at=now, heartbeat_at=now, expires_at=now + ttl)
+        except IntegrityError:
+            # аренда есть и она у другого процесса
+            return False
+        return True
+
+    def release(self, name: str, holder: str) -> bool:
+        """Отпустить аренду, чтобы другой процесс взял ее не дожидаясь истечения"""
+        return bool(self.filter(name=name, holder=holder).update(expires_at=timezone.now()))
+
+
+class SchedulerLease(models.Model):
+    """Аренда лидера, только процесс с действующей арендой выполняет периодические задачи"""
+    name = models.CharField('название', max_length=50, unique=True)
+    holder = models.CharField('процесс', max_length=200)
+    acquired_at = models.DateTimeField('дата и время получения')
+    heartbeat_at = models.DateTimeField('дата и время последнего продления')
+    expires_at = models.DateTimeField('действует до')
+
+    objects = SchedulerLeaseQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'аренда планировщика'
+        verbose_name_plural = 'аренды планировщика'
+
+    def __str__(self):
+        return f'{self.name} у {self.holder} до {self.expires_at}'
+
+
+class NotifierWatermark(models.Model):
+    """Докуда уведомитель о новых заказах уже просмотрел заказы, чтобы читать только новые"""
+    name = models.CharField('название', max_length=50, unique=True)
+    order_id = models.BigIntegerField('id последнего просмотренного заказа', default=0)
+    order_created_at = models.DateTimeField('дата и время создания последнего заказа', null=True, blank=True)
+    scanned_at = models.DateTimeField('дата и время последнего просмотра', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'водяной знак уведомителя'
+        verbose_name_plural = 'водяные знаки уведомителя'
 
-# Create your models here.
+    def __str__(self):
+        return f'{self.name}: заказ {self.order_id}'
@@ -0,0 +1,120 @@
+import heapq
+from datetime import datetime
+from datetime import timedelta
+from time import monotonic
+from typing import Optional
+
+from django.db.models import Q
+from django.utils import timezone
+
+from support_app.models import Order
+from tgbot_app.models import NotifierWatermark
+
+NEW_ORDERS_WATERMARK = 'new_orders'
+# orders updated this long before the previous scan are read again, for transactions committed late
+SCAN_OVERLAP = timedelta(minutes=1)
+# due orders are rebuilt from the database this often in case some of them were missed
+RESYNC_SECONDS = 60 * 60
+
+
+class DueOrders:
+    """Heap of order ids by the time of their next notification, an order is in it once"""
+
+    def __init__(self):
+        self.heap: list[tuple[datetime, int]] = []
+        # latest due time of every order, older heap entries of the order are skipped
+        self.due_at: dict[int, datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self.due_at)
+
+    def push(self, order_id: int, due_at: datetime) -> None:
+        self.due_at[order_id] = due_at
+        heapq.heappush(self.heap, (due_at, order_id))
+
+    def pop_due(self, now: datetime) -> list[int]:
+        order_ids = []
+        while self.heap and self.heap[0][0] <= now:
+            due_at, order_id = heapq.heappop(self.heap)
+            if self.due_at.get(order_id) == due_at:
+                del self.due_at[order_id]
+                order_ids.append(order_id)
+        return order_ids
+
+    def clear(self) -> None:
+        self.heap.clear()
+        self.due_at.clear()
+
+
+class NewOrdersSchedule:
+    """
+    Which orders the new orders notifier should look at now.
+
+    New orders are read after the persisted watermark of the last seen order id, released orders
+    come back not informed and are read by update time. Orders waiting for the end of the assigned
+    contractors window or for the next wave are kept in DueOrders, so every run reads only the new
+    events and the due orders instead of all not informed ones. Due orders are rebuilt from
+    the database when the process takes the lease (another leader could inform orders meanwhile)
+    and every RESYNC_SECONDS
+    """
+
+    def __init__(self, name: str = NEW_ORDERS_WATERMARK):
+        self.name = name
+        self.due_orders = DueOrders()
+        self.watermark: Optional[NotifierWatermark] = None
+        self.lease_term: Optional[int] = None
+        self.synced_at = 0
+
+    def sync(self) -> None:
+        """Load the watermark and make all not informed orders due now"""
+        self.watermark, _ = NotifierWatermark.objects.get_or_create(name=self.name)
+        self.due_orders.clear()
+        now = timezone.now()
+        for order_id in Order.objects.get_available_not_informed_all().values_list('pk', flat=True):
+            self.due_orders.push(order_id, now)
+        self.synced_at = monotonic()
+
+    def collect(self, lease_term: int) -> list[int]:
+        """Ids of orders to process now: new, released and due ones"""
+        if lease_term != self.lease_term or monotonic() - self.synced_at > RESYNC_SECONDS:
+            self.lease_term = lease_term
+            self.sync()
+
+        now = timezone.now()
+        events = Q(pk__gt=self.watermark.order_id)
+        if self.watermark.scanned_at is not None:
+            # status is checked below, so the query is answered by order_never_informed_idx
+            events |= Q(
+                updated_at__gte=self.watermark.scanned_at - SCAN_OVERLAP,
+                assigned_contractors_informed=False,
+                contractors_inform_wave=0,
+            )
+        new_orders = Order.objects.filter(events).values_list(
+            'pk',
+            'created_at',
+            'status',
+            'all_contractors_informed',
+        )
+        for order_id, created_at, status, all_contractors_informed in new_orders:
+            if order_id > self.watermark.order_id:
+                self.watermark.order_id = order_id
+                self.watermark.order_created_at = created_at
+            if status == Order.Status.created and not all_contractors_informed:
+                # released order may still wait in the heap for its old wave
+                self.due_orders.push(order_id, now)
+        self.watermark.scanned_at = now
+        return self.due_orders.pop_due(now)
+
+    def schedule(self, order_id: int, due_at: Optional[datetime]) -> None:
+        """Order should be looked at again at due_at, None if all contractors are informed"""
+        if due_at is not None:
+            self.due_orders.push(order_id, due_at)
+
+    def retry(self, order_ids) -> None:
+        """Orders collected but not processed (the run failed) are due at once, not after the resync"""
+        now = timezone.now()
+        for order_id in order_ids:
+            self.due_orders.push(order_id, now)
+
+    def save_watermark(self) -> None:
+        self.watermark.save()
@@ -0,0 +1,124 @@
+import logging
+import time
+from datetime import timedelta
+from typing import Callable
+
+from django.utils import timezone
+from telegram import Bot
+from telegram.error import BadRequest
+from telegram.error import RetryAfter
+from telegram.error import TelegramError
+from telegram.error import Unauthorized
+
+from tgbot_app.models import OutboxMessage
+
+logger = logging.getLogger('tgbot_app_error')
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+# pending messages above this count are dropped, the oldest first
+MAX_PENDING = 10000
+DELIVERED_RETENTION = timedelta(days=1)
+FAILED_RETENTION = timedelta(days=7)
+DISPATCH_INTERVAL_SECONDS = 5
+# a run ends before the next one is due, otherwise the job queue skips runs as "maximum number of running instances"
+DISPATCH_BUDGET_SECONDS = 4
+
+
+def dispatch_outbox(
+        bot: Bot,
+        time_budget_seconds: float = DISPATCH_BUDGET_SECONDS,
+        is_leader: Callable[[], bool] = lambda: True,
+) -> int:
+    """
+    Send pending outbox messages batch by batch.
+
+    Every message is marked right after sending, so after restart the dispatcher resumes
+    from the first not delivered message and at most one message can be sent twice.
+    is_leader and the budget are checked before every message: a process which lost the lease
+    stops before the new leader sends the same messages, and a slow batch does not outlast the job interval.
+    Returns count of delivered messages.
+    """
+    delivered_count = 0
+    started_at = time.monotonic()
+    while True:
+        messages = list(OutboxMessage.objects.pending()[:BATCH_SIZE])
+        if not messages:
+            break
+        for message in messages:
+            if not is_leader() or time.monotonic() - started_at >= time_budget_seconds:
+                return delivered_count
+            try:
+                bot.send_message(chat_id=message.chat_id, text=message.text)
+            except RetryAfter as exc:
+                # telegram asks to slow down, the rest of the queue waits too
+                postpone_message(message, timedelta(seconds=exc.retry_after), str(exc), count_attempt=False)
+                return delivered_count
+            except (Unauthorized, BadRequest) as exc:
+                # user blocked the bot or chat does not exist, retry will not help
+                fail_message(message, str(exc))
+            except TelegramError as exc:
+                retry_message(message, str(exc))
+            else:
+                OutboxMessage.objects.filter(pk=message.pk).update(
+                    status=OutboxMessage.Status.delivered,
+                    attempts=message.attempts + 1,
+                    processed_at=timezone.now(),
+                )
+                delivered_count += 1
+    return delivered_count
+
+
+def postpone_message(message: OutboxMessage, delay: timedelta, error: str, count_attempt: bool = True) -> None:
+    """Try to send message later"""
+    OutboxMessage.objects.filter(pk=message.pk).update(
+        attempts=message.attempts + count_attempt,
+        next_attempt_at=timezone.now() + delay,
+        last_error=error,
+    )
+
+
+def retry_message(message: OutboxMessage, error: str) -> None:
+    """Retry message with exponential backoff or fail it after MAX_ATTEMPTS"""
+    if message.attempts + 1 >= MAX_ATTEMPTS:
+        fail_message(message, error)
+        return
+    postpone_message(message, timedelta(seconds=10 * 2 ** message.attempts), error)
+
+
+def fail_message(message: OutboxMessage, error: str) -> None:
+    """Stop trying to send message"""
+    logger.error(f'outbox message {message.pk} to chat {message.chat_id} was not delivered: {error}')
+    OutboxMessage.objects.filter(pk=message.pk).update(
+        status=OutboxMessage.Status.failed,
+        attempts=message.attempts + 1,
+        last_error=error,
+        processed_at=timezone.now(),
+    )
+
+
+def purge_outbox() -> None:
+    """Delete old processed messages and drop the oldest pending messages above MAX_PENDING"""
+    now = timezone.now()
+    OutboxMessage.objects.filter(
+        status=OutboxMessage.Status.delivered,
+        processed_at__lt=now - DELIVERED_RETENTION,
+    ).delete()
+    OutboxMessage.objects.filter(
+        status=OutboxMessage.Status.failed,
+        processed_at__lt=now - FAILED_RETENTION,
+    ).delete()
+
+    overflow_ids = list(
+        OutboxMessage.objects.filter(status=OutboxMessage.Status.pending).order_by('-id').values_list(
+            'id',
+            flat=True,
+        )[MAX_PENDING:]
+    )
+    if overflow_ids:
+        logger.error(f'outbox overflow, {len(overflow_ids)} oldest messages were dropped')
+        OutboxMessage.objects.filter(pk__in=overflow_ids).update(
+            status=OutboxMessage.Status.failed,
+            last_error='outbox overflow',
+            processed_at=now,
+        )
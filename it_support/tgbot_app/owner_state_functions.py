@@ -1,8 +1,4 @@
-import csv
-import os
-import random
 import re
-import time
 from functools import partial
 from typing import Any
 
@@ -11,13 +7,15 @@ from telegram import InlineKeyboardMarkup
 from telegram.ext.callbackcontext import CallbackContext
 from telegram.update import Update
 
-from support_app.models import Order
 from support_app.models import BotUser
 from support_app.models import Client
 from support_app.models import Contractor
 from support_app.models import Manager
 from support_app.models import Owner
 from support_app.models import Tariff
+from tgbot_app.menus import show_menu
+from tgbot_app.reports import REPORTS
+from tgbot_app.reports import report_executor
 
 
 import logging
@@ -25,25 +23,6 @@ import logging
 logger = logging.getLogger('tgbot_app_info')
 
 
-def send_data_in_csv_file(update: Update, context: CallbackContext, filename: str, data_for_writing: list[list[str]]):
-    """Save data in csv and send it."""
-    logger.info('function "send_data_in_csv_file" was run')
-    os_filename = f'{time.time()}_{random.randint(1, 2 ** 20)}_{filename}'
-    chat_id = update.effective_chat.id
-    try:
-        with open(os_filename, 'w', newline='', encoding='utf8') as f:
-            csv_writer = csv.writer(f)
-            csv_writer.writerows(data_for_writing)
-        with open(os_filename, 'rb') as f:
-            context.bot.send_document(document=f, filename=filename, chat_id=chat_id)
-    finally:
-        try:
-            os.remove(os_filename)
-            logger.info('function "send_data_in_csv_file" ended\n')
-        except FileNotFoundError:
-            pass
-
-
 def process_bot_user_add(role_to_model: dict[BotUser.Role, dict[str, Any]], username: str, role: Client.Role) -> str:
     logger.info('function "process_bot_user_add" was run')
     message = []
@@ -95,10 +74,9 @@ def process_bot_user_add(role_to_model: dict[BotUser.Role, dict[str, Any]], user
     return message
 
 
-def process_bot_user(update: Update, context: CallbackContext, username: str, role: Client.Role, is_add: bool):
-    """Process adding or create user with some role."""
+def process_bot_user(username: str, role: Client.Role, is_add: bool) -> str:
+    """Process adding or create user with some role, returns message for the owner."""
     logger.info('function "process_bot_user" was run')
-    chat_id = update.effective_chat.id
     role_to_model = {
         BotUser.Role.client: {
             'model': Client,
@@ -131,17 +109,18 @@ def process_bot_user(update: Update, context: CallbackContext, username: str, ro
         except role_to_model[role]['model'].DoesNotExist:
             message = 'Пользователь с таким именем не найден'
 
-    context.bot.send_message(text=message, chat_id=chat_id)
     logger.info('function "process_bot_user" ended\n')
+    return message
 
 
-def start_owner(update: Update, context: CallbackContext) -> str:
-    """Owner start function which send a menu"""
+def start_owner(update: Update, context: CallbackContext, notice: str = '') -> str:
+    """Owner start function which show a menu, notice is the answer to the previous action"""
     logger.info('function "start_owner" was run with the /start command')
-    chat_id = update.effective_chat.id
     keyboard = [
         [InlineKeyboardButton('Биллинг подрядчиков за прошлый месяц', callback_data='contractor_billing_prev_month')],
         [InlineKeyboardButton('Статистика по заказам', callback_data='orders_stats')],
+        [InlineKeyboardButton('Эффективность подрядчиков', callback_data='contractors_performance')],
+        [InlineKeyboardButton('SLA по тарифам за текущий месяц', callback_data='tariffs_sla')],
         [
             InlineKeyboardButton('Добавить клиента', callback_data='add_client'),
             InlineKeyboardButton('Удалить клиента', callback_data='delete_client'),
@@ -160,7 +139,7 @@ def start_owner(update: Update, context: CallbackContext) -> str:
         ],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    context.bot.send_message(text='Что вас интересует', reply_markup=reply_markup, chat_id=chat_id)
+    show_menu(update, context, 'Что вас интересует', reply_markup, notice)
     logger.info('function "start_owner" ended\n')
     return 'HANDLE_MENU_OWNER'
 
@@ -176,65 +155,39 @@ def handle_menu_owner(update: Update, context: CallbackContext) -> str:
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if query and query.data == 'contractor_billing_prev_month':  # owner request billing for pay to contractors
-        header = ['Подрядчик', 'Выполненных заказов']
-        billing = [
-            [
-                contractor_billing['contractor__tg_nick'],
-                contractor_billing['count_orders'],
-            ]
-            for contractor_billing
-            in Order.objects.calculate_billing()
-        ]
-        data_for_writing = [header] + billing
-        filename = 'billing.csv'
-        send_data_in_csv_file(update, context, filename, data_for_writing)
-    elif query and query.data == 'orders_stats':  # owner request a stats of clients
-        header = ['Начало биллинга', 'Клиент', 'Число заказов']
-        billing_start_index = 0
-        client_name_index = 1
-        orders_count_index = 2
-        clients_months_stats = [
-            [
-                client_month_stat[billing_start_index],
-                client_month_stat[client_name_index],
-                client_month_stat[orders_count_index],
-            ]
-            for client_month_stat
-            in Order.objects.calculate_average_orders_in_month()
-        ]
-        data_for_writing = [header] + clients_months_stats
-        filename = 'stats.csv'
-        send_data_in_csv_file(update, context, filename, data_for_writing)
+    message = ''
+    if query and query.data in REPORTS:  # owner request a report, it is built in background
+        if report_executor.submit(context.bot, query.data, chat_id):
+            message = 'Отчет готовится, пришлю файл, когда он будет готов'
+        else:
+            message = 'Этот отчет уже готовится, пришлю файл, когда он будет готов'
     elif query:
         for role in ['client', 'contractor', 'manager', 'owner']:
             for action in ['add', 'delete']:
                 if query.data == f'{action}_{role}':
                     message = f'Пришлите username. Пример: @{role}'
-                    context.bot.send_message(text=message, chat_id=chat_id, reply_markup=reply_markup)
+                    show_menu(update, context, message, reply_markup)
                     return f'WAITING_USERNAME_{role.upper()}_{action.upper()}'
     logger.info('function "handle_menu_owner" ended\n')
-    return start_owner(update, context)
+    return start_owner(update, context, message)
 
 
 def waiting_username(update: Update, context: CallbackContext, role: Client.Role, is_add: bool) -> str:
     """Waiting username and call user process"""
     logger.info('function "waiting_username" was run')
-    chat_id = update.effective_chat.id
     query = update.callback_query
     no_text_message = True
-    if update.message:
+    if update.message and update.message.text:
         username = update.message.text
         no_text_message = False
     if query and query.data == 'get_back':
         return start_owner(update, context)
     elif no_text_message:  # if order disappeared or client send not a text
         message = 'Что-то пошло не так, попробуйте снова'
-        context.bot.send_message(text=message, chat_id=chat_id)
     else:
-        process_bot_user(update, context, username, role, is_add)
+        message = process_bot_user(username, role, is_add)
     logger.info('function "waiting_username" ended\n')
-    return start_owner(update, context)
+    return start_owner(update, context, message)
 
 
 logger.info('"waiting_username" was run ')
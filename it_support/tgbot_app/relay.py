@@ -0,0 +1,92 @@
+import threading
+from time import monotonic
+from typing import NamedTuple
+from typing import Optional
+
+from django.db.models import Q
+from telegram import Bot
+from telegram import Message
+from telegram.constants import MAX_CAPTION_LENGTH
+
+from support_app.models import BotUser
+from support_app.models import Order
+from tgbot_app.digests import TELEGRAM_MESSAGE_LIMIT
+
+# orders closed or released in other processes (admin) stop being relayed after this time
+PAIRING_TTL_SECONDS = 60
+# messages of these types can have a caption, the header is put into it
+CAPTION_ATTACHMENTS = ('photo', 'video', 'document', 'audio', 'animation', 'voice')
+# chat mode states of client and contractor, their messages are relayed to the counterpart
+RELAY_STATES = frozenset(('WAIT_MESSAGE_TO_CONTRACTOR_CLIENT', 'WAIT_MESSAGE_TO_CLIENT_CONTRACTOR'))
+
+
+class Pairing(NamedTuple):
+    order_id: int
+    chat_id: Optional[int]
+    cached_at: float
+
+
+class OrderPairings:
+    """
+    Chat of the counterpart of a client or contractor by their order in work.
+
+    Pairings are cached in the process, so messages of chat mode don't look up the order
+    every time. Bot handlers which close or take orders forget pairings at once
+    """
+
+    def __init__(self, ttl_seconds: float = PAIRING_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.pairings: dict[int, Pairing] = {}
+
+    def get(self, user: BotUser) -> Optional[Pairing]:
+        """Pairing of the user, None if there is no order in work"""
+        now = monotonic()
+        with self.lock:
+            pairing = self.pairings.get(user.pk)
+        if pairing is not None and now - pairing.cached_at < self.ttl_seconds:
+            return pairing
+
+        # one query for both roles, absence of order is not cached: it is taken in work in another process
+        order = Order.objects.filter(
+            Q(client_id=user.pk) | Q(contractor_id=user.pk),
+            status=Order.Status.in_work,
+        ).values_list('pk', 'client__telegram_id', 'contractor__telegram_id').first()
+        with self.lock:
+            if order is None:
+                self.pairings.pop(user.pk, None)
+                return None
+            order_id, client_chat_id, contractor_chat_id = order
+            chat_id = contractor_chat_id if user.role == BotUser.Role.client else client_chat_id
+            pairing = Pairing(order_id, chat_id, now)
+            self.pairings[user.pk] = pairing
+        return pairing
+
+    def forget(self, *user_ids: int) -> None:
+        with self.lock:
+            for user_id in user_ids:
+                self.pairings.pop(user_id, None)
+
+
+order_pairings = OrderPairings()
+
+
+def relay_message(bot: Bot, message: Message, chat_id: int, header: str) -> None:
+    """
+    Send message of any type to chat_id with header telling who it is from.
+
+    Text is sent with the header in one message. Other messages are copied by Telegram
+    (copyMessage), files are not downloaded and uploaded again, the header is put into
+    the caption if the type has one, otherwise it is sent before the copy
+    """
+    if message.text is not None and len(header) + len(message.text) + 2 <= TELEGRAM_MESSAGE_LIMIT:
+        bot.send_message(chat_id=chat_id, text=f'{header}\n\n{message.text}')
+        return
+
+    caption = None
+    if any(getattr(message, attachment) for attachment in CAPTION_ATTACHMENTS):
+        caption = f'{header}\n\n{message.caption}' if message.caption else header
+    if caption is None or len(caption) > MAX_CAPTION_LENGTH:
+        bot.send_message(chat_id=chat_id, text=header)
+        caption = None
+    bot.copy_message(chat_id=chat_id, from_chat_id=message.chat_id, message_id=message.message_id, caption=caption)
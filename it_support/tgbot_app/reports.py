@@ -0,0 +1,232 @@
+import csv
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable
+from typing import Hashable
+from typing import NamedTuple
+from typing import Optional
+
+from django.db import connection
+from django.utils import timezone
+from telegram import Bot
+from telegram.error import TelegramError
+
+from support_app.analytics import calculate_contractors_performance
+from support_app.models import Order
+from support_app.models import SlaSketch
+from support_app.models import get_billing_calendar
+from support_app.models import get_names_watermark
+from support_app.models import get_nearest_billing_start_date
+
+logger = logging.getLogger('tgbot_app_error')
+logger_info = logging.getLogger('tgbot_app_info')
+
+# reports are heavy queries, more workers would only compete for the database
+REPORT_WORKERS = 2
+REPORT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+def build_billing_report() -> list[list]:
+    header = ['Подрядчик', 'Выполненных заказов']
+    billing = [
+        [
+            contractor_billing['contractor__tg_nick'],
+            contractor_billing['count_orders'],
+        ]
+        for contractor_billing
+        in Order.objects.calculate_billing()
+    ]
+    return [header] + billing
+
+
+def build_orders_stats_report() -> list[list]:
+    header = ['Начало биллинга', 'Клиент', 'Число заказов']
+    return [header] + [
+        [billing_start, client, orders_count]
+        for billing_start, client, orders_count
+        in Order.objects.calculate_average_orders_in_month()
+    ]
+
+
+def build_contractors_performance_report() -> list[list]:
+    billing_starts, contractors_performance = calculate_contractors_performance()
+    header = [
+        'Подрядчик',
+        'Выполненных заказов',
+        'Медиана выполнения, ч',
+        'p90 выполнения, ч',
+        'Заказов с оценкой',
+        'Ошибка оценки',
+        'Смещение оценки',
+    ] + [f'Заказов с {billing_start:%d.%m.%Y}' for billing_start in billing_starts]
+    performance = [
+        [
+            contractor_performance['contractor'],
+            contractor_performance['closed_orders'],
+            contractor_performance['median_hours'],
+            contractor_performance['p90_hours'],
+            contractor_performance['estimated_orders'],
+            contractor_performance['estimate_error'],
+            contractor_performance['estimate_bias'],
+        ] + contractor_performance['throughput']
+        for contractor_performance in contractors_performance
+    ]
+    return [header] + performance
+
+
+def build_tariffs_sla_report() -> list[list]:
+    header = ['Тариф', 'Метрика', 'Число заказов', 'p50, мин', 'p90, мин', 'p99, мин']
+    tariffs_sla = SlaSketch.objects.calculate_percentiles(
+        timezone.localdate(get_nearest_billing_start_date()),
+        timezone.localdate(),
+    )
+    return [header] + tariffs_sla
+
+
+def get_prev_billing_watermark() -> tuple[datetime, tuple]:
+    """Previous billing period and watermark of orders closed in it, other orders don't change the billing"""
+    billing_calendar = get_billing_calendar()
+    nearest_billing_start_date = billing_calendar.get_period_start()
+    prev_billing_start_date = billing_calendar.shift(nearest_billing_start_date, -1)
+    period_orders = Order.objects.filter(
+        closed_at__gt=prev_billing_start_date,
+        closed_at__lte=nearest_billing_start_date,
+    )
+    return prev_billing_start_date, period_orders.get_watermark()
+
+
+def get_all_orders_watermark() -> tuple[datetime, tuple]:
+    """Current billing period and watermark of all orders, for reports over the whole history"""
+    return get_nearest_billing_start_date(), Order.objects.get_watermark()
+
+
+def get_report_cache_key(report_type: str) -> tuple:
+    """Reports show user nicks and tariff names edited in the admin, so their fingerprint is a part of the key"""
+    names_fingerprint, _ = get_names_watermark()
+    return report_type, *REPORTS[report_type].get_watermark(), names_fingerprint
+
+
+class Report(NamedTuple):
+    filename: str
+    build: Callable[[], list[list]]
+    # returns (billing period, orders watermark), the report is the same while they are the same
+    get_watermark: Callable[[], tuple[datetime, tuple]]
+
+
+# report type is the owner menu callback data
+REPORTS = {
+    'contractor_billing_prev_month': Report('billing.csv', build_billing_report, get_prev_billing_watermark),
+    'orders_stats': Report('stats.csv', build_orders_stats_report, get_all_orders_watermark),
+    'contractors_performance': Report(
+        'contractors_performance.csv',
+        build_contractors_performance_report,
+        get_all_orders_watermark,
+    ),
+    'tariffs_sla': Report('tariffs_sla.csv', build_tariffs_sla_report, get_all_orders_watermark),
+}
+
+
+def render_csv(rows: list[list]) -> bytes:
+    content = io.StringIO()
+    csv.writer(content).writerows(rows)
+    return content.getvalue().encode('utf8')
+
+
+class ReportCache:
+    """
+    Rendered reports keyed by (report type, billing period, orders watermark, names watermark).
+
+    A changed order or a renamed user or tariff changes the key, so stale entries are never hit and are evicted
+    as least recently used when total size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = REPORT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[Hashable, bytes] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self.lock:
+            content = self.entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key: Hashable, content: bytes) -> None:
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted_content = self.entries.popitem(last=False)
+                self.size -= len(evicted_content)
+
+
+class ReportExecutor:
+    """
+    Build reports in a bounded pool of worker threads, so dispatcher workers are not blocked.
+
+    Requests for a report which is already being built don't start a new run,
+    the chat is added to the recipients of the running one.
+    """
+
+    def __init__(self, max_workers: int = REPORT_WORKERS, cache: Optional[ReportCache] = None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self.cache = cache or ReportCache()
+        self.lock = threading.Lock()
+        self.recipients: dict[str, list[int]] = {}
+
+    def submit(self, bot: Bot, report_type: str, chat_id: int) -> bool:
+        """Request a report for the chat, returns False if the same report is already being built"""
+        with self.lock:
+            if report_type in self.recipients:
+                if chat_id not in self.recipients[report_type]:
+                    self.recipients[report_type].append(chat_id)
+                return False
+            self.recipients[report_type] = [chat_id]
+        self.executor.submit(self.run, bot, report_type)
+        return True
+
+    def run(self, bot: Bot, report_type: str) -> None:
+        report = REPORTS[report_type]
+        content = None
+        try:
+            cache_key = get_report_cache_key(report_type)
+            content = self.cache.get(cache_key)
+            if content is None:
+                content = render_csv(report.build())
+                self.cache.put(cache_key, content)
+                logger_info.info(f'report "{report_type}" is built, {len(content)} bytes')
+        except Exception:
+            logger.exception(f'report "{report_type}" failed')
+        finally:
+            # every worker thread has own connection, don't leave it open between runs
+            connection.close()
+            # requests after this point start a new run with fresh data
+            with self.lock:
+                chat_ids = self.recipients.pop(report_type)
+
+        for chat_id in chat_ids:
+            try:
+                if content is None:
+                    bot.send_message(text='Не удалось подготовить отчет, попробуйте позже', chat_id=chat_id)
+                else:
+                    bot.send_document(document=io.BytesIO(content), filename=report.filename, chat_id=chat_id)
+            except TelegramError as error:
+                logger.error(f'report "{report_type}" was not sent to chat {chat_id}: {error}')
+
+
+report_executor = ReportExecutor()
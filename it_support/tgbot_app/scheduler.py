@@ -0,0 +1,85 @@
+import logging
+import os
+import socket
+from datetime import timedelta
+from functools import wraps
+from time import monotonic
+from typing import Callable
+from uuid import uuid4
+
+from django.db import DatabaseError
+from telegram.ext.callbackcontext import CallbackContext
+
+from tgbot_app.models import SchedulerLease
+
+logger = logging.getLogger('tgbot_app_error')
+logger_info = logging.getLogger('tgbot_app_info')
+
+PERIODIC_JOBS_LEASE = 'periodic_jobs'
+# lease is renewed every heartbeat, another process takes it over when the holder misses ttl
+LEASE_TTL_SECONDS = 30
+LEASE_HEARTBEAT_SECONDS = 10
+
+
+class LeaderLease:
+    """
+    Lease in the database which makes one of the processes the leader.
+
+    The lease is considered lost locally a heartbeat before it expires in the database,
+    so an old leader stops running jobs before a new one can take the lease over.
+    Processes compare expiration with their own clocks, so they should be synchronized
+    much better than LEASE_TTL_SECONDS
+    """
+
+    def __init__(
+            self,
+            name: str,
+            ttl_seconds: float = LEASE_TTL_SECONDS,
+            heartbeat_seconds: float = LEASE_HEARTBEAT_SECONDS,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+        self.held_until = 0
+        # incremented every time the lease is taken, state built in a previous term may be stale
+        self.term = 0
+
+    def is_held(self) -> bool:
+        return monotonic() < self.held_until
+
+    def heartbeat(self, context: CallbackContext = None) -> None:
+        """Job to take or renew the lease"""
+        was_held = self.is_held()
+        started_at = monotonic()
+        try:
+            is_acquired = SchedulerLease.objects.acquire(self.name, self.holder, timedelta(seconds=self.ttl_seconds))
+        except DatabaseError as error:
+            logger.error(f'lease "{self.name}" was not renewed: {error}')
+            is_acquired = False
+
+        if is_acquired and not was_held:
+            self.term += 1
+        if is_acquired:
+            self.held_until = started_at + self.ttl_seconds - self.heartbeat_seconds
+        else:
+            self.held_until = 0
+        if is_acquired != was_held:
+            logger_info.info(f'lease "{self.name}" is {"taken" if is_acquired else "lost"} by {self.holder}')
+
+    def release(self) -> None:
+        if self.is_held():
+            self.held_until = 0
+            SchedulerLease.objects.release(self.name, self.holder)
+            logger_info.info(f'lease "{self.name}" is released by {self.holder}')
+
+    def leader_only(self, job_callback: Callable) -> Callable:
+        """Decorator for jobs which should run in one process only"""
+
+        @wraps(job_callback)
+        def wrapper(context: CallbackContext):
+            if self.is_held():
+                return job_callback(context)
+            return None
+
+        return wrapper
@@ -1,3 +1,621 @@
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import SimpleTestCase
 from django.test import TestCase
+from django.utils import timezone
+from telegram import Update
+from telegram.error import NetworkError
+from telegram.error import RetryAfter
+from telegram.error import Unauthorized
+
+from support_app.models import AssignedContractor
+from support_app.models import BotUser
+from support_app.models import Client
+from support_app.models import Contractor
+from support_app.models import Order
+from support_app.models import Tariff
+from tgbot_app.conversation import ChatContext
+from tgbot_app.conversation import ChatContextStore
+from tgbot_app.digests import TELEGRAM_MESSAGE_LIMIT
+from tgbot_app.digests import build_manager_digest
+from tgbot_app.digests import split_message
+from tgbot_app.drafts import EMPTY_DRAFT
+from tgbot_app.drafts import DraftStore
+from tgbot_app.loadtest import FakeBot
+from tgbot_app.loadtest import SimulatedUser
+from tgbot_app.loadtest import UpdateFactory
+from tgbot_app.notifier import SCAN_OVERLAP
+from tgbot_app.notifier import NewOrdersSchedule
+from tgbot_app.management.commands.start_bot import create_bot
+from tgbot_app.models import NotifierWatermark
+from tgbot_app.models import OutboxMessage
+from tgbot_app.models import SchedulerLease
+from tgbot_app.outbox import DISPATCH_BUDGET_SECONDS
+from tgbot_app.outbox import DISPATCH_INTERVAL_SECONDS
+from tgbot_app.outbox import MAX_ATTEMPTS
+from tgbot_app.outbox import dispatch_outbox
+from tgbot_app.outbox import purge_outbox
+from tgbot_app.reports import ReportCache
+from tgbot_app.reports import get_report_cache_key
+from tgbot_app.scheduler import LeaderLease
+from tgbot_app.throttling import TokenBucket
+from tgbot_app.throttling import UpdateThrottler
+
+
+class RecordingBot:
+    """Bot which keeps sent messages, errors are raised for the chats they are given for"""
+
+    def __init__(self, errors: dict = None):
+        self.errors = errors or {}
+        self.sent = []
+
+    def send_message(self, chat_id, text):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append((chat_id, text))
+
+
+class OutboxDispatchTestCase(TestCase):
+
+    def test_dispatch_stops_when_lease_is_lost(self):
+        OutboxMessage.objects.enqueue([1, 2, 3, 4, 5], 'Новый заказ')
+        leader_checks = iter([True, True])
+        bot = RecordingBot()
+
+        delivered_count = dispatch_outbox(bot, is_leader=lambda: next(leader_checks, False))
+
+        self.assertEqual(delivered_count, 2)
+        self.assertEqual([chat_id for chat_id, _ in bot.sent], [1, 2])
+        self.assertEqual(OutboxMessage.objects.pending().count(), 3)
+
+    def test_dispatch_stops_when_budget_is_spent(self):
+        OutboxMessage.objects.enqueue([1, 2, 3, 4, 5], 'Новый заказ')
+        bot = RecordingBot()
+        # every message takes a second to send
+        clock = iter(range(100))
+
+        with patch('tgbot_app.outbox.time.monotonic', side_effect=lambda: next(clock)):
+            delivered_count = dispatch_outbox(bot)
+
+        self.assertLess(DISPATCH_BUDGET_SECONDS, DISPATCH_INTERVAL_SECONDS)
+        self.assertEqual(delivered_count, DISPATCH_BUDGET_SECONDS - 1)
+        self.assertEqual(OutboxMessage.objects.pending().count(), 5 - delivered_count)
+
+    def test_errors_are_retried_with_backoff(self):
+        OutboxMessage.objects.enqueue([1, 2, 3], 'Новый заказ')
+        bot = RecordingBot({1: NetworkError('connection reset'), 2: Unauthorized('bot was blocked by the user')})
+
+        self.assertEqual(dispatch_outbox(bot), 1)
+
+        retried, blocked, delivered = OutboxMessage.objects.order_by('chat_id')
+        self.assertEqual((retried.status, retried.attempts), (OutboxMessage.Status.pending, 1))
+        self.assertGreater(retried.next_attempt_at, timezone.now() + timedelta(seconds=9))
+        self.assertEqual(blocked.status, OutboxMessage.Status.failed)
+        self.assertEqual(blocked.last_error, 'bot was blocked by the user')
+        self.assertEqual(delivered.status, OutboxMessage.Status.delivered)
+
+        # the delay doubles with every attempt, the message fails after MAX_ATTEMPTS
+        for attempt in range(1, MAX_ATTEMPTS):
+            OutboxMessage.objects.filter(pk=retried.pk).update(next_attempt_at=timezone.now())
+            sent_at = timezone.now()
+            dispatch_outbox(bot)
+            retried.refresh_from_db()
+            self.assertEqual(retried.attempts, attempt + 1)
+            if attempt + 1 < MAX_ATTEMPTS:
+                self.assertGreaterEqual(retried.next_attempt_at, sent_at + timedelta(seconds=10 * 2 ** attempt))
+        self.assertEqual(retried.status, OutboxMessage.Status.failed)
+
+    def test_retry_after_stops_dispatch_without_attempt(self):
+        OutboxMessage.objects.enqueue([1, 2], 'Новый заказ')
+        bot = RecordingBot({1: RetryAfter(30)})
+
+        self.assertEqual(dispatch_outbox(bot), 0)
+
+        self.assertEqual(bot.sent, [])
+        postponed = OutboxMessage.objects.get(chat_id=1)
+        self.assertEqual((postponed.status, postponed.attempts), (OutboxMessage.Status.pending, 0))
+        self.assertGreater(postponed.next_attempt_at, timezone.now() + timedelta(seconds=29))
+        self.assertEqual(list(OutboxMessage.objects.pending().values_list('chat_id', flat=True)), [2])
+
+    def test_purge_drops_old_and_overflow_messages(self):
+        OutboxMessage.objects.enqueue(range(1, 6), 'Новый заказ')
+        old_message, failed_message, *pending_ids = OutboxMessage.objects.order_by('pk').values_list('pk', flat=True)
+        OutboxMessage.objects.filter(pk=old_message).update(
+            status=OutboxMessage.Status.delivered,
+            processed_at=timezone.now() - timedelta(days=2),
+        )
+        OutboxMessage.objects.filter(pk=failed_message).update(
+            status=OutboxMessage.Status.failed,
+            processed_at=timezone.now() - timedelta(days=2),
+        )
+
+        with patch('tgbot_app.outbox.MAX_PENDING', 2):
+            purge_outbox()
+
+        self.assertFalse(OutboxMessage.objects.filter(pk=old_message).exists())
+        self.assertTrue(OutboxMessage.objects.filter(pk=failed_message).exists())
+        # the oldest pending message is dropped
+        self.assertEqual(list(OutboxMessage.objects.pending().values_list('pk', flat=True)), pending_ids[1:])
+        self.assertEqual(OutboxMessage.objects.get(pk=pending_ids[0]).last_error, 'outbox overflow')
+
+
+class NewOrdersInformTestCase(TestCase):
+    """Informing contractors must not overwrite an order taken in work meanwhile"""
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        cls.client_user = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=tariff,
+            paid=True,
+            telegram_id=100,
+        )
+        cls.contractors = [
+            Contractor.objects.create(tg_nick=f'testcontractor{index}', role=BotUser.Role.contractor, telegram_id=index)
+            for index in range(1, 4)
+        ]
+
+    def setUp(self):
+        self.bot = create_bot(FakeBot(settings.TELEGRAM_ACCESS_TOKEN), run_jobs=False)
+        self.order = Order.objects.create(task='Задание', client=self.client_user)
+        # the notifier read the order before the contractor took it
+        self.stale_order = Order.objects.get(pk=self.order.pk)
+        self.order.take_in_work(self.contractors[0], 3)
+
+    def assert_order_kept_in_work(self):
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.contractor_id), (Order.Status.in_work, self.contractors[0].pk))
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_assigned_contractors_are_not_informed_about_taken_order(self):
+        assigned_contractor = AssignedContractor.objects.create(client=self.client_user, contractor=self.contractors[1])
+        next_inform_at = self.bot.process_new_order_with_contractors(
+            self.stale_order,
+            [assigned_contractor],
+            self.contractors,
+            0.2,
+            (timedelta(minutes=6), 3),
+            'Новый заказ',
+        )
+        self.assertIsNone(next_inform_at)
+        self.assert_order_kept_in_work()
+
+    def test_wave_is_not_sent_for_taken_order(self):
+        next_wave_at = self.bot.inform_contractors_wave(
+            self.stale_order,
+            self.contractors,
+            self.stale_order.created_at,
+            timedelta(minutes=6),
+            3,
+            'Новый заказ',
+        )
+        self.assertIsNone(next_wave_at)
+        self.assert_order_kept_in_work()
+        self.assertEqual(self.order.contractors_inform_wave, 0)
+
+
+class ChatModeThrottlingTestCase(TestCase):
+    """Every message of a burst in chat mode reaches the counterpart, e.g. photos of an album"""
+
+    def test_burst_of_chat_mode_is_relayed(self):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        client = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=tariff,
+            paid=True,
+            telegram_id=100,
+            bot_state='WAIT_MESSAGE_TO_CONTRACTOR_CLIENT',
+        )
+        contractor = Contractor.objects.create(tg_nick='testcontractor', role=BotUser.Role.contractor, telegram_id=200)
+        Order.objects.create(task='Задание', client=client).take_in_work(contractor, 3)
+        fake_bot = FakeBot(settings.TELEGRAM_ACCESS_TOKEN)
+        dispatcher = create_bot(fake_bot, run_jobs=False).updater.dispatcher
+        user = SimulatedUser(client.telegram_id, client.tg_nick, client.role)
+        updates = UpdateFactory()
+        burst_size = 12  # over the burst of the throttler
+
+        for index in range(burst_size):
+            dispatcher.process_update(Update.de_json(updates.build(user, ('text', f'Фото {index}')), fake_bot))
+
+        self.assertEqual(fake_bot.calls['sendMessage'], burst_size)
+
+
+class RecordingJobQueue:
+
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, context=None, name=None):
+        self.jobs.append((when, context))
+
+
+class UpdateThrottlerTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        monotonic_patcher = patch('tgbot_app.throttling.monotonic', lambda: self.now)
+        monotonic_patcher.start()
+        self.addCleanup(monotonic_patcher.stop)
+        self.throttler = UpdateThrottler({'Клиент': (1, 2)})
+        self.handled = []
+        self.handler = self.throttler(lambda update, context: self.handled.append(update))
+        chat = ChatContext()
+        chat.role = BotUser.Role.client
+        self.context = SimpleNamespace(user_data=chat, job_queue=RecordingJobQueue())
+
+    def build_update(self, is_callback: bool):
+        return SimpleNamespace(effective_chat=SimpleNamespace(id=1), callback_query=object() if is_callback else None)
+
+    def test_bucket_refills_up_to_capacity(self):
+        bucket = TokenBucket(rate=2, capacity=3, now=0)
+        self.assertTrue(all(bucket.try_take(0) for _ in range(3)))
+        self.assertFalse(bucket.try_take(0))
+        self.assertEqual(bucket.seconds_until_token(), 0.5)
+        self.assertTrue(bucket.try_take(0.5))
+        self.assertFalse(bucket.is_full(1))
+        self.assertTrue(bucket.is_full(10))
+        self.assertEqual(bucket.tokens, 3)
+
+    def test_messages_over_burst_are_dropped(self):
+        messages = [self.build_update(is_callback=False) for _ in range(3)]
+        for message in messages:
+            self.handler(message, self.context)
+        self.assertEqual(self.handled, messages[:2])
+
+        self.now += 1
+        self.handler(messages[2], self.context)
+        self.assertEqual(self.handled, messages)
+        self.assertEqual(self.throttler.pop_counters()['dropped', BotUser.Role.client], 1)
+
+    def test_only_last_callback_of_burst_is_replayed(self):
+        callbacks = [self.build_update(is_callback=True) for _ in range(5)]
+        for callback in callbacks:
+            self.handler(callback, self.context)
+        self.assertEqual(self.handled, callbacks[:2])
+        # one replay is scheduled for the burst and it takes the last callback
+        self.assertEqual(self.context.job_queue.jobs, [(1, 1)])
+        self.assertTrue(self.throttler.is_pending(callbacks[-1]))
+
+        self.now += 1
+        self.handler(callbacks[-1], self.context)
+        self.assertEqual(self.handled, callbacks[:2] + callbacks[-1:])
+        self.assertFalse(self.throttler.is_pending(callbacks[-1]))
+        counters = self.throttler.pop_counters()
+        self.assertEqual(counters['coalesced', BotUser.Role.client], 2)
+        self.assertEqual(counters['replayed', BotUser.Role.client], 1)
+
+
+class LeaderLeaseTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        monotonic_patcher = patch('tgbot_app.scheduler.monotonic', lambda: self.now)
+        monotonic_patcher.start()
+        self.addCleanup(monotonic_patcher.stop)
+        self.leader = LeaderLease('test', ttl_seconds=30, heartbeat_seconds=10)
+        self.follower = LeaderLease('test', ttl_seconds=30, heartbeat_seconds=10)
+
+    def test_only_one_process_holds_lease(self):
+        self.leader.heartbeat()
+        self.follower.heartbeat()
+        self.assertTrue(self.leader.is_held())
+        self.assertFalse(self.follower.is_held())
+        self.assertEqual(SchedulerLease.objects.get(name='test').holder, self.leader.holder)
+
+        # renewal keeps the term and the time the lease was taken
+        acquired_at = SchedulerLease.objects.get(name='test').acquired_at
+        self.now += 10
+        self.leader.heartbeat()
+        self.assertEqual(self.leader.term, 1)
+        self.assertEqual(SchedulerLease.objects.get(name='test').acquired_at, acquired_at)
+
+    def test_expired_lease_is_taken_over(self):
+        self.leader.heartbeat()
+        # the leader missed heartbeats, it stops a heartbeat before the lease expires in the database
+        self.now += 20
+        self.assertFalse(self.leader.is_held())
+        SchedulerLease.objects.filter(name='test').update(expires_at=timezone.now())
+
+        self.follower.heartbeat()
+        self.assertTrue(self.follower.is_held())
+        self.assertEqual(self.follower.term, 1)
+        self.leader.heartbeat()
+        self.assertFalse(self.leader.is_held())
+
+    def test_released_lease_is_taken_at_once(self):
+        self.leader.heartbeat()
+        self.leader.release()
+        self.follower.heartbeat()
+        self.assertFalse(self.leader.is_held())
+        self.assertTrue(self.follower.is_held())
+
+
+class ChatContextStoreTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        monotonic_patcher = patch('tgbot_app.conversation.monotonic', lambda: self.now)
+        monotonic_patcher.start()
+        self.addCleanup(monotonic_patcher.stop)
+
+    def test_least_recently_active_chat_is_evicted(self):
+        chats = ChatContextStore(max_chats=2)
+        chats[1].menu_message_id = 10
+        chats[2]
+        chats[1]  # chat 2 is the least recently active now
+        chats[3]
+        self.assertEqual(chats.keys(), [1, 3])
+        self.assertEqual(chats[1].menu_message_id, 10)
+        self.assertIsNone(chats[2].menu_message_id)
+
+    def test_idle_chats_are_pruned(self):
+        chats = ChatContextStore(ttl_seconds=60)
+        chats[1]
+        chats[2]
+        self.now += 30
+        chats[1]
+        self.now += 40
+        self.assertEqual(chats.prune(), 1)
+        self.assertEqual(chats.keys(), [1])
+        self.now += 60
+        self.assertEqual(chats.prune(), 1)
+        self.assertEqual(len(chats), 0)
+
+
+class DraftStoreTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/drafts.sqlite3'
+        self.drafts = self.open_drafts()
+
+    def open_drafts(self) -> DraftStore:
+        drafts = DraftStore(self.path)
+        self.addCleanup(drafts.close)
+        return drafts
+
+    def test_drafts_survive_reopening(self):
+        self.drafts.save({1: (10, None), 2: (None, 'Не работает сайт'), 3: EMPTY_DRAFT})
+        self.drafts.close()
+        drafts = self.open_drafts()
+        self.assertEqual(drafts.load(1), (10, None))
+        self.assertEqual(drafts.load(2), (None, 'Не работает сайт'))
+        self.assertEqual(drafts.load(3), EMPTY_DRAFT)
+
+        drafts.save({1: EMPTY_DRAFT})
+        self.assertEqual(drafts.load(1), EMPTY_DRAFT)
+        self.assertEqual(drafts.purge(ttl_seconds=-1), 1)
+        self.assertEqual(drafts.load(2), EMPTY_DRAFT)
+
+    def test_only_changed_drafts_are_flushed(self):
+        chats = ChatContextStore(drafts=self.drafts)
+        chats[1].creating_order_task = 'Не работает сайт'
+        chats[2]
+        self.assertEqual(chats.flush_drafts(), 1)
+        self.assertEqual(chats.flush_drafts(), 0)
+
+        # a changed draft of an evicted chat is saved by the next flush
+        chats[1].order_in_process_id = 10
+        chats.forget(1, chats.chats[1])
+        self.assertEqual(chats[1].get_draft(), (10, 'Не работает сайт'))
+        self.assertEqual(chats.flush_drafts(), 1)
+        chats.close()
+
+        # after a restart chats are loaded from the drafts
+        restarted_chats = ChatContextStore(drafts=self.open_drafts())
+        self.assertEqual(restarted_chats[1].get_draft(), (10, 'Не работает сайт'))
+        self.assertEqual(restarted_chats[2].get_draft(), EMPTY_DRAFT)
+
+
+class NewOrdersScheduleTestCase(TestCase):
+    """Notifier reads only new, released and due orders"""
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        cls.client_user = Client.objects.create(
+            tg_nick='testclient',
+            role=BotUser.Role.client,
+            tariff=tariff,
+            paid=True,
+            telegram_id=100,
+        )
+        cls.contractor = Contractor.objects.create(tg_nick='testcontractor', role=BotUser.Role.contractor)
+
+    def create_order(self) -> Order:
+        return Order.objects.create(task='Задание', client=self.client_user)
+
+    @staticmethod
+    def age_orders() -> None:
+        """Orders updated before the scan overlap are not read by update time anymore"""
+        Order.objects.update(updated_at=timezone.now() - SCAN_OVERLAP * 2)
+
+    def test_new_released_and_due_orders_are_collected(self):
+        first_order = self.create_order()
+        schedule = NewOrdersSchedule()
+        self.assertEqual(schedule.collect(1), [first_order.pk])
+        schedule.schedule(first_order.pk, timezone.now() + timedelta(hours=1))
+        schedule.save_watermark()
+        self.age_orders()
+        self.assertEqual(NotifierWatermark.objects.get(name=schedule.name).order_id, first_order.pk)
+
+        # the watermark is advanced, only the new order is read
+        second_order = self.create_order()
+        self.assertEqual(schedule.collect(1), [second_order.pk])
+        Order.objects.filter(pk=second_order.pk).update(assigned_contractors_informed=True, contractors_inform_wave=1)
+        schedule.schedule(second_order.pk, None)
+        self.age_orders()
+        self.assertEqual(schedule.collect(1), [])
+
+        # released order is not informed again and comes back
+        second_order.refresh_from_db()
+        second_order.take_in_work(self.contractor, 3)
+        self.age_orders()
+        self.assertEqual(schedule.collect(1), [])
+        Order.objects.filter(pk=second_order.pk).release()
+        self.assertEqual(schedule.collect(1), [second_order.pk])
+
+    def test_orders_are_resynced_when_lease_is_taken_again(self):
+        order = self.create_order()
+        schedule = NewOrdersSchedule()
+        self.assertEqual(schedule.collect(1), [order.pk])
+        schedule.schedule(order.pk, timezone.now() + timedelta(hours=1))
+        self.age_orders()
+        self.assertEqual(schedule.collect(1), [])
+        # another leader could inform the order while this process didn't hold the lease
+        self.assertEqual(schedule.collect(2), [order.pk])
+
+    def test_orders_are_due_again_after_failed_run(self):
+        orders = [self.create_order() for _ in range(2)]
+        bot = create_bot(FakeBot(settings.TELEGRAM_ACCESS_TOKEN), run_jobs=False)
+
+        with patch.object(bot, 'inform_contractors_wave', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                bot.handle_new_orders_inform(None)
+
+        self.age_orders()
+        self.assertEqual(sorted(bot.new_orders_schedule.collect(bot.lease.term)), [order.pk for order in orders])
+
+
+class ReportCacheTestCase(SimpleTestCase):
+
+    def test_least_recently_used_reports_are_evicted_by_size(self):
+        cache = ReportCache(max_bytes=10)
+        cache.put('billing', b'1234')
+        cache.put('stats', b'1234')
+        self.assertEqual(cache.get('billing'), b'1234')
+
+        cache.put('sla', b'1234')
+
+        # stats was used least recently
+        self.assertIsNone(cache.get('stats'))
+        self.assertEqual(cache.get('billing'), b'1234')
+        self.assertEqual(cache.get('sla'), b'1234')
+        self.assertEqual(cache.size, 8)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_report_larger_than_cache_is_not_stored(self):
+        cache = ReportCache(max_bytes=10)
+        cache.put('billing', b'1234')
+        cache.put('stats', b'12345678901')
+
+        self.assertIsNone(cache.get('stats'))
+        self.assertEqual(cache.get('billing'), b'1234')
+
+    def test_report_put_again_replaces_its_size(self):
+        cache = ReportCache(max_bytes=10)
+        cache.put('billing', b'1234')
+        cache.put('billing', b'123456')
+
+        self.assertEqual(cache.size, 6)
+        self.assertEqual(list(cache.entries), ['billing'])
+
+
+class ReportCacheKeyTestCase(TestCase):
+    """Reports show nicks and tariff names, renaming them in the admin must change the cached report"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tariff = Tariff.objects.create(
+            name='test',
+            orders_limit=5,
+            reaction_time_minutes=60,
+            can_reserve_contractor=True,
+            can_see_contractor_contacts=True,
+            price=Decimal(1000),
+        )
+        cls.contractor = Contractor.objects.create(tg_nick='testcontractor', role=BotUser.Role.contractor)
+
+    def test_key_changes_when_contractor_or_tariff_is_renamed(self):
+        key = get_report_cache_key('contractor_billing_prev_month')
+        self.assertEqual(get_report_cache_key('contractor_billing_prev_month'), key)
+
+        self.contractor.tg_nick = 'renamedcontractor'
+        self.contractor.save()
+        contractor_renamed_key = get_report_cache_key('contractor_billing_prev_month')
+        self.assertNotEqual(contractor_renamed_key, key)
+
+        self.tariff.name = 'renamed'
+        self.tariff.save()
+        self.assertNotEqual(get_report_cache_key('contractor_billing_prev_month'), contractor_renamed_key)
+
+
+class SplitMessageTestCase(SimpleTestCase):
+    """Digests are split between blocks into messages which fit in the telegram limit"""
+
+    def test_blocks_fill_message_up_to_limit(self):
+        blocks = ['a' * (TELEGRAM_MESSAGE_LIMIT - 96), 'b' * 96]
+        self.assertEqual(split_message(blocks), [''.join(blocks)])
+
+        messages = split_message(blocks + ['c'])
+        self.assertEqual(messages, [''.join(blocks), 'c'])
+
+    def test_block_longer_than_limit_is_truncated(self):
+        messages = split_message(['a', 'b' * (TELEGRAM_MESSAGE_LIMIT + 10), 'c'])
+
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(messages[0], 'a')
+        self.assertEqual(len(messages[1]), TELEGRAM_MESSAGE_LIMIT)
+        self.assertTrue(messages[1].endswith('…'))
+        self.assertEqual(messages[2], 'c')
+
+    def test_manager_digest_merges_both_kinds(self):
+        client = SimpleNamespace(tg_nick='testclient')
+        contractor = SimpleNamespace(tg_nick='testcontractor')
+        orders_not_in_work = [SimpleNamespace(task=f'new {number} ' + 'x' * 100, client=client) for number in range(40)]
+        orders_not_closed = [
+            SimpleNamespace(task=f'late {number} ' + 'x' * 100, client=client, contractor=contractor)
+            for number in range(40)
+        ]
+
+        digest = build_manager_digest(orders_not_in_work, orders_not_closed)
+
+        self.assertGreater(len(digest), 1)
+        self.assertTrue(all(len(message) <= TELEGRAM_MESSAGE_LIMIT for message in digest))
+        text = ''.join(digest)
+        # every kind is headed once, orders not in work go first
+        self.assertEqual(text.count('Есть заказы, которые долго не берут в работу'), 1)
+        self.assertEqual(text.count('Есть заказы, которые не выполнены'), 1)
+        self.assertTrue(digest[0].startswith('Есть заказы, которые долго не берут в работу'))
+        self.assertLess(text.index('new 39 '), text.index('Есть заказы, которые не выполнены'))
+        self.assertTrue(all(f'late {number} ' in text for number in range(40)))
+        self.assertEqual(text.count('Контакт подрядчика: @testcontractor'), 40)
+
+    def test_manager_digest_of_one_kind(self):
+        client = SimpleNamespace(tg_nick='testclient')
+        digest = build_manager_digest([SimpleNamespace(task='new', client=client)], [])
 
-# Create your tests here.
+        self.assertEqual(digest, [
+            'Есть заказы, которые долго не берут в работу\n\n'
+            'Задача: new \nКонтакт клиента: @testclient\n\n'
+        ])
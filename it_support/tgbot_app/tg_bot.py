@@ -1,8 +1,16 @@
+from datetime import datetime
+from datetime import timedelta
+from pathlib import Path
 from textwrap import dedent
 from typing import Callable
+from typing import Optional
+from typing import Union
 
+from django.conf import settings
 from django.db.transaction import atomic
 from django.utils import timezone
+from telegram import Bot
+from telegram.error import TelegramError
 from telegram.ext import CallbackQueryHandler
 from telegram.ext import CommandHandler
 from telegram.ext import Filters
@@ -11,16 +19,35 @@ from telegram.ext import Updater
 from telegram.ext.callbackcontext import CallbackContext
 from telegram.update import Update
 
+from support_app.matching import ContractorRanker
+from support_app.matching import plan_inform_wave
+from support_app.models import AssignedContractor
 from support_app.models import BotUser
 from support_app.models import Manager
 from support_app.models import Contractor
-from support_app.models import Client
 from support_app.models import Order
 from support_app.models import SystemSettings
+from tgbot_app.conversation import ChatContextStore
+from tgbot_app.digests import build_manager_digest
+from tgbot_app.digests import build_search_results
+from tgbot_app.drafts import DRAFTS_FLUSH_SECONDS
+from tgbot_app.drafts import DraftStore
+from tgbot_app.models import OutboxMessage
+from tgbot_app.notifier import NewOrdersSchedule
+from tgbot_app.outbox import DISPATCH_INTERVAL_SECONDS
+from tgbot_app.outbox import dispatch_outbox
+from tgbot_app.outbox import purge_outbox
+from tgbot_app.relay import RELAY_STATES
+from tgbot_app.scheduler import PERIODIC_JOBS_LEASE
+from tgbot_app.scheduler import LeaderLease
+from tgbot_app.throttling import UpdateThrottler
 
 import logging
 
 logger = logging.getLogger('tgbot_app_error')
+logger_info = logging.getLogger('tgbot_app_info')
+
+SEARCH_RESULTS_LIMIT = 10
 
 
 def get_user(func: Callable) -> Callable:
@@ -45,15 +72,29 @@ def get_user(func: Callable) -> Callable:
         except BotUser.DoesNotExist:
             user = None
 
-        context.user_data['user'] = user
-        return func(update, context)
+        chat = context.user_data
+        chat.user = user
+        chat.role = user.role if user is not None else None
+        try:
+            return func(update, context)
+        finally:
+            chat.is_relaying = user is not None and user.bot_state in RELAY_STATES
+            # user instance is not kept between updates, see ChatContext
+            chat.user = None
 
     return wrapper
 
 
 class TgBot(object):
 
-    def __init__(self, tg_token: str, states_functions: dict[str, dict[str, Callable]]) -> None:
+    def __init__(
+            self,
+            tg_token: str,
+            states_functions: dict[str, dict[str, Callable]],
+            bot: Optional[Bot] = None,
+            run_jobs: bool = True,
+            drafts_path: Optional[Union[str, Path]] = None,
+    ) -> None:
         """
             states_functions not dict[str, Callable] because it contains many bots like:
             states_functions = {
@@ -66,45 +107,135 @@ class TgBot(object):
                     'state_2_bot_2': func2_bot2,
                 }
             }
+            bot is used instead of a bot created by token, e.g. a fake bot in load tests
+            run_jobs is False for replicas which only handle updates, periodic jobs run in
+            the process holding the lease, see run_scheduler
+            drafts_path is SQLite file to keep drafts of conversations between restarts,
+            without it they are only in memory
         """
         self.tg_token = tg_token
         self.states_functions = states_functions
-        self.updater = Updater(token=tg_token, use_context=True)
-        self.updater.dispatcher.add_handler(CommandHandler('start', get_user(self.handle_users_reply)))
+        self.contractor_ranker = ContractorRanker()
+        self.new_orders_schedule = NewOrdersSchedule()
+        # flood protection goes before get_user, so shed updates don't touch the database
+        self.throttler = UpdateThrottler(settings.BOT_THROTTLE_RATES)
+        if bot is None:
+            self.updater = Updater(token=tg_token, use_context=True)
+        else:
+            self.updater = Updater(bot=bot, use_context=True)
+        # compact conversation data forgotten for idle chats instead of dicts kept for every chat
+        self.chat_contexts = ChatContextStore(drafts=DraftStore(drafts_path) if drafts_path else None)
+        self.updater.dispatcher.user_data = self.chat_contexts
+        self.updater.dispatcher.add_handler(
+            CommandHandler('start', self.throttler(get_user(self.handle_users_reply)))
+        )
         self.updater.dispatcher.add_handler(CommandHandler('help', self.help_handler))
-        self.updater.dispatcher.add_handler(CallbackQueryHandler(get_user(self.handle_users_reply)))
-        self.updater.dispatcher.add_handler(MessageHandler(Filters.text, get_user(self.handle_users_reply)))
+        self.updater.dispatcher.add_handler(
+            CommandHandler('search', self.throttler(get_user(self.search_handler)))
+        )
+        self.updater.dispatcher.add_handler(
+            # the button stops showing progress at once, shed callbacks are answered too
+            CallbackQueryHandler(self.answer_callback_query(self.throttler(get_user(self.handle_users_reply))))
+        )
+        self.updater.dispatcher.add_handler(
+            # attachments are relayed in chat mode of client and contractor, other states ask for text
+            MessageHandler(Filters.text | Filters.attachment, self.throttler(get_user(self.handle_users_reply)))
+        )
         self.updater.dispatcher.add_error_handler(self.error)
         self.job_queue = self.updater.job_queue
+        self.lease = LeaderLease(PERIODIC_JOBS_LEASE)
 
+        # throttler and chat contexts are local for every process handling updates
         self.job_queue.run_repeating(
-            self.handle_warning_orders_not_in_work,
-            interval=60,
-            first=10,
-            name='handle_warning_orders_not_in_work'
+            self.handle_throttle_stats,
+            interval=10 * 60,
+            first=10 * 60,
+            name='handle_throttle_stats'
         )
 
         self.job_queue.run_repeating(
-            self.handle_warning_orders_not_closed,
+            self.handle_idle_chats,
+            interval=10 * 60,
+            first=10 * 60,
+            name='handle_idle_chats'
+        )
+
+        if self.chat_contexts.drafts is not None:
+            self.job_queue.run_repeating(
+                self.handle_drafts_flush,
+                interval=DRAFTS_FLUSH_SECONDS,
+                first=DRAFTS_FLUSH_SECONDS,
+                name='handle_drafts_flush'
+            )
+        if run_jobs:
+            self.register_periodic_jobs()
+
+    def register_periodic_jobs(self) -> None:
+        """Jobs working with orders and outbox, they run only while the process holds the lease"""
+        self.job_queue.run_repeating(
+            self.lease.heartbeat,
+            interval=self.lease.heartbeat_seconds,
+            first=0,
+            name='lease_heartbeat'
+        )
+
+        self.job_queue.run_repeating(
+            self.lease.leader_only(self.handle_warning_orders),
             interval=60,
-            first=20,
-            name='handle_warning_orders_not_closed'
+            first=10,
+            name='handle_warning_orders'
         )
 
         self.job_queue.run_repeating(
-            self.handle_new_orders_inform,
+            self.lease.leader_only(self.handle_new_orders_inform),
             interval=60,
             first=30,
-            name='handle_warning_orders_not_closed'
+            name='handle_new_orders_inform'
+        )
+
+        self.job_queue.run_repeating(
+            self.lease.leader_only(self.handle_outbox_dispatch),
+            interval=DISPATCH_INTERVAL_SECONDS,
+            first=DISPATCH_INTERVAL_SECONDS,
+            name='handle_outbox_dispatch'
+        )
+
+        self.job_queue.run_repeating(
+            self.lease.leader_only(self.handle_outbox_purge),
+            interval=60 * 60,
+            first=60,
+            name='handle_outbox_purge'
         )
 
+        self.job_queue.run_repeating(
+            self.lease.leader_only(self.handle_archive_orders),
+            interval=60 * 60 * 24,
+            first=60 * 60,
+            name='handle_archive_orders'
+        )
+
+    def answer_callback_query(self, handler: Callable) -> Callable:
+        """Decorator which answers callback query before the update is processed"""
+
+        def wrapper(update: Update, context: CallbackContext):
+            # replay of a kept callback was answered when it came first
+            if update.callback_query is not None and not self.throttler.is_pending(update):
+                try:
+                    update.callback_query.answer()
+                except TelegramError as error:
+                    # e.g. the query is too old after a long downtime, the update is processed anyway
+                    logger.error(f'callback query of {update.effective_user.id} was not answered: {error}')
+            return handler(update, context)
+
+        return wrapper
+
     def handle_users_reply(self, update: Update, context: CallbackContext) -> None:
         """
         State machine of bot.
 
         Current state of user record to DB
         """
-        user = context.user_data['user']
+        user = context.user_data.user
 
         if user is None:
             self.states_functions['unknown']['START'](update, context)
@@ -138,115 +269,221 @@ class TgBot(object):
         """help handler"""
         update.message.reply_text("Используйте /start для того, что бы перезапустить бот")
 
-    def handle_warning_orders_not_in_work(self, context: CallbackContext) -> None:
-        """If there are an overdue created orders they should be sent to every manager"""
-        warning_orders_not_in_work = Order.objects.get_warning_orders_not_in_work()
-        if not warning_orders_not_in_work:  # если не будет просроченных заказов, то не отправляем
+    def search_handler(self, update: Update, context: CallbackContext) -> None:
+        """Search orders by words of task for managers and owners, state of the user is not changed"""
+        user = context.user_data.user
+        if user is None or user.role not in [BotUser.Role.manager, BotUser.Role.owner]:
+            update.message.reply_text('Поиск заказов доступен менеджерам и владельцу')
             return
-        message = 'Есть заказы, которые долго не берут в работу\n\n' + '\n'.join(
-            [
-                f'Задача: {order.task} \nКонтакт клиента: @{order.client.tg_nick}\n\n'
-                for order in warning_orders_not_in_work
-            ]
-        )
-        managers = Manager.objects.active()
-        for manager in managers:
-            context.bot.send_message(text=message, chat_id=manager.telegram_id)
-        warning_orders_not_in_work.update(not_in_work_manager_informed=True)
-
-    def handle_warning_orders_not_closed(self, context: CallbackContext) -> None:
-        """If there are an overdue in work orders they should be sent to every manager"""
-        warning_orders_not_closed = Order.objects.get_warning_orders_not_closed()
-        if not warning_orders_not_closed:  # если не будет просроченных заказов, то не отправляем
+        if not context.args:
+            update.message.reply_text('Напишите слова из задания после команды, например: /search ошибка сайта')
             return
-        message = 'Есть заказы, которые не выполнены\n\n' + '\n'.join(
-            [
-                f'Задача: {order.task}\nКонтакт подрядчика: @{order.contractor.tg_nick}\nКонтакт клиента: @{order.client.tg_nick}\n\n'
-                for order in warning_orders_not_closed
-            ]
+        orders = list(
+            Order.objects.search_task(' '.join(context.args)).select_related('client')[:SEARCH_RESULTS_LIMIT]
         )
-        managers = Manager.objects.active()
-        for manager in managers:
-            context.bot.send_message(text=message, chat_id=manager.telegram_id)
-        warning_orders_not_closed.update(late_work_manager_informed=True)
+        for message in build_search_results(orders):
+            update.message.reply_text(message)
 
-    def handle_new_orders_inform(self, context: CallbackContext) -> None:
-        """If there are a new orders contractors should be informed"""
-        new_orders = Order.objects.get_available_not_informed_all().select_related(
-            'client',
-            'client__tariff',
+    def handle_warning_orders(self, context: CallbackContext) -> None:
+        """Overdue created and in work orders are sent to every manager in one digest"""
+        warning_orders_not_in_work = list(
+            Order.objects.get_warning_orders_not_in_work().select_related('client')
+        )
+        warning_orders_not_closed = list(
+            Order.objects.get_warning_orders_not_closed().select_related('client', 'contractor')
         )
-        available_contractors = Contractor.objects.get_available()
+        # если не будет просроченных заказов, то не отправляем
+        if not warning_orders_not_in_work and not warning_orders_not_closed:
+            return
 
+        digest = build_manager_digest(warning_orders_not_in_work, warning_orders_not_closed)
+        managers_chat_ids = list(Manager.objects.active().values_list('telegram_id', flat=True))
+        with atomic():
+            # parts are enqueued one by one for all managers, so every manager gets them in order
+            for digest_part in digest:
+                OutboxMessage.objects.enqueue(managers_chat_ids, digest_part)
+            Order.objects.filter(
+                pk__in=[order.pk for order in warning_orders_not_in_work]
+            ).update(not_in_work_manager_informed=True)
+            Order.objects.filter(
+                pk__in=[order.pk for order in warning_orders_not_closed]
+            ).update(late_work_manager_informed=True)
+
+    def handle_new_orders_inform(self, context: CallbackContext) -> None:
+        """If there are a new orders contractors should be informed, the best ones first"""
+        order_ids = self.new_orders_schedule.collect(self.lease.term)
+        if not order_ids:
+            self.new_orders_schedule.save_watermark()
+            return
+        not_processed_ids = set(order_ids)
         try:
-            assigned_contractors_limit = SystemSettings.objects.get(
-                'ASSIGNED_CONTRACTORS_TIME_LIMIT'
-            ).parameter_value
-            assigned_contractors_limit = int(assigned_contractors_limit) / 100
-        except (SystemSettings.DoesNotExist, ValueError):
-            assigned_contractors_limit = 0.2
-
-        # it can be not optimal if many new orders but it should be about 5 orders in hour
-        # so it not a big chance to have more then 2 orders simultaneously
-        # also it send message to many contractors but telegram don't have bulk message :(
-        for new_order in new_orders:
-            # only send message without button
-            # because contractor can do anything and button can broke his process
-            message = dedent(f'''
-            Появился новый заказ, для взятие в работу нажмите "Посмотреть заказы"
-            и выберите данный заказ:
-
-            Задание:
-            {new_order.task}
-            ''')
-            client = new_order.client
-            if not client.contractors.all():
-                # if no assigned contractors then send all available and mark then
-                # send both - assigned and all
-                for contractor in available_contractors:
-                    contractor_chat_id = contractor.telegram_id
-                    context.bot.send_message(text=message, chat_id=contractor_chat_id)
-                with atomic():
-                    new_order.assigned_contractors_informed = True
-                    new_order.all_contractors_informed = True
-                    new_order.save()
-            else:
-                self.process_new_order_with_contractors(
-                    context,
-                    new_order,
-                    client,
-                    assigned_contractors_limit,
-                    message,
-                )
+            # tariffs are taken from the process tariff table, no join needed
+            new_orders = list(
+                Order.objects.get_available_not_informed_all().filter(pk__in=order_ids).select_related('client')
+            )
+            # orders taken or informed meanwhile are not due anymore
+            not_processed_ids = {new_order.pk for new_order in new_orders}
+            self.contractor_ranker.refresh()
+            ranked_contractors = self.contractor_ranker.rank(Contractor.objects.get_available())
+
+            assigned_contractors_limit = SystemSettings.objects.get_int('ASSIGNED_CONTRACTORS_TIME_LIMIT', 20) / 100
+            top_k = max(SystemSettings.objects.get_int('MATCHING_TOP_K', 3), 1)
+            wave_share = max(SystemSettings.objects.get_int('MATCHING_WAVE_PERCENT', 10), 1) / 100
+
+            # messages are written to outbox in the same transaction as order flags and sent by dispatcher
+            for new_order in new_orders:
+                # only send message without button
+                # because contractor can do anything and button can broke his process
+                message = dedent(f'''
+                Появился новый заказ, для взятие в работу нажмите "Посмотреть заказы"
+                и выберите данный заказ:
+
+                Задание:
+                {new_order.task}
+                ''')
+                client = new_order.client
+                reaction_time = timedelta(minutes=client.tariff.reaction_time_minutes)
+                assigned_contractors = list(client.contractors.select_related('contractor'))
+                if not assigned_contractors:
+                    # if no assigned contractors then inform available ones by waves from order creation
+                    next_inform_at = self.inform_contractors_wave(
+                        new_order,
+                        ranked_contractors,
+                        new_order.created_at,
+                        reaction_time * wave_share,
+                        top_k,
+                        message,
+                    )
+                else:
+                    next_inform_at = self.process_new_order_with_contractors(
+                        new_order,
+                        assigned_contractors,
+                        ranked_contractors,
+                        assigned_contractors_limit,
+                        (reaction_time * wave_share, top_k),
+                        message,
+                    )
+                self.new_orders_schedule.schedule(new_order.pk, next_inform_at)
+                not_processed_ids.discard(new_order.pk)
+        finally:
+            # collect() took them from the schedule, after an error they would wait for the hourly resync
+            self.new_orders_schedule.retry(not_processed_ids)
+            self.new_orders_schedule.save_watermark()
+
+    def handle_outbox_dispatch(self, context: CallbackContext) -> None:
+        """Send messages written to outbox while the process holds the lease"""
+        dispatch_outbox(context.bot, is_leader=self.lease.is_held)
+
+    def handle_outbox_purge(self, context: CallbackContext) -> None:
+        """Keep outbox small"""
+        purge_outbox()
+
+    def handle_throttle_stats(self, context: CallbackContext) -> None:
+        """Log shed updates counters and forget idle chats"""
+        counters = self.throttler.pop_counters()
+        shed_counters = {
+            f'{event} {role}': count
+            for (event, role), count in sorted(counters.items())
+            if event not in ('admitted', 'relayed')
+        }
+        if shed_counters:
+            logger_info.info(f'throttled updates: {shed_counters}')
+        self.throttler.prune()
+
+    def handle_idle_chats(self, context: CallbackContext) -> None:
+        """Forget conversation data of idle chats, their drafts are loaded again on the next update"""
+        pruned_count = self.chat_contexts.prune()
+        if pruned_count:
+            logger_info.info(f'{pruned_count} idle chats were forgotten, {len(self.chat_contexts)} are kept')
+        if self.chat_contexts.drafts is not None:
+            self.chat_contexts.drafts.purge()
+
+    def handle_drafts_flush(self, context: CallbackContext) -> None:
+        """Save changed drafts of conversations in one batch"""
+        self.chat_contexts.flush_drafts()
+
+    def handle_archive_orders(self, context: CallbackContext) -> None:
+        """Move old closed and cancelled orders out of the hot orders table"""
+        billing_periods = SystemSettings.objects.get_int('ARCHIVE_BILLING_PERIODS', 3)
+        archived_count = Order.objects.archive(billing_periods)
+        logger_info.info(f'{archived_count} orders were archived')
 
     def process_new_order_with_contractors(
             self,
-            context: CallbackContext,
             new_order: Order,
-            client: Client,
+            assigned_contractors: list[AssignedContractor],
+            ranked_contractors: list[Contractor],
             assigned_contractors_limit: float,
+            wave_params: tuple[timedelta, int],
             message: str,
-    ):
+    ) -> Optional[datetime]:
+        """Inform assigned contractors first and others after their window, returns when to look again"""
         # check if time for assigned contractors or all
-        client_tariff_reaction_time_seconds = new_order.client.tariff.reaction_time_minutes * 60
-        seconds_from_created = (timezone.now() - new_order.created_at).total_seconds()
-        is_inform_only_assigned_contractors = False
-        if seconds_from_created / client_tariff_reaction_time_seconds < assigned_contractors_limit:
-            is_inform_only_assigned_contractors = True
+        client_tariff_reaction_time = timedelta(minutes=new_order.client.tariff.reaction_time_minutes)
+        all_contractors_inform_start = new_order.created_at + client_tariff_reaction_time * assigned_contractors_limit
+        is_inform_only_assigned_contractors = timezone.now() < all_contractors_inform_start
 
         # check that assigned contractors weren't informed too
         if is_inform_only_assigned_contractors and not new_order.assigned_contractors_informed:
-            for assigned_contractor in client.contractors.all():
-                contractor_chat_id = assigned_contractor.contractor.telegram_id
-                context.bot.send_message(text=message, chat_id=contractor_chat_id)
-                new_order.assigned_contractors_informed = True
-                new_order.save()
-        elif not is_inform_only_assigned_contractors:
-            # inform all contractors except assigned
-            for contractor in client.get_not_assigned_contractors():
-                contractor_chat_id = contractor.telegram_id
-                context.bot.send_message(text=message, chat_id=contractor_chat_id)
-                with atomic():
-                    new_order.assigned_contractors_informed = True  # just for be sure
-                    new_order.all_contractors_informed = True
-                    new_order.save()
+            with atomic():
+                # conditional update, the order could be taken in work after it was read
+                if not Order.objects.filter(pk=new_order.pk, status=Order.Status.created).update(
+                    assigned_contractors_informed=True,
+                ):
+                    return None
+                OutboxMessage.objects.enqueue(
+                    [assigned_contractor.contractor.telegram_id for assigned_contractor in assigned_contractors],
+                    message,
+                )
+            new_order.assigned_contractors_informed = True
+        if is_inform_only_assigned_contractors:
+            return all_contractors_inform_start
+
+        # inform contractors except assigned by waves
+        assigned_contractors_ids = {
+            assigned_contractor.contractor_id for assigned_contractor in assigned_contractors
+        }
+        wave_interval, top_k = wave_params
+        return self.inform_contractors_wave(
+            new_order,
+            [contractor for contractor in ranked_contractors if contractor.pk not in assigned_contractors_ids],
+            all_contractors_inform_start,
+            wave_interval,
+            top_k,
+            message,
+        )
+
+    def inform_contractors_wave(
+            self,
+            new_order: Order,
+            ranked_contractors: list[Contractor],
+            phase_start: datetime,
+            wave_interval: timedelta,
+            top_k: int,
+            message: str,
+    ) -> Optional[datetime]:
+        """Inform next top contractors if it is time for the next wave, returns when the next wave starts"""
+        contractors_to_inform, informed_waves, is_all_informed = plan_inform_wave(
+            ranked_contractors,
+            new_order.contractors_inform_wave,
+            phase_start,
+            wave_interval,
+            top_k,
+            timezone.now(),
+        )
+        next_wave_at = None if is_all_informed else phase_start + wave_interval * informed_waves
+        if informed_waves == new_order.contractors_inform_wave:
+            return next_wave_at
+        with atomic():
+            # conditional update, the order could be taken in work after it was read
+            if not Order.objects.filter(pk=new_order.pk, status=Order.Status.created).update(
+                contractors_inform_wave=informed_waves,
+                assigned_contractors_informed=True,  # just for be sure
+                all_contractors_informed=is_all_informed,
+            ):
+                return None
+            OutboxMessage.objects.enqueue([contractor.telegram_id for contractor in contractors_to_inform], message)
+        new_order.contractors_inform_wave = informed_waves
+        new_order.assigned_contractors_informed = True
+        new_order.all_contractors_informed = is_all_informed
+        return next_wave_at
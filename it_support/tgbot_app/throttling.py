@@ -0,0 +1,170 @@
+import threading
+from collections import Counter
+from time import monotonic
+from typing import Callable
+from typing import Optional
+
+from telegram.ext.callbackcontext import CallbackContext
+from telegram.update import Update
+
+# (updates per second, burst), role is unknown until the first update of the chat reaches get_user
+DEFAULT_THROTTLE_RATES = {
+    'unknown': (0.5, 5),
+    'Клиент': (1, 8),
+    'Подрядчик': (1, 8),
+    'Менеджер': (2, 15),
+    'Владелец': (2, 15),
+}
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, now: float) -> bool:
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self) -> float:
+        return max(1 - self.tokens, 0) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class UpdateThrottler:
+    """
+    Per chat token bucket in front of the state machine, it doesn't touch the database.
+
+    Updates over the limit are shed: text messages are dropped, callbacks are coalesced,
+    only the last callback of a burst is kept and put back to the update queue
+    when the bucket has a token again. Messages of chat mode are not throttled,
+    they are relayed to the counterpart and an album comes as a burst of messages.
+    """
+
+    def __init__(self, rates: Optional[dict[str, tuple[float, float]]] = None):
+        self.rates = {**DEFAULT_THROTTLE_RATES, **(rates or {})}
+        self.lock = threading.Lock()
+        self.buckets: dict[int, TokenBucket] = {}
+        self.pending_callbacks: dict[int, Update] = {}
+        # counters by (event, role), event is admitted, relayed, dropped, coalesced or replayed
+        self.counters = Counter()
+
+    @staticmethod
+    def get_role(context: CallbackContext) -> str:
+        # role of the user from the previous update of this chat, see get_user
+        chat = context.user_data
+        return chat.role if chat is not None and chat.role is not None else 'unknown'
+
+    @staticmethod
+    def is_relayed(update: Update, context: CallbackContext) -> bool:
+        chat = context.user_data
+        return update.callback_query is None and chat is not None and chat.is_relaying
+
+    def get_bucket(self, chat_id: int, role: str, now: float) -> TokenBucket:
+        rate, capacity = self.rates.get(role, self.rates['unknown'])
+        bucket = self.buckets.get(chat_id)
+        if bucket is None or bucket.rate != rate or bucket.capacity != capacity:
+            bucket = TokenBucket(rate, capacity, now)
+            self.buckets[chat_id] = bucket
+        return bucket
+
+    def __call__(self, handler: Callable) -> Callable:
+        """Decorator for update handlers"""
+
+        def wrapper(update: Update, context: CallbackContext):
+            if update.effective_chat is None:
+                return handler(update, context)
+            chat_id = update.effective_chat.id
+            role = self.get_role(context)
+            if self.is_relayed(update, context):
+                with self.lock:
+                    self.counters['relayed', role] += 1
+                return handler(update, context)
+            now = monotonic()
+            with self.lock:
+                bucket = self.get_bucket(chat_id, role, now)
+                if bucket.try_take(now):
+                    pending_callback = self.pending_callbacks.get(chat_id)
+                    if pending_callback is update:
+                        del self.pending_callbacks[chat_id]
+                        self.counters['replayed', role] += 1
+                    elif pending_callback is not None and update.callback_query is not None:
+                        # newer callback goes first, the kept one is outdated now
+                        del self.pending_callbacks[chat_id]
+                        self.counters['coalesced', role] += 1
+                    self.counters['admitted', role] += 1
+                    is_admitted = True
+                else:
+                    is_admitted = False
+                    replay_after = self.shed(chat_id, role, update, bucket)
+            if is_admitted:
+                return handler(update, context)
+            if replay_after is not None:
+                context.job_queue.run_once(
+                    self.replay_pending_callback,
+                    replay_after,
+                    context=chat_id,
+                    name=f'replay_callback_{chat_id}',
+                )
+            return None
+
+        return wrapper
+
+    def is_pending(self, update: Update) -> bool:
+        """Is update the kept callback of its chat, it has passed handlers in front of the throttler once"""
+        if update.effective_chat is None:
+            return False
+        with self.lock:
+            return self.pending_callbacks.get(update.effective_chat.id) is update
+
+    def shed(self, chat_id: int, role: str, update: Update, bucket: TokenBucket) -> Optional[float]:
+        """Drop or coalesce update over the limit, returns delay to replay the kept callback if it is new"""
+        if update.callback_query is None:
+            self.counters['dropped', role] += 1
+            return None
+        previous_update = self.pending_callbacks.get(chat_id)
+        self.pending_callbacks[chat_id] = update
+        if previous_update is None or previous_update is update:
+            # first callback over the limit or its replay came too early
+            return bucket.seconds_until_token()
+        # replay of the previous one is already scheduled and will take this update instead
+        self.counters['coalesced', role] += 1
+        return None
+
+    def replay_pending_callback(self, context: CallbackContext) -> None:
+        """Put the last callback of a burst back to the update queue, it passes the throttler again"""
+        with self.lock:
+            update = self.pending_callbacks.get(context.job.context)
+        if update is not None:
+            context.dispatcher.update_queue.put(update)
+
+    def prune(self) -> int:
+        """Forget chats with full buckets, their state is the same as a new bucket"""
+        now = monotonic()
+        with self.lock:
+            idle_chat_ids = [
+                chat_id for chat_id, bucket in self.buckets.items()
+                if chat_id not in self.pending_callbacks and bucket.is_full(now)
+            ]
+            for chat_id in idle_chat_ids:
+                del self.buckets[chat_id]
+        return len(idle_chat_ids)
+
+    def pop_counters(self) -> Counter:
+        with self.lock:
+            counters, self.counters = self.counters, Counter()
+        return counters